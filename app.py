@@ -1,7 +1,26 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Flask, Response, render_template, request, redirect, url_for, session, flash, jsonify, g, has_request_context, send_from_directory
 import mysql.connector
+import bisect
+import click
+import csv
+import gzip
+import hashlib
+import heapq
+import io
+import json
+import mimetypes
 import os
+import queue
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
 from functools import wraps
+from jinja2 import nodes
+from jinja2.ext import Extension
 
 app = Flask(__name__)
 app.secret_key = os.urandom(24)
@@ -14,13 +33,2499 @@ db_config = {
     'database': 'firin_db'
 }
 
+# Bağlantı Havuzu Ayarları
+pool_config = {
+    'pool_size': 10,              # Sürekli açık tutulan bağlantı sayısı
+    'max_overflow': 10,           # Yoğunlukta geçici olarak açılabilecek ek bağlantı
+    'timeout': 5,                 # Boş bağlantı beklerken en fazla kaç saniye
+    'health_check_interval': 30   # Bu kadar saniye boşta kalan bağlantı kullanılmadan önce ping'lenir
+}
+
+class PoolTimeout(Exception):
+    pass
+
+class ConnectionPool:
+    def __init__(self, config, pool_size=10, max_overflow=10, timeout=5, health_check_interval=30):
+        self.config = config
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._idle = []      # (bağlantı, son kullanım zamanı)
+        self._open = 0       # Havuzun açtığı toplam bağlantı (boşta + kullanımda)
+        self._cond = threading.Condition()
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'reconnects': 0,
+            'wait_total': 0.0,
+            'wait_max': 0.0
+        }
+
+    def acquire(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        waited = False
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._open < self.pool_size + self.max_overflow:
+                    # Yeni bağlantı için yer ayır, bağlantıyı kilit dışında aç
+                    self._open += 1
+                    conn, last_used = None, None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout(f"{self.timeout} sn içinde boş bağlantı bulunamadı")
+                waited = True
+                self._cond.wait(remaining)
+
+        try:
+            if conn is None:
+                conn = mysql.connector.connect(**self.config)
+            elif time.monotonic() - last_used > self.health_check_interval and not self._is_alive(conn):
+                conn = mysql.connector.connect(**self.config)
+                with self._cond:
+                    self._stats['reconnects'] += 1
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+
+        wait = time.monotonic() - start
+        with self._cond:
+            self._stats['checkouts'] += 1
+            self._stats['wait_total'] += wait
+            self._stats['wait_max'] = max(self._stats['wait_max'], wait)
+            if waited: self._stats['waits'] += 1
+        return conn
+
+    def release(self, conn):
+        broken = False
+        try:
+            # Yarım kalan (commit edilmemiş) iş bir sonraki isteğe taşınmasın
+            conn.rollback()
+        except mysql.connector.Error:
+            broken = True
+
+        with self._cond:
+            if broken or len(self._idle) >= self.pool_size:
+                # Bozuk veya overflow bağlantısı: havuzda tutma
+                self._open -= 1
+                self._close_quietly(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            s = dict(self._stats)
+            s['open'] = self._open
+            s['idle'] = len(self._idle)
+            s['in_use'] = self._open - len(self._idle)
+        s['wait_avg_ms'] = round(s['wait_total'] * 1000 / s['checkouts'], 3) if s['checkouts'] else 0.0
+        s['wait_max_ms'] = round(s.pop('wait_max') * 1000, 3)
+        s['wait_total_ms'] = round(s.pop('wait_total') * 1000, 3)
+        return s
+
+    def _is_alive(self, conn):
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except mysql.connector.Error:
+            self._close_quietly(conn)
+            return False
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+# Tek bir istekte view ve context processor aynı sorgu sırasına girdiği için
+# "Unread result found" hatası almamak adına havuz bağlantıları buffered açılır.
+db_pool = ConnectionPool(dict(db_config, buffered=True), **pool_config)
+
+class RequestConnection:
+    # İstek boyunca paylaşılan bağlantı. View'ların çağırdığı close() bağlantıyı
+    # kapatmaz; eskisi gibi commit edilmemiş işi geri alır. Havuza iade teardown'da.
+    def __init__(self, conn):
+        self._conn = conn
+
+    def close(self):
+        if self._conn.in_transaction:
+            self._conn.rollback()
+
+    @property
+    def autocommit(self):
+        return self._conn.autocommit
+
+    @autocommit.setter
+    def autocommit(self, value):
+        self._conn.autocommit = value
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
 def get_db_connection():
+    # İlk çağrıda havuzdan bağlantı alınır, aynı istekteki sonraki çağrılar onu paylaşır
+    if 'db_conn' in g:
+        return g.db_conn
     try:
-        conn = mysql.connector.connect(**db_config)
-        return conn
-    except mysql.connector.Error as err:
+        conn = db_pool.acquire()
+    except (mysql.connector.Error, PoolTimeout) as err:
         print(f"Veritabanı başarısız: {err}")
         return None
+    g.db_conn = RequestConnection(conn)
+    return g.db_conn
+
+@app.teardown_appcontext
+def release_db_connection(exc):
+    rc = g.pop('db_conn', None)
+    if rc is not None:
+        db_pool.release(rc._conn)
+
+def _in_clause(values):
+    # IN (...) listesi için parametre yer tutucuları
+    return ', '.join(['%s'] * len(values))
+
+# --- ÖNBELLEK ---
+# Önbellek Ayarları
+cache_config = {
+    'version_check_interval': 5,   # Diğer worker'ların değişikliklerini en geç bu kadar saniyede fark et
+    'site_settings_ttl': 600,      # Sürüm değişmese de site ayarlarını bu kadar saniyede bir tazele
+    'cart_count_ttl': 300,         # Session'daki sepet sayacı bu kadar saniyeden eskiyse DB'den doğrulanır
+    'catalog_ttl': 3600,           # Kategori + ürün anlık görüntüsünün en uzun ömrü
+    'stock_ttl': 15                # Stok katmanının en uzun ömrü (sürüm satırı yok, bkz. stock_cache)
+}
+
+def read_cache_version(cursor, key):
+    cursor.execute("SELECT surum FROM onbellek_surum WHERE anahtar=%s", (key,))
+    row = cursor.fetchone()
+    if not row: return 0
+    return row['surum'] if isinstance(row, dict) else row[0]
+
+def bump_cache_version(cursor, key):
+    # Değişikliği yapan transaction içinde çağrılır; commit ile birlikte diğer worker'lara yayılır
+    cursor.execute("""
+        INSERT INTO onbellek_surum (anahtar, surum) VALUES (%s, 1)
+        ON DUPLICATE KEY UPDATE surum = surum + 1
+    """, (key,))
+
+class VersionedCache:
+    # Süreç içi önbellek. Değer en fazla `ttl` saniye tutulur; arada her
+    # `check_interval` saniyede bir onbellek_surum tablosundaki sürüm okunur ve
+    # değişmişse değer yeniden yüklenir. Böylece her render'da sorgu atılmaz.
+    # key=None verilirse sürüm satırı kullanılmaz, değer sadece TTL ile tazelenir.
+    def __init__(self, key, loader, ttl, check_interval=None):
+        self.key = key
+        self.loader = loader
+        self.ttl = ttl
+        if key is None:
+            self.check_interval = ttl
+        else:
+            self.check_interval = check_interval if check_interval is not None else cache_config['version_check_interval']
+        self._value = None
+        self._version = None
+        self._loaded_at = 0.0
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        now = time.monotonic()
+        if (self._version is not None and now - self._checked_at < self.check_interval
+                and now - self._loaded_at < self.ttl):
+            return self._value
+
+        with self._lock:
+            # Kilidi beklerken başka bir thread yüklemiş olabilir
+            now = time.monotonic()
+            if (self._version is not None and now - self._checked_at < self.check_interval
+                    and now - self._loaded_at < self.ttl):
+                return self._value
+
+            conn = get_db_connection()
+            if not conn: return self._value
+            try:
+                cursor = conn.cursor(dictionary=True)
+                version = read_cache_version(cursor, self.key) if self.key else 0
+                if version != self._version or now - self._loaded_at >= self.ttl:
+                    self._value = self.loader(cursor)
+                    self._loaded_at = now
+                self._version = version
+                self._checked_at = now
+            except mysql.connector.Error as err:
+                # Veritabanı geçici olarak yoksa eldeki (eski) değerle devam et
+                print(f"Önbellek yüklenemedi ({self.key}): {err}")
+            return self._value
+
+    @property
+    def version(self):
+        return self._version
+
+    def invalidate(self, cursor):
+        if self.key:
+            bump_cache_version(cursor, self.key)
+        if has_request_context():
+            # Yerel kopya, transaction commit edildikten sonra (istek sonunda) düşürülür
+            g.setdefault('stale_caches', set()).add(self)
+        else:
+            self.reset()
+
+    def reset(self):
+        self._version = None
+        self._checked_at = 0.0
+
+@app.teardown_request
+def reset_stale_caches(exc):
+    for cache in g.pop('stale_caches', ()):
+        cache.reset()
+
+def _load_site_settings(cursor):
+    cursor.execute("SELECT * FROM site_ayarlari WHERE id=1")
+    return cursor.fetchone() or {}
+
+site_settings_cache = VersionedCache('site_ayarlari', _load_site_settings, ttl=cache_config['site_settings_ttl'])
+
+# --- KATALOG ANLIK GÖRÜNTÜSÜ ---
+# Kategoriler ve ürünler sadece admin ürün işlemlerinde değişir; 'katalog' sürümüyle
+# önbelleğe alınır. Stok her siparişte değiştiği için ayrı bir katman olarak tutulur:
+# tek bir sürüm satırını her checkout'ta güncellemek o satırı darboğaz yapacağından
+# stok katmanı kısa TTL ile tazelenir, bu süreçteki stok değişikliklerinde ise hemen düşürülür.
+def _load_catalog(cursor):
+    cursor.execute("SELECT * FROM kategori ORDER BY id")
+    tum_kategoriler = cursor.fetchall()
+    kategori_adlari = {k['id']: k['ad'] for k in tum_kategoriler}
+
+    cursor.execute("""
+        SELECT u.*, p.yorum_sayisi, p.puan_toplam
+        FROM urun u
+        LEFT JOIN urun_puan p ON p.urun_id = u.id
+        ORDER BY u.kategori_id, u.id
+    """)
+    urunler = cursor.fetchall()
+    for u in urunler:
+        u['kategori_adi'] = kategori_adlari.get(u['kategori_id'])
+        puan_ozeti(u)
+
+    return {
+        'kategoriler': [k for k in tum_kategoriler if k['aktif']],
+        'kategori_adlari': kategori_adlari,
+        'urunler': {u['id']: u for u in urunler},
+        'aktif_urunler': [u for u in urunler if u['aktif'] and u['kategori_id'] in kategori_adlari]
+    }
+
+def _load_stock(cursor):
+    cursor.execute("SELECT urun_id, miktar, kritik_seviye FROM stok")
+    return {row['urun_id']: row for row in cursor.fetchall()}
+
+catalog_cache = VersionedCache('katalog', _load_catalog, ttl=cache_config['catalog_ttl'])
+stock_cache = VersionedCache(None, _load_stock, ttl=cache_config['stock_ttl'])
+
+def get_stok_miktari(urun_id, stoklar=None):
+    if stoklar is None:
+        stoklar = stock_cache.get() or {}
+    row = stoklar.get(urun_id)
+    return row['miktar'] if row else None
+
+_catalog_view = {'katalog': None, 'stoklar': None, 'urunler': [], 'gruplar': {}}
+
+def with_stok_kovasi(urun, stoklar):
+    row = stoklar.get(urun['id'])
+    miktar = row['miktar'] if row else None
+    return dict(urun, stok_durumu=miktar, stok_kovasi=stok_kovasi(miktar, row['kritik_seviye'] if row else None))
+
+def get_catalog_products():
+    # Aktif ürünler + stok katmanı. Birleştirilmiş liste, iki katmandan biri
+    # yenilenene kadar istekler arasında paylaşılır (şablonlar sadece okur).
+    # gruplar: kategori_id -> {'urunler': [...], 'puana_gore': [...], 'imza': stok kovaları};
+    # imza, kategori bloğunun parça önbelleği anahtarında kullanılır.
+    katalog = catalog_cache.get()
+    if katalog is None: return None, None, None
+    stoklar = stock_cache.get() or {}
+    view = _catalog_view
+    if view['katalog'] is not katalog or view['stoklar'] is not stoklar:
+        urunler = [with_stok_kovasi(u, stoklar) for u in katalog['aktif_urunler']]
+        gruplar = {}
+        for u in urunler:
+            gruplar.setdefault(u['kategori_id'], {'urunler': [], 'imza': ()})['urunler'].append(u)
+        for grup in gruplar.values():
+            grup['imza'] = tuple(u['stok_kovasi'] for u in grup['urunler'])
+            grup['puana_gore'] = sorted(grup['urunler'], key=puan_sirasi)
+        view.update(katalog=katalog, stoklar=stoklar, urunler=urunler, gruplar=gruplar)
+    return katalog['kategoriler'], view['urunler'], view['gruplar']
+
+# --- ŞABLON PARÇA ÖNBELLEĞİ ---
+# Ürün kartları ve kategori blokları sadece ürün (ad, fiyat, resim...) ya da stok
+# durumu değişince değişir. Şablonlarda {% cache 'urun_kart', urun.id, urun.stok_kovasi %}
+# ... {% endcache %} ile işaretlenen parçalar bir kez render edilip süreç içinde
+# tutulur. Anahtara katalog sürümü otomatik eklenir; admin ürün işlemleri
+# catalog_cache.invalidate() ile sürümü artırdığı için eski parçalar kendiliğinden
+# geçersiz olur. Kullanıcıya özel kısımlar (sepet rozeti, oturum) parçaların dışında kalmalı.
+fragment_cache_config = {
+    'enabled': True,
+    'max_entries': 2000
+}
+
+def stok_kovasi(miktar, kritik_seviye=None):
+    # Kartlarda stok adedi değil durumu gösterilir; parça anahtarı da bu yüzden kovayla kurulur
+    if miktar is None: return 'bilinmiyor'
+    if miktar <= 0: return 'yok'
+    if kritik_seviye is not None and miktar <= kritik_seviye: return 'az'
+    return 'var'
+
+class FragmentCache:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.surum = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_render(self, parcalar, render):
+        surum = catalog_cache.version
+        if not fragment_cache_config['enabled'] or surum is None:
+            # Katalog sürümü bilinmiyorsa (DB yok, önbellek sıfırlandı) önbelleğe alma
+            return render()
+        anahtar = (surum,) + tuple(parcalar)
+        with self.lock:
+            if surum != self.surum:
+                self.entries.clear()
+                self.surum = surum
+            html = self.entries.get(anahtar)
+            if html is not None:
+                self.entries.move_to_end(anahtar)
+                self.hits += 1
+                return html
+            self.misses += 1
+
+        html = render()
+        with self.lock:
+            if self.surum == surum:
+                self.entries[anahtar] = html
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        return html
+
+    def stats(self):
+        with self.lock:
+            return {'kayit': len(self.entries), 'surum': self.surum, 'isabet': self.hits, 'iska': self.misses}
+
+fragment_cache = FragmentCache(fragment_cache_config['max_entries'])
+
+class FragmentCacheExtension(Extension):
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        parcalar = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            parcalar.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render', [nodes.List(parcalar)]), [], [], body).set_lineno(lineno)
+
+    def _render(self, parcalar, caller):
+        return fragment_cache.get_or_render(parcalar, caller)
+
+app.jinja_env.add_extension(FragmentCacheExtension)
+
+# --- KOŞULLU GET (ETag) ---
+# Katalog sayfaları için ucuz bir doğrulayıcı: katalog/yorum/site ayarı sürümleri
+# (süreç içi), stok durumu (stok katmanı) ve sayfanın oturuma bağlı kısımları
+# (kullanıcı, rol, sepet rozeti) özetlenir. İstemcinin If-None-Match'i tutarsa
+# ağır sorgular ve render yapılmadan 304 döner. Kullanıcıya özel durumlar
+# (favori, yorum izni) doğrulayıcıya eklenmeden önce okunur, bu yüzden farklı
+# kullanıcılar ya da değişen durum aynı ETag'i üretmez.
+review_version_cache = VersionedCache('yorum', lambda cursor: True, ttl=cache_config['catalog_ttl'])
+
+def page_etag(*parcalar):
+    if session.get('_flashes'):
+        # Bekleyen flash mesajları sayfada gösterilecek; bu yanıt tekrar kullanılamaz
+        return None
+    if session.get('rol') == 'MUSTERI':
+        yas = time.time() - session.get('sepet_count_at', 0)
+        if 'sepet_count' not in session or yas > cache_config['cart_count_ttl']:
+            # Rozet render sırasında DB'den tazelenecek; önceden bilinmiyor
+            return None
+    site_settings_cache.get()
+    ortak = (site_settings_cache.version, session.get('user_id'), session.get('rol'),
+             session.get('k_adi'), session.get('ad_soyad'), session.get('sepet_count'))
+    return hashlib.sha1(repr(ortak + parcalar).encode('utf-8')).hexdigest()[:24]
+
+def not_modified(etag):
+    if etag and etag in request.if_none_match:
+        resp = Response(status=304)
+        resp.set_etag(etag)
+        resp.cache_control.private = True
+        resp.cache_control.no_cache = True
+        return resp
+    return None
+
+def with_etag(body, etag):
+    resp = app.make_response(body)
+    if etag:
+        resp.set_etag(etag)
+        # Oturuma göre değiştiği için paylaşılan önbelleklerde tutulmaz; her seferinde doğrulanır
+        resp.cache_control.private = True
+        resp.cache_control.no_cache = True
+    return resp
+
+# --- ÜRÜN PUANLARI ---
+# Ortalama puan her sayfada AVG(puan) ile hesaplanmaz; urun_puan tablosunda onaylı
+# yorumların sayısı ve puan toplamı tutulur. Yorumu ekleyen/onaylayan/silen
+# transaction tabloyu da günceller ve katalog sürümünü artırır; böylece puanlar
+# katalog anlık görüntüsüyle birlikte gelir, puana göre sıralama bellekte yapılır.
+def adjust_urun_puan(cursor, urun_id, adet, puan):
+    cursor.execute("""
+        INSERT INTO urun_puan (urun_id, yorum_sayisi, puan_toplam) VALUES (%s, %s, %s)
+        ON DUPLICATE KEY UPDATE yorum_sayisi = yorum_sayisi + VALUES(yorum_sayisi),
+                                puan_toplam = puan_toplam + VALUES(puan_toplam)
+    """, (urun_id, adet, adet * puan))
+
+def puan_ozeti(urun):
+    # urun sözlüğüne puan_ortalama ekler (yorum yoksa None)
+    sayi = urun.get('yorum_sayisi') or 0
+    urun['yorum_sayisi'] = sayi
+    urun['puan_ortalama'] = round(float(urun.get('puan_toplam') or 0) / sayi, 1) if sayi else None
+    return urun
+
+def puan_sirasi(urun):
+    # Puanı yüksek olan önce, eşitlikte yorum sayısı fazla olan; yorumsuzlar en sonda
+    if not urun.get('yorum_sayisi'):
+        return (1, 0, 0, urun['id'])
+    return (0, -urun['puan_toplam'] / urun['yorum_sayisi'], -urun['yorum_sayisi'], urun['id'])
+
+@app.cli.command('urun-puan-duzelt')
+def urun_puan_duzelt_command():
+    # urun_puan'ı yorum tablosundan yeniden hesaplar (kayma şüphesinde ya da ilk kurulumda)
+    conn = get_db_connection()
+    if not conn:
+        print("Veritabanı bağlantısı yok.")
+        return
+    try:
+        cursor = conn.cursor()
+        conn.start_transaction()
+        cursor.execute("SELECT urun_id FROM urun_puan FOR UPDATE")
+        cursor.fetchall()
+        cursor.execute("DELETE FROM urun_puan")
+        cursor.execute("""
+            INSERT INTO urun_puan (urun_id, yorum_sayisi, puan_toplam)
+            SELECT urun_id, COUNT(*), SUM(puan) FROM yorum WHERE onay_durumu = 1 GROUP BY urun_id
+        """)
+        adet = cursor.rowcount
+        catalog_cache.invalidate(cursor)
+        conn.commit()
+        print(f"{adet} ürünün puanı yeniden hesaplandı.")
+    finally:
+        conn.close()
+
+# --- ÜRÜN DETAYI ---
+# urun_detay verisi: ürün + kategori + stok katalog anlık görüntüsünden (yoksa tek
+# JOIN), kullanıcıya özel durumlar tek sorguda, yorumlar ise (tarih, id) üzerinden
+# keyset sayfalanarak okunur (ix_yorum_urun_onay_tarih).
+YORUM_SAYFA = 10
+
+def load_urun_detay(cursor, urun_id):
+    # Dönüş: (urun, kategori, stok, onbellekten); ürün yoksa urun None
+    katalog = catalog_cache.get()
+    urun = katalog['urunler'].get(urun_id) if katalog else None
+    if urun:
+        return urun, {'ad': katalog['kategori_adlari'].get(urun['kategori_id'])}, get_stok_miktari(urun_id) or 0, True
+
+    # Önbellekte yok (başka worker'da yeni eklenmiş olabilir): tek gidişte oku
+    cursor.execute("""
+        SELECT u.*, k.ad AS kategori_ad, s.miktar AS stok_miktar, p.yorum_sayisi, p.puan_toplam
+        FROM urun u
+        LEFT JOIN kategori k ON k.id = u.kategori_id
+        LEFT JOIN stok s ON s.urun_id = u.id
+        LEFT JOIN urun_puan p ON p.urun_id = u.id
+        WHERE u.id=%s
+    """, (urun_id,))
+    urun = cursor.fetchone()
+    if not urun:
+        return None, None, 0, False
+    kategori = {'ad': urun.pop('kategori_ad')}
+    stok = urun.pop('stok_miktar') or 0
+    return puan_ozeti(urun), kategori, stok, False
+
+def fetch_urun_kullanici_durumu(cursor, urun_id, musteri_id):
+    # Favori mi, yorum yapabilir mi (iptal/red dışı bir siparişte aldı mı): tek gidiş
+    cursor.execute("""
+        SELECT
+            EXISTS(SELECT 1 FROM favoriler WHERE musteri_id=%s AND urun_id=%s) AS favoride,
+            EXISTS(
+                SELECT 1
+                FROM siparis_detay sd
+                JOIN siparis s ON s.id = sd.siparis_id
+                WHERE s.musteri_id=%s AND sd.urun_id=%s AND s.durum NOT IN ('IPTAL_EDILDI','REDDEDILDI')
+            ) AS yorum_izni
+    """, (musteri_id, urun_id, musteri_id, urun_id))
+    row = cursor.fetchone()
+    return bool(row and row['favoride']), bool(row and row['yorum_izni'])
+
+def fetch_urun_yorumlari(cursor, urun_id, once=None):
+    # Onaylı yorumlardan bir sayfa; dönüş (yorumlar, sonraki imleç)
+    kosullar = ["y.urun_id=%s", "y.onay_durumu=1"]
+    params = [urun_id]
+    if once and '_' in once:
+        once_tarih, once_id = once.rsplit('_', 1)
+        kosullar.append("(y.tarih < %s OR (y.tarih = %s AND y.id < %s))")
+        params += [once_tarih, once_tarih, int(once_id) if once_id.isdigit() else 0]
+    cursor.execute(f"""
+        SELECT y.id, y.puan, y.metin, y.tarih, y.onay_durumu, m.ad, m.soyad
+        FROM yorum y
+        JOIN musteri m ON y.musteri_id = m.id
+        WHERE {" AND ".join(kosullar)}
+        ORDER BY y.tarih DESC, y.id DESC
+        LIMIT %s
+    """, params + [YORUM_SAYFA + 1])
+    yorumlar = cursor.fetchall()
+    sonraki = None
+    if len(yorumlar) > YORUM_SAYFA:
+        yorumlar = yorumlar[:YORUM_SAYFA]
+        son = yorumlar[-1]
+        sonraki = f"{son['tarih']}_{son['id']}"
+    return yorumlar, sonraki
+
+def fetch_bekleyen_yorumlarim(cursor, urun_id, musteri_id):
+    # Müşterinin henüz onaylanmamış kendi yorumları (sadece ona, ilk sayfanın başında gösterilir)
+    cursor.execute("""
+        SELECT y.id, y.puan, y.metin, y.tarih, y.onay_durumu, m.ad, m.soyad
+        FROM yorum y
+        JOIN musteri m ON y.musteri_id = m.id
+        WHERE y.urun_id=%s AND y.onay_durumu=0 AND y.musteri_id=%s
+        ORDER BY y.tarih DESC, y.id DESC
+    """, (urun_id, musteri_id))
+    return cursor.fetchall()
+
+# --- ÜRÜN ARAMA ---
+# Ürün adı ve açıklaması üzerinde süreç içi ters indeks. Katalog anlık görüntüsü
+# değiştiğinde sadece değişen ürünler yeniden indekslenir.
+_TR_KATLAMA = str.maketrans({'ı': 'i', 'ş': 's', 'ğ': 'g', 'ç': 'c', 'ö': 'o', 'ü': 'u', 'â': 'a', 'î': 'i', 'û': 'u'})
+
+def fold_tr(text):
+    # 'İ'.lower() birleşik nokta ürettiği için önce elle çevrilir
+    return (text or '').replace('İ', 'i').lower().translate(_TR_KATLAMA)
+
+def tokenize_tr(text):
+    return re.findall(r'\w+', fold_tr(text))
+
+def _edit_distance(a, b, max_d):
+    # Sınırlı Damerau-Levenshtein; max_d aşılınca erken döner
+    if abs(len(a) - len(b)) > max_d: return max_d + 1
+    prev2, prev = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if prev2 is not None and i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        if min(cur) > max_d: return max_d + 1
+        prev2, prev = prev, cur
+    return prev[-1]
+
+def _deletes(term):
+    return {term[:i] + term[i + 1:] for i in range(len(term))}
+
+class SearchIndex:
+    NAME_WEIGHT = 10.0      # Addaki eşleşme açıklamadakinin her zaman önüne geçer
+    DESC_WEIGHT = 1.0
+    PREFIX_FACTOR = 0.8
+    TYPO_FACTOR = 0.5
+    MAX_PREFIX_TERMS = 50   # Çok kısa öneklerde taranacak terim sayısı sınırı
+
+    def __init__(self):
+        self._docs = {}        # urun_id -> (ad, aciklama) indekslenen hali
+        self._names = {}       # urun_id -> katlanmış ad (eşit puanda sıralama için)
+        self._postings = {}    # terim -> {urun_id: ağırlık}
+        self._terms = []       # sıralı sözlük (önek araması için)
+        self._deletes = {}     # tek harf silinmiş varyant -> {terim} (yazım hatası için)
+        self._katalog = None
+        self._lock = threading.Lock()
+
+    def sync(self, katalog):
+        if katalog is self._katalog: return
+        with self._lock:
+            if katalog is self._katalog: return
+            guncel = {uid: (u['ad'], u['aciklama'])
+                      for uid, u in katalog['urunler'].items() if u['aktif']}
+            for uid in [uid for uid in self._docs if uid not in guncel]:
+                self._remove(uid)
+            for uid, doc in guncel.items():
+                if self._docs.get(uid) != doc:
+                    self._remove(uid)
+                    self._add(uid, doc)
+            self._katalog = katalog
+
+    def _add(self, uid, doc):
+        ad, aciklama = doc
+        agirliklar = {}
+        for t in set(tokenize_tr(ad)):
+            agirliklar[t] = agirliklar.get(t, 0) + self.NAME_WEIGHT
+        for t in set(tokenize_tr(aciklama)):
+            agirliklar[t] = agirliklar.get(t, 0) + self.DESC_WEIGHT
+        for t, w in agirliklar.items():
+            if t not in self._postings:
+                self._postings[t] = {}
+                bisect.insort(self._terms, t)
+                for d in _deletes(t):
+                    self._deletes.setdefault(d, set()).add(t)
+            self._postings[t][uid] = w
+        self._docs[uid] = doc
+        self._names[uid] = fold_tr(ad)
+
+    def _remove(self, uid):
+        doc = self._docs.pop(uid, None)
+        if doc is None: return
+        self._names.pop(uid, None)
+        for t in set(tokenize_tr(doc[0])) | set(tokenize_tr(doc[1])):
+            posting = self._postings.get(t)
+            if posting is None: continue
+            posting.pop(uid, None)
+            if not posting:
+                del self._postings[t]
+                del self._terms[bisect.bisect_left(self._terms, t)]
+                for d in _deletes(t):
+                    bucket = self._deletes.get(d)
+                    if bucket:
+                        bucket.discard(t)
+                        if not bucket: del self._deletes[d]
+
+    def _expand(self, qt):
+        # Sorgu terimini sözlükteki terimlere genişlet: tam > önek > yazım hatası
+        eslesen = {}
+        if qt in self._postings:
+            eslesen[qt] = 1.0
+        if len(qt) >= 2:
+            i = bisect.bisect_left(self._terms, qt)
+            for t in self._terms[i:i + self.MAX_PREFIX_TERMS]:
+                if not t.startswith(qt): break
+                eslesen.setdefault(t, self.PREFIX_FACTOR)
+        if len(qt) >= 4 and qt[-1] in 'kptc':
+            # Ünsüz yumuşaması: börek -> böreği, ağaç -> ağacı
+            kok = qt[:-1]
+            i = bisect.bisect_left(self._terms, kok)
+            for t in self._terms[i:i + self.MAX_PREFIX_TERMS]:
+                if not t.startswith(kok): break
+                if len(t) > len(kok) and t[len(kok)] in 'gbdc':
+                    eslesen.setdefault(t, self.PREFIX_FACTOR)
+        if not eslesen and len(qt) >= 4:
+            max_d = 1 if len(qt) < 8 else 2
+            # Eksik harf, fazla harf, yanlış harf ve yer değiştirme adayları
+            adaylar = set()
+            for d in _deletes(qt) | {qt}:
+                if d in self._postings: adaylar.add(d)
+                adaylar |= self._deletes.get(d, set())
+            for t in adaylar:
+                if _edit_distance(qt, t, max_d) <= max_d:
+                    eslesen[t] = self.TYPO_FACTOR
+        return eslesen
+
+    def search(self, query, limit=100):
+        terimler = tokenize_tr(query)
+        if not terimler: return []
+        with self._lock:
+            puanlar = None
+            for qt in terimler:
+                terim_puani = {}
+                for t, katsayi in self._expand(qt).items():
+                    for uid, w in self._postings[t].items():
+                        p = w * katsayi
+                        if p > terim_puani.get(uid, 0):
+                            terim_puani[uid] = p
+                # Her sorgu terimi eşleşmeli (AND)
+                if puanlar is None:
+                    puanlar = terim_puani
+                else:
+                    puanlar = {uid: puanlar[uid] + p for uid, p in terim_puani.items() if uid in puanlar}
+                if not puanlar: return []
+            return heapq.nsmallest(limit, puanlar, key=lambda uid: (-puanlar[uid], self._names[uid]))
+
+search_index = SearchIndex()
+
+# --- OLAY KUTUSU (OUTBOX) ---
+# Sipariş yan etkileri (siparis_durum_log, stok_hareketi, kupon_kullanim) istek
+# transaction'ında tek bir olay_kutusu satırı olarak yazılır; arka plan worker'ı
+# bunları toplu olarak hedef tablolara aktarır. Her kayıt "olay_id:sıra" anahtarıyla
+# yazıldığı için aynı olay tekrar işlense bile kayıt çoğalmaz (en az bir kez teslim).
+# Worker yalnızca 'python app.py' altında uygulama içinde başlar; flask run / WSGI
+# dağıtımlarında 'flask outbox-worker' ayrı süreç olarak çalıştırılmalıdır.
+outbox_config = {
+    'batch_size': 500,       # Bir transaction'da işlenecek en fazla olay
+    'poll_interval': 1.0,    # Kuyruk boşken bekleme süresi (sn)
+    'run_in_app': True,      # python app.py ile çalışırken worker thread'i uygulama içinde başlat
+    'max_deneme': 5          # Tek tek denemede bu kadar başarısız olan olay HATALI'ya alınır
+}
+
+def enqueue_event(cursor, olay_tipi, loglar=(), stok_hareketleri=(), kupon_kullanimlari=()):
+    # loglar: (siparis_id, eski_durum, yeni_durum, degistiren_id, aciklama)
+    # stok_hareketleri: (urun_id, siparis_id, hareket_tipi, miktar, aciklama, yapan_id)
+    # kupon_kullanimlari: (kupon_kod, musteri_id, siparis_id)
+    yuk = {
+        'siparis_durum_log': [list(r) for r in loglar],
+        'stok_hareketi': [list(r) for r in stok_hareketleri],
+        'kupon_kullanim': [list(r) for r in kupon_kullanimlari]
+    }
+    cursor.execute("INSERT INTO olay_kutusu (olay_tipi, yuk) VALUES (%s, %s)", (olay_tipi, json.dumps(yuk)))
+
+def _outbox_satirlari(olay_id, yuk, olusturma, loglar, hareketler, kuponlar):
+    yuk = json.loads(yuk)
+    sira = 0
+    for siparis_id, eski, yeni, degistiren_id, aciklama in yuk.get('siparis_durum_log', []):
+        sira += 1
+        loglar.append((siparis_id, eski, yeni, degistiren_id, aciklama, olusturma, f"{olay_id}:{sira}"))
+    for urun_id, siparis_id, tip, miktar, aciklama, yapan_id in yuk.get('stok_hareketi', []):
+        sira += 1
+        hareketler.append((urun_id, siparis_id, tip, miktar, aciklama, yapan_id, olusturma, f"{olay_id}:{sira}"))
+    kuponlar += [tuple(k) for k in yuk.get('kupon_kullanim', [])]
+
+def _write_outbox_events(cursor, olaylar):
+    loglar, hareketler, kuponlar = [], [], []
+    for olay_id, yuk, olusturma in olaylar:
+        _outbox_satirlari(olay_id, yuk, olusturma, loglar, hareketler, kuponlar)
+
+    if loglar:
+        cursor.executemany("""
+            INSERT INTO siparis_durum_log (siparis_id, eski_durum, yeni_durum, degistiren_id, aciklama, tarih, olay_anahtari)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE id = id
+        """, loglar)
+    if hareketler:
+        cursor.executemany("""
+            INSERT INTO stok_hareketi (urun_id, siparis_id, hareket_tipi, miktar, aciklama, yapan_id, created_at, olay_anahtari)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE id = id
+        """, hareketler)
+    for kupon_kod, musteri_id, siparis_id in kuponlar:
+        # Siparişte kupon tek kez kullanılır; (kupon, sipariş) zaten varsa tekrar yazma
+        try:
+            cursor.execute("""
+                INSERT INTO kupon_kullanim (kupon_kod, musteri_id, siparis_id)
+                SELECT %s, %s, %s FROM DUAL
+                WHERE NOT EXISTS (SELECT 1 FROM kupon_kullanim WHERE kupon_kod=%s AND siparis_id=%s)
+            """, (kupon_kod, musteri_id, siparis_id, kupon_kod, siparis_id))
+        except mysql.connector.Error:
+            pass # Tablo yoksa olayı bekletme, kupon loglanmasın
+
+    ids = [o[0] for o in olaylar]
+    cursor.execute(f"DELETE FROM olay_kutusu WHERE id IN ({_in_clause(ids)})", ids)
+
+def _process_outbox_tek_tek(conn, ids):
+    # Toplu yazım başarısız oldu: olaylar tek tek denenir ki yazılamayan olay
+    # (ör. ürünü silinmiş stok hareketi, FK hatası) diğerlerini bekletmesin.
+    # max_deneme kez başarısız olan olay HATALI'ya alınır ve kuyruktan çıkar.
+    cursor = conn.cursor()
+    islenen = 0
+    for olay_id in ids:
+        conn.start_transaction()
+        cursor.execute("""
+            SELECT id, yuk, olusturma FROM olay_kutusu
+            WHERE id=%s AND durum='BEKLIYOR'
+            FOR UPDATE SKIP LOCKED
+        """, (olay_id,))
+        olay = cursor.fetchone()
+        if not olay:
+            conn.rollback()
+            continue
+        try:
+            _write_outbox_events(cursor, [olay])
+            conn.commit()
+            islenen += 1
+        except Exception as err:
+            conn.rollback()
+            conn.start_transaction()
+            cursor.execute("""
+                UPDATE olay_kutusu
+                SET deneme = deneme + 1, hata = %s,
+                    durum = IF(deneme >= %s, 'HATALI', durum)
+                WHERE id=%s
+            """, (str(err)[:1000], outbox_config['max_deneme'], olay_id))
+            conn.commit()
+            print(f"Olay kutusu #{olay_id} yazılamadı: {err}")
+    return islenen
+
+def process_outbox_batch(conn, batch_size=None):
+    # Bekleyen olayları tek transaction'da hedef tablolara yazar ve kuyruktan siler
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT id, yuk, olusturma FROM olay_kutusu
+        WHERE durum='BEKLIYOR'
+        ORDER BY id
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    """, (batch_size or outbox_config['batch_size'],))
+    olaylar = cursor.fetchall()
+    if not olaylar:
+        conn.rollback()
+        return 0
+
+    try:
+        _write_outbox_events(cursor, olaylar)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        _process_outbox_tek_tek(conn, [o[0] for o in olaylar])
+    return len(olaylar)
+
+def outbox_lag(cursor):
+    cursor.execute("""
+        SELECT COUNT(*), TIMESTAMPDIFF(SECOND, MIN(olusturma), NOW(3)) FROM olay_kutusu WHERE durum='BEKLIYOR'
+    """)
+    row = cursor.fetchone()
+    if isinstance(row, dict): row = tuple(row.values())
+    cursor.execute("SELECT COUNT(*) FROM olay_kutusu WHERE durum='HATALI'")
+    hatali = cursor.fetchone()
+    if isinstance(hatali, dict): hatali = tuple(hatali.values())
+    return {'bekleyen': row[0] or 0, 'gecikme_sn': row[1] or 0, 'hatali': hatali[0] or 0}
+
+_outbox_stop = threading.Event()
+
+def run_outbox_worker(stop_event=None):
+    stop_event = stop_event or _outbox_stop
+    while not stop_event.is_set():
+        islenen = 0
+        try:
+            with app.app_context():
+                conn = get_db_connection()
+                if conn:
+                    islenen = process_outbox_batch(conn)
+        except Exception as err:
+            print(f"Olay kutusu işlenemedi: {err}")
+        # Dolu batch geldiyse beklemeden devam et
+        if islenen < outbox_config['batch_size']:
+            stop_event.wait(outbox_config['poll_interval'])
+
+@app.cli.command('outbox-worker')
+def outbox_worker_command():
+    # Ayrı süreç olarak çalıştırmak için (gunicorn vb. altında)
+    print("Olay kutusu worker'ı başladı.")
+    try:
+        run_outbox_worker()
+    except KeyboardInterrupt:
+        pass
+
+# --- PANEL SAYAÇLARI ---
+# Yönetim paneli özetleri her açılışta COUNT(*) yerine panel_sayac tablosundan okunur.
+# Sayaçlar, ilgili satırı değiştiren transaction içinde artırılıp azaltılır. Sık
+# güncellenen sayaçlar tek satırda kilit beklemesin diye her anahtar 'slots' adet
+# parçaya bölünür; okurken toplanır. Periyodik düzeltme, olası kaymaları giderir.
+panel_counter_config = {
+    'slots': 8,
+    'reconcile_interval': 3600   # sn
+}
+
+BEKLEYEN_DURUMLAR = ('ONAY_BEKLIYOR', 'OLUSTURULDU')
+
+PANEL_SAYACLARI = {
+    'bekleyen_siparis': "SELECT COUNT(*) FROM siparis WHERE durum IN ('ONAY_BEKLIYOR', 'OLUSTURULDU')",
+    'aktif_urun': "SELECT COUNT(*) FROM urun WHERE aktif=1",
+    'musteri': "SELECT COUNT(*) FROM musteri",
+    'yorum': "SELECT COUNT(*) FROM yorum",
+    'okunmamis_mesaj': "SELECT COUNT(*) FROM mesajlar WHERE alici_rol='ADMIN' AND durum='BEKLIYOR'"
+}
+
+def adjust_panel_sayac(cursor, anahtar, delta):
+    if not delta:
+        return
+    parca = random.randrange(panel_counter_config['slots'])
+    cursor.execute("""
+        INSERT INTO panel_sayac (anahtar, parca, deger) VALUES (%s, %s, %s)
+        ON DUPLICATE KEY UPDATE deger = deger + VALUES(deger)
+    """, (anahtar, parca, delta))
+
+def track_siparis_gecisi(cursor, eski_durum, yeni_durum, adet=1):
+    # Bekleyen sipariş sayacını durum geçişine göre günceller
+    delta = (yeni_durum in BEKLEYEN_DURUMLAR) - (eski_durum in BEKLEYEN_DURUMLAR)
+    adjust_panel_sayac(cursor, 'bekleyen_siparis', delta * adet)
+
+def read_panel_sayaclari(cursor):
+    cursor.execute("SELECT anahtar, SUM(deger) FROM panel_sayac GROUP BY anahtar")
+    sayaclar = {}
+    for row in cursor.fetchall():
+        if isinstance(row, dict): row = tuple(row.values())
+        sayaclar[row[0]] = int(row[1])
+    return sayaclar
+
+def reconcile_panel_sayaclari(conn):
+    # Her anahtar için sayaç satırları kilitlenir, ardından gerçek sayım alınır. Kilitten
+    # sonra gelen artışlar bizim commit'imizi bekler ve sayımın üzerine eklenir; sayım
+    # (ilk tutarlı okuma) kilitten sonra alındığı için öncekiler zaten sayıma dahildir.
+    cursor = conn.cursor()
+    duzeltilen = {}
+    for anahtar, sorgu in PANEL_SAYACLARI.items():
+        # Önceki okumalardan kalan transaction (ve snapshot'ı) varsa bırak
+        if conn.in_transaction:
+            conn.rollback()
+        conn.start_transaction()
+        try:
+            cursor.execute("SELECT SUM(deger) FROM panel_sayac WHERE anahtar=%s FOR UPDATE", (anahtar,))
+            onceki = cursor.fetchone()[0]
+            cursor.execute(sorgu)
+            gercek = cursor.fetchone()[0]
+            cursor.execute("DELETE FROM panel_sayac WHERE anahtar=%s", (anahtar,))
+            cursor.execute("INSERT INTO panel_sayac (anahtar, parca, deger) VALUES (%s, 0, %s)", (anahtar, gercek))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        if onceki is None or int(onceki) != gercek:
+            duzeltilen[anahtar] = (onceki, gercek)
+    return duzeltilen
+
+_panel_sayac_stop = threading.Event()
+
+def run_panel_sayac_reconciler(stop_event=None):
+    stop_event = stop_event or _panel_sayac_stop
+    while not stop_event.wait(panel_counter_config['reconcile_interval']):
+        try:
+            with app.app_context():
+                conn = get_db_connection()
+                if conn:
+                    reconcile_panel_sayaclari(conn)
+        except Exception as err:
+            print(f"Panel sayaçları düzeltilemedi: {err}")
+
+@app.cli.command('panel-sayac-duzelt')
+def panel_sayac_duzelt_command():
+    conn = get_db_connection()
+    if not conn:
+        print("Veritabanı bağlantısı yok.")
+        return
+    duzeltilen = reconcile_panel_sayaclari(conn)
+    for anahtar, (onceki, gercek) in duzeltilen.items():
+        print(f"{anahtar}: {onceki} -> {gercek}")
+    print(f"{len(duzeltilen)} sayaç düzeltildi.")
+
+# --- KURYE ATAMA (DISPATCH) ---
+# Onaylanan/hazırlanan ve kuryesi olmayan siparişler periyodik olarak toplu atanır.
+# Plan saf bir fonksiyondur (DB'ye dokunmaz): siparişler en eskiden başlayarak
+# sırayla, yükü (KURYE_ATANDI + YOLDA iş sayısı) en az olan kuryeye verilir; kurye
+# aynı mahalle/ilçede zaten iş taşıyorsa yükü bonus kadar düşük sayılır.
+dispatch_config = {
+    'enabled': True,
+    'interval': 15,              # sn
+    'batch_size': 200,           # Bir turda planlanacak en fazla sipariş
+    'max_load': 3,               # Kurye başına aynı anda en fazla iş
+    'mahalle_bonus': 1.0,
+    'ilce_bonus': 0.5,
+    # Loglarda 'degistiren_id': girişi kapalı 'sistem' hesabı (seed id 9), ortamdan değiştirilebilir
+    'sistem_kullanici_id': int(os.environ.get('FIRIN_SISTEM_KULLANICI_ID', 9))
+}
+OTOMATIK_ATAMA_ACIKLAMASI = 'Otomatik kurye ataması'
+
+ATANABILIR_DURUMLAR = ('ONAYLANDI', 'HAZIRLANIYOR')
+AKTIF_KURYE_DURUMLARI = ('KURYE_ATANDI', 'YOLDA')
+
+def adres_bolgesi(acik_adres):
+    # 'İstanbul, Kadıköy, Moda Mah. Lale Sok. No:5' -> ('kadikoy', 'moda')
+    parcalar = [p.strip() for p in (acik_adres or '').split(',')]
+    ilce = fold_tr(parcalar[1]) if len(parcalar) > 2 else ''
+    m = re.search(r'([\w\s]+?)\s+mah(?:\.|allesi)?\b', fold_tr(acik_adres))
+    mahalle = m.group(1).strip().split()[-1] if m else ''
+    return (ilce, mahalle)
+
+def kurye_atama_plani(siparisler, kuryeler, max_yuk=None, mahalle_bonus=None, ilce_bonus=None):
+    # siparisler: [{'id', 'tarih', 'bolge': (ilce, mahalle)}]
+    # kuryeler:   [{'id', 'yuk', 'bolgeler': [(ilce, mahalle), ...]}]
+    # Dönüş: [(siparis_id, kurye_id)]
+    max_yuk = max_yuk or dispatch_config['max_load']
+    mahalle_bonus = dispatch_config['mahalle_bonus'] if mahalle_bonus is None else mahalle_bonus
+    ilce_bonus = dispatch_config['ilce_bonus'] if ilce_bonus is None else ilce_bonus
+
+    yukler = {}
+    mahalle_kuryeleri = {}
+    ilce_kuryeleri = {}
+    heap = []
+    for k in kuryeler:
+        yukler[k['id']] = k['yuk']
+        for ilce, mahalle in k.get('bolgeler', ()):
+            if mahalle: mahalle_kuryeleri.setdefault((ilce, mahalle), set()).add(k['id'])
+            if ilce: ilce_kuryeleri.setdefault(ilce, set()).add(k['id'])
+        if k['yuk'] < max_yuk:
+            heap.append((k['yuk'], k['id']))
+    heapq.heapify(heap)
+
+    plan = []
+    for s in sorted(siparisler, key=lambda s: (s['tarih'], s['id'])):
+        # Yükü değişmiş (eski) ya da dolmuş kayıtları at
+        while heap and (heap[0][0] != yukler[heap[0][1]] or heap[0][0] >= max_yuk):
+            heapq.heappop(heap)
+        if not heap:
+            break
+
+        ilce, mahalle = s['bolge']
+        adaylar = {heap[0][1]: 0.0}
+        for kid in ilce_kuryeleri.get(ilce, ()) if ilce else ():
+            adaylar[kid] = ilce_bonus
+        for kid in mahalle_kuryeleri.get((ilce, mahalle), ()) if mahalle else ():
+            adaylar[kid] = mahalle_bonus
+        kurye_id = min((kid for kid in adaylar if yukler[kid] < max_yuk),
+                       key=lambda kid: (yukler[kid] - adaylar[kid], yukler[kid], kid))
+
+        plan.append((s['id'], kurye_id))
+        yukler[kurye_id] += 1
+        if yukler[kurye_id] < max_yuk:
+            heapq.heappush(heap, (yukler[kurye_id], kurye_id))
+        if mahalle: mahalle_kuryeleri.setdefault((ilce, mahalle), set()).add(kurye_id)
+        if ilce: ilce_kuryeleri.setdefault(ilce, set()).add(kurye_id)
+    return plan
+
+def dispatch_batch(conn):
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(f"""
+        SELECT s.id, s.durum, s.tarih, s.musteri_id, a.acik_adres
+        FROM siparis s
+        JOIN adres a ON a.id = s.adres_id
+        WHERE s.durum IN ({_in_clause(ATANABILIR_DURUMLAR)}) AND s.kurye_id IS NULL
+        ORDER BY s.tarih, s.id
+        LIMIT %s
+    """, ATANABILIR_DURUMLAR + (dispatch_config['batch_size'],))
+    siparisler = cursor.fetchall()
+    if not siparisler:
+        conn.rollback()
+        return []
+
+    cursor.execute("SELECT id FROM kurye WHERE durum IN ('MUSAIT', 'MESGUL')")
+    kuryeler = {k['id']: {'id': k['id'], 'yuk': 0, 'bolgeler': []} for k in cursor.fetchall()}
+    if not kuryeler:
+        conn.rollback()
+        return []
+    ids = list(kuryeler)
+    cursor.execute(f"""
+        SELECT s.kurye_id, a.acik_adres
+        FROM siparis s
+        JOIN adres a ON a.id = s.adres_id
+        WHERE s.kurye_id IN ({_in_clause(ids)}) AND s.durum IN ({_in_clause(AKTIF_KURYE_DURUMLARI)})
+    """, ids + list(AKTIF_KURYE_DURUMLARI))
+    for row in cursor.fetchall():
+        k = kuryeler[row['kurye_id']]
+        k['yuk'] += 1
+        k['bolgeler'].append(adres_bolgesi(row['acik_adres']))
+
+    for s in siparisler:
+        s['bolge'] = adres_bolgesi(s['acik_adres'])
+    plan = kurye_atama_plani(siparisler, list(kuryeler.values()))
+
+    # Koşullu UPDATE: bu arada elle atanan ya da iptal edilen sipariş atlanır
+    eski = {s['id']: s['durum'] for s in siparisler}
+    sistem_id = dispatch_config['sistem_kullanici_id']
+    atananlar = []
+    loglar = []
+    for siparis_id, kurye_id in plan:
+        cursor.execute("""
+            UPDATE siparis SET kurye_id=%s, durum='KURYE_ATANDI'
+            WHERE id=%s AND durum=%s AND kurye_id IS NULL
+        """, (kurye_id, siparis_id, eski[siparis_id]))
+        if cursor.rowcount == 1:
+            atananlar.append((siparis_id, kurye_id))
+            loglar.append((siparis_id, eski[siparis_id], 'KURYE_ATANDI', sistem_id, OTOMATIK_ATAMA_ACIKLAMASI))
+            track_siparis_gecisi(cursor, eski[siparis_id], 'KURYE_ATANDI')
+    if loglar:
+        enqueue_event(cursor, 'KURYE_ATANDI', loglar=loglar)
+    conn.commit()
+    musteriler = {s['id']: s['musteri_id'] for s in siparisler}
+    for siparis_id, kurye_id in atananlar:
+        publish_siparis_olayi(siparis_id, eski[siparis_id], 'KURYE_ATANDI', musteriler[siparis_id], kurye_id)
+    return atananlar
+
+_dispatch_stop = threading.Event()
+
+def check_sistem_kullanici(conn):
+    # Log satırları degistiren_id ile kullanici'ya bağlı; hesap yoksa her atama FK hatası verir
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM kullanici WHERE id=%s", (dispatch_config['sistem_kullanici_id'],))
+    mevcut = cursor.fetchone() is not None
+    conn.rollback()
+    return mevcut
+
+def run_dispatcher(stop_event=None):
+    stop_event = stop_event or _dispatch_stop
+    # Sistem kullanıcısı döngü içinde doğrulanır: geçici DB hatası thread'i sonlandırmaz
+    hazir = uyarildi = False
+    while not stop_event.wait(dispatch_config['interval']):
+        try:
+            with app.app_context():
+                conn = get_db_connection()
+                if not conn:
+                    continue
+                if not hazir:
+                    hazir = check_sistem_kullanici(conn)
+                    if not hazir:
+                        if not uyarildi:
+                            print(f"Kurye ataması bekliyor: sistem kullanıcısı (id={dispatch_config['sistem_kullanici_id']}) "
+                                  f"bulunamadı. FIRIN_SISTEM_KULLANICI_ID ile mevcut bir hesap verin.")
+                            uyarildi = True
+                        continue
+                dispatch_batch(conn)
+        except Exception as err:
+            print(f"Kurye ataması yapılamadı: {err}")
+
+@app.cli.command('kurye-atama')
+def kurye_atama_command():
+    # Ayrı süreç olarak çalıştırmak için; tek bir dispatcher çalışması önerilir
+    print("Kurye atama döngüsü başladı.")
+    try:
+        run_dispatcher()
+    except KeyboardInterrupt:
+        pass
+
+def simulate_dispatch(kurye_sayisi=20, tur=500, siparis_orani=4.0, ilce_sayisi=5, mahalle_sayisi=8,
+                      mahalle_bonus=None, ilce_bonus=None, seed=42):
+    # Basit filo simülasyonu: her tur Poisson sayıda sipariş gelir, planlayıcı çalışır,
+    # kuryeler işlerini sırayla bitirir. Teslim süresi bir önceki teslimatla aynı mahalle
+    # ise 2, aynı ilçe ise 4, değilse 6 turdur.
+    rnd = random.Random(seed)
+    bolgeler = [(f"ilce{i}", f"mahalle{m}") for i in range(ilce_sayisi) for m in range(mahalle_sayisi)]
+    kuryeler = {kid: {'is': [], 'kalan': 0, 'son': None} for kid in range(1, kurye_sayisi + 1)}
+    bekleyen = {}
+    sonraki_id = 1
+    bekleme = []
+    teslim = 0
+    plan_suresi = 0.0
+
+    for t in range(tur):
+        # Gelen siparişler (Poisson, Knuth yöntemi)
+        esik, n, p = pow(2.718281828, -siparis_orani), 0, rnd.random()
+        while p > esik:
+            n += 1
+            p *= rnd.random()
+        for _ in range(n):
+            bekleyen[sonraki_id] = {'id': sonraki_id, 'tarih': t, 'bolge': rnd.choice(bolgeler)}
+            sonraki_id += 1
+
+        girdi = [{'id': kid, 'yuk': len(k['is']), 'bolgeler': [b for _, b in k['is']]} for kid, k in kuryeler.items()]
+        basla = time.perf_counter()
+        plan = kurye_atama_plani(list(bekleyen.values()), girdi, mahalle_bonus=mahalle_bonus, ilce_bonus=ilce_bonus)
+        plan_suresi += time.perf_counter() - basla
+        for siparis_id, kurye_id in plan:
+            s = bekleyen.pop(siparis_id)
+            kuryeler[kurye_id]['is'].append((siparis_id, s['bolge']))
+            bekleme.append(t - s['tarih'])
+
+        for k in kuryeler.values():
+            if not k['is']:
+                continue
+            if k['kalan'] == 0:
+                bolge = k['is'][0][1]
+                k['kalan'] = 2 if bolge == k['son'] else 4 if k['son'] and bolge[0] == k['son'][0] else 6
+            k['kalan'] -= 1
+            if k['kalan'] == 0:
+                k['son'] = k['is'].pop(0)[1]
+                teslim += 1
+
+    return {
+        'siparis': sonraki_id - 1,
+        'teslim': teslim,
+        'bekleyen': len(bekleyen),
+        'ort_bekleme_tur': round(sum(bekleme) / len(bekleme), 2) if bekleme else 0,
+        'plan_ms_tur': round(plan_suresi * 1000 / tur, 3)
+    }
+
+@app.cli.command('kurye-atama-bench')
+def kurye_atama_bench_command():
+    # Yük + bölge yakınlığı ile sadece yüke göre atamayı aynı simüle filo üzerinde karşılaştırır
+    for ad, bonus in (('sadece yük', (0.0, 0.0)), ('yük + bölge', (None, None))):
+        sonuc = simulate_dispatch(mahalle_bonus=bonus[0], ilce_bonus=bonus[1])
+        print(f"{ad:12} " + ", ".join(f"{k}={v}" for k, v in sonuc.items()))
+
+_arka_plan_worker = threading.Event()
+_worker_uyarisi = threading.Event()
+
+@app.before_request
+def uyar_worker_yoksa():
+    # flask run / WSGI altında worker'lar bu süreçte başlamaz; loglar ayrı süreç olmadan yazılmaz
+    if _worker_uyarisi.is_set():
+        return
+    _worker_uyarisi.set()
+    if not _arka_plan_worker.is_set():
+        print("Uyarı: arka plan worker'ları bu süreçte çalışmıyor. Sipariş logları, stok hareketleri ve "
+              "kupon kullanımları için 'flask outbox-worker' ayrı süreç olarak çalıştırılmalı.")
+
+def start_background_workers():
+    _arka_plan_worker.set()
+    threading.Thread(target=run_outbox_worker, name='outbox-worker', daemon=True).start()
+    threading.Thread(target=run_panel_sayac_reconciler, name='panel-sayac', daemon=True).start()
+    if dispatch_config['enabled']:
+        threading.Thread(target=run_dispatcher, name='kurye-atama', daemon=True).start()
+    if analytics_config['enabled']:
+        threading.Thread(target=run_rapor_rollup, name='rapor-ozet', daemon=True).start()
+    if audit_config['enabled']:
+        threading.Thread(target=run_denetim_arsivi, name='denetim-arsivi', daemon=True).start()
+
+# --- CANLI SİPARİŞ OLAYLARI (SSE) ---
+# Sipariş durum geçişleri commit'ten sonra süreç içi bir yayına basılır; açık
+# /olaylar/siparisler bağlantıları kendilerini ilgilendiren olayları alır. Her
+# abonenin kuyruğu sınırlıdır: yetişemeyen istemcinin kuyruğu boşaltılır ve sayfayı
+# bir kez yenilemesi söylenir (yayıncı hiçbir zaman beklemez).
+# Not: yayın süreç içidir; birden fazla worker süreci varsa her biri kendi olaylarını görür.
+sse_config = {
+    'queue_size': 50,
+    'max_per_user': 3,      # Kullanıcı başına açık akış sınırı
+    'heartbeat': 20         # sn; proxy'ler boşta bağlantıyı kapatmasın
+}
+
+class TooManyStreams(Exception):
+    pass
+
+class OrderEventSubscriber:
+    def __init__(self, rol, user_id, siparis_id, queue_size):
+        self.rol = rol
+        self.user_id = user_id
+        self.siparis_id = siparis_id
+        self.kuyruk = queue.Queue(maxsize=queue_size)
+
+    def ilgili(self, olay, musteri_id, kurye_idleri):
+        if self.siparis_id and olay['siparis_id'] != self.siparis_id:
+            return False
+        if self.rol == 'ADMIN':
+            return True
+        if self.rol == 'MUSTERI':
+            return musteri_id == self.user_id
+        if self.rol == 'KURYE':
+            return self.user_id in kurye_idleri
+        return False
+
+class OrderEventBus:
+    def __init__(self, queue_size=50, max_per_user=3):
+        self.queue_size = queue_size
+        self.max_per_user = max_per_user
+        self._lock = threading.Lock()
+        self._aboneler = set()
+        self._kullanici_akislari = {}
+        self._yayinlanan = 0
+        self._tasan = 0
+        self._reddedilen = 0
+
+    def subscribe(self, rol, user_id, siparis_id=None):
+        anahtar = (rol, user_id)
+        with self._lock:
+            if self._kullanici_akislari.get(anahtar, 0) >= self.max_per_user:
+                self._reddedilen += 1
+                raise TooManyStreams()
+            self._kullanici_akislari[anahtar] = self._kullanici_akislari.get(anahtar, 0) + 1
+            abone = OrderEventSubscriber(rol, user_id, siparis_id, self.queue_size)
+            self._aboneler.add(abone)
+        return abone
+
+    def unsubscribe(self, abone):
+        anahtar = (abone.rol, abone.user_id)
+        with self._lock:
+            if abone in self._aboneler:
+                self._aboneler.discard(abone)
+                self._kullanici_akislari[anahtar] -= 1
+                if not self._kullanici_akislari[anahtar]:
+                    del self._kullanici_akislari[anahtar]
+
+    def publish(self, olay, musteri_id=None, kurye_idleri=()):
+        with self._lock:
+            aboneler = list(self._aboneler)
+            self._yayinlanan += 1
+        for abone in aboneler:
+            if not abone.ilgili(olay, musteri_id, kurye_idleri):
+                continue
+            try:
+                abone.kuyruk.put_nowait(olay)
+            except queue.Full:
+                # Yavaş istemci: bekleyenleri at, yerine tek bir 'yenile' işareti koy
+                with self._lock:
+                    self._tasan += 1
+                try:
+                    while True:
+                        abone.kuyruk.get_nowait()
+                except queue.Empty:
+                    pass
+                abone.kuyruk.put_nowait(None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'acik_akis': len(self._aboneler),
+                'yayinlanan': self._yayinlanan,
+                'tasan': self._tasan,
+                'reddedilen': self._reddedilen
+            }
+
+order_events = OrderEventBus(sse_config['queue_size'], sse_config['max_per_user'])
+
+def publish_siparis_olayi(siparis_id, eski_durum, yeni_durum, musteri_id, kurye_id=None, eski_kurye_id=None):
+    # Commit'ten SONRA çağrılmalı
+    olay = {'siparis_id': siparis_id, 'eski_durum': eski_durum, 'durum': yeni_durum, 'kurye_id': kurye_id}
+    kurye_idleri = {k for k in (kurye_id, eski_kurye_id) if k}
+    order_events.publish(olay, musteri_id=musteri_id, kurye_idleri=kurye_idleri)
+
+# --- SİPARİŞ DURUM GEÇİŞLERİ ---
+# Admin işlemleri: işlem -> (yeni durum, izin verilen eski durumlar). Tek sipariş ve
+# toplu işlem aynı yolu kullanır: siparişler tek sıralı FOR UPDATE ile kilitlenir,
+# durum tek koşullu UPDATE ile değişir, iade stokları tek UPDATE'te döner, loglar
+# ve stok hareketleri tek olay olarak kuyruğa yazılır.
+SIPARIS_ISLEMLERI = {
+    'onayla': ('ONAYLANDI', {'OLUSTURULDU'}),
+    'hazirla': ('HAZIRLANIYOR', {'ONAYLANDI'}),
+    'iptal': ('IPTAL_EDILDI', {'OLUSTURULDU', 'ONAYLANDI', 'HAZIRLANIYOR', 'KURYE_ATANDI'}),
+    'reddet': ('REDDEDILDI', {'OLUSTURULDU'}),
+    'kapat': ('TESLIM_EDILDI', {'YOLDA'})
+}
+STOK_IADE_ISLEMLERI = {'iptal', 'reddet'}
+TOPLU_SIPARIS_LIMIT = 200
+
+def apply_siparis_islemi(cursor, siparis_idler, action, yapan_id, aciklama='Admin İşlemi'):
+    # Transaction içinde çağrılır. Dönüş: ({siparis_id: None | hata}, [yayınlanacak geçişler])
+    yeni_durum, izinli_eski = SIPARIS_ISLEMLERI[action]
+    siparis_idler = sorted(set(siparis_idler))
+    cursor.execute(f"""
+        SELECT id, durum, musteri_id, kurye_id FROM siparis
+        WHERE id IN ({_in_clause(siparis_idler)})
+        ORDER BY id
+        FOR UPDATE
+    """, siparis_idler)
+    mevcut = {row[0]: row[1:] for row in cursor.fetchall()}
+
+    sonuclar, uygunlar = {}, []
+    for siparis_id in siparis_idler:
+        if siparis_id not in mevcut:
+            sonuclar[siparis_id] = 'Sipariş bulunamadı.'
+        elif mevcut[siparis_id][0] not in izinli_eski:
+            sonuclar[siparis_id] = f'Bu işlem için uygun durum değil: {mevcut[siparis_id][0]}'
+        else:
+            sonuclar[siparis_id] = None
+            uygunlar.append(siparis_id)
+    if not uygunlar:
+        return sonuclar, []
+
+    iade = action in STOK_IADE_ISLEMLERI
+    izinli = sorted(izinli_eski)
+    cursor.execute(f"""
+        UPDATE siparis SET durum=%s{', kurye_id=NULL' if iade else ''}
+        WHERE id IN ({_in_clause(uygunlar)}) AND durum IN ({_in_clause(izinli)})
+    """, [yeni_durum] + uygunlar + izinli)
+
+    iadeler = []
+    if iade:
+        # İptal veya Red durumunda stokları iade et
+        cursor.execute(f"""
+            SELECT siparis_id, urun_id, adet FROM siparis_detay
+            WHERE siparis_id IN ({_in_clause(uygunlar)})
+            ORDER BY siparis_id
+        """, uygunlar)
+        iade_miktarlari = {}
+        for siparis_id, urun_id, adet in cursor.fetchall():
+            iade_miktarlari[urun_id] = iade_miktarlari.get(urun_id, 0) + adet
+            iadeler.append((urun_id, siparis_id, 'IADE', adet, 'Sipariş iptal/red iadesi', yapan_id))
+        update_stok_bulk(cursor, iade_miktarlari)
+        stock_cache.invalidate(cursor)
+
+    eski_sayilari = {}
+    for siparis_id in uygunlar:
+        eski_durum = mevcut[siparis_id][0]
+        eski_sayilari[eski_durum] = eski_sayilari.get(eski_durum, 0) + 1
+    for eski_durum, adet in eski_sayilari.items():
+        track_siparis_gecisi(cursor, eski_durum, yeni_durum, adet)
+    enqueue_event(cursor, 'SIPARIS_DURUM',
+                  loglar=[(i, mevcut[i][0], yeni_durum, yapan_id, aciklama) for i in uygunlar],
+                  stok_hareketleri=iadeler)
+
+    gecisler = []
+    for siparis_id in uygunlar:
+        eski_durum, musteri_id, kurye_id = mevcut[siparis_id]
+        gecisler.append((siparis_id, eski_durum, yeni_durum, musteri_id, None if iade else kurye_id, kurye_id))
+    return sonuclar, gecisler
+
+# --- MESAJ KONUŞMALARI ---
+# mesajlar tablosunun üzerine konuşma modeli: her konuşmanın son mesaj işaretçisi ve
+# her katılımcı için okunmamış sayacı tutulur. Gelen kutusu, katılımcının kendi
+# satırları üzerinden (rol, id, silindi, son_mesaj_tarihi) index'iyle sayfalanır;
+# geçmişin tamamı taranmaz. Yöneticiler tek ortak kutuyu paylaşır.
+MESAJ_SAYFA = 20
+ADMIN_KUTUSU_ID = 1
+
+def mesaj_katilimcisi(rol, kullanici_id):
+    return (rol, ADMIN_KUTUSU_ID if rol == 'ADMIN' else int(kullanici_id))
+
+def create_konusma(cursor, konu, gonderen, alici):
+    cursor.execute("INSERT INTO konusma (konu) VALUES (%s)", (konu,))
+    konusma_id = cursor.lastrowid
+    cursor.executemany("""
+        INSERT INTO konusma_katilimci (konusma_id, katilimci_rol, katilimci_id, karsi_rol, karsi_id)
+        VALUES (%s, %s, %s, %s, %s)
+    """, [(konusma_id, gonderen[0], gonderen[1], alici[0], alici[1]),
+          (konusma_id, alici[0], alici[1], gonderen[0], gonderen[1])])
+    return konusma_id
+
+def find_konusma_karsi(cursor, konusma_id, katilimci):
+    # Katılımcı değilse None döner
+    cursor.execute("""
+        SELECT karsi_rol, karsi_id FROM konusma_katilimci
+        WHERE konusma_id=%s AND katilimci_rol=%s AND katilimci_id=%s
+    """, (konusma_id, katilimci[0], katilimci[1]))
+    row = cursor.fetchone()
+    if isinstance(row, dict): row = (row['karsi_rol'], row['karsi_id'])
+    return tuple(row) if row else None
+
+def append_mesaj(cursor, konusma_id, gonderen, gonderen_id, alici, konu, mesaj):
+    # gonderen_id: oturumdaki gerçek kullanıcı (yöneticiler için kutu ID'si değil)
+    cursor.execute("""
+        INSERT INTO mesajlar (konusma_id, gonderen_id, gonderen_rol, alici_id, alici_rol, konu, mesaj)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+    """, (konusma_id, gonderen_id, gonderen[0], alici[1], alici[0], konu, mesaj))
+    mesaj_id = cursor.lastrowid
+    cursor.execute("""
+        UPDATE konusma SET son_mesaj_id=%s, son_mesaj_tarihi=NOW() WHERE id=%s
+    """, (mesaj_id, konusma_id))
+    # Alıcı: okunmamış +1, konuşma (silinmişse) tekrar kutuya düşer
+    cursor.execute("""
+        UPDATE konusma_katilimci
+        SET okunmamis = okunmamis + 1, son_mesaj_tarihi = NOW(), silindi = 0
+        WHERE konusma_id=%s AND katilimci_rol=%s AND katilimci_id=%s
+    """, (konusma_id, alici[0], alici[1]))
+    # Gönderen: kendi mesajı okunmuş sayılır
+    cursor.execute("""
+        UPDATE konusma_katilimci
+        SET son_okunan_id = %s, son_mesaj_tarihi = NOW(), silindi = 0
+        WHERE konusma_id=%s AND katilimci_rol=%s AND katilimci_id=%s
+    """, (mesaj_id, konusma_id, gonderen[0], gonderen[1]))
+    if alici[0] == 'ADMIN':
+        adjust_panel_sayac(cursor, 'okunmamis_mesaj', 1)
+    elif gonderen[0] == 'ADMIN':
+        yanitla_admin_mesajlari(cursor, konusma_id)
+    return mesaj_id
+
+def yanitla_admin_mesajlari(cursor, konusma_id):
+    # Yönetici konuşmayı okuduğunda, yanıtladığında ya da kutusundan kaldırdığında
+    # bekleyen mesajları kapanır; panel sayacı aynı transaction'da düşülür
+    cursor.execute("""
+        UPDATE mesajlar SET durum='YANITLANDI'
+        WHERE konusma_id=%s AND alici_rol='ADMIN' AND durum='BEKLIYOR'
+    """, (konusma_id,))
+    if cursor.rowcount:
+        adjust_panel_sayac(cursor, 'okunmamis_mesaj', -cursor.rowcount)
+
+def mark_konusma_okundu(cursor, konusma_id, katilimci):
+    cursor.execute("""
+        UPDATE konusma_katilimci kk
+        JOIN konusma k ON k.id = kk.konusma_id
+        SET kk.okunmamis = 0, kk.son_okunan_id = k.son_mesaj_id
+        WHERE kk.konusma_id=%s AND kk.katilimci_rol=%s AND kk.katilimci_id=%s AND kk.okunmamis > 0
+    """, (konusma_id, katilimci[0], katilimci[1]))
+    if katilimci[0] == 'ADMIN':
+        yanitla_admin_mesajlari(cursor, konusma_id)
+
+def forget_okunmamis_mesaj(cursor, msg):
+    # Alıcı okumadan silinen/kaldırılan mesaj okunmamış sayacından düşülür
+    if not msg.get('konusma_id'):
+        return
+    alici = mesaj_katilimcisi(msg['alici_rol'], msg['alici_id'])
+    cursor.execute("""
+        UPDATE konusma_katilimci
+        SET okunmamis = GREATEST(okunmamis - 1, 0)
+        WHERE konusma_id=%s AND katilimci_rol=%s AND katilimci_id=%s AND son_okunan_id < %s
+    """, (msg['konusma_id'], alici[0], alici[1], msg['id']))
+
+def fetch_gelen_kutusu(cursor, katilimci, once=None, karsi_rol=None):
+    # Bir sayfa konuşma: önce katılımcının index'li satırları, sonra o sayfanın son
+    # mesajları ve karşı taraf adları (PK/IN sorguları)
+    kosullar = ["kk.katilimci_rol=%s", "kk.katilimci_id=%s", "kk.silindi=0"]
+    params = [katilimci[0], katilimci[1]]
+    if karsi_rol:
+        kosullar.append("kk.karsi_rol=%s")
+        params.append(karsi_rol)
+    if once and '_' in once:
+        once_tarih, once_id = once.rsplit('_', 1)
+        kosullar.append("(kk.son_mesaj_tarihi < %s OR (kk.son_mesaj_tarihi = %s AND kk.konusma_id < %s))")
+        params += [once_tarih, once_tarih, int(once_id) if once_id.isdigit() else 0]
+    cursor.execute(f"""
+        SELECT kk.konusma_id, kk.karsi_rol, kk.karsi_id, kk.okunmamis, kk.son_mesaj_tarihi,
+               k.konu, k.son_mesaj_id
+        FROM konusma_katilimci kk
+        JOIN konusma k ON k.id = kk.konusma_id
+        WHERE {" AND ".join(kosullar)}
+        ORDER BY kk.son_mesaj_tarihi DESC, kk.konusma_id DESC
+        LIMIT %s
+    """, params + [MESAJ_SAYFA + 1])
+    konusmalar = cursor.fetchall()
+    sonraki = None
+    if len(konusmalar) > MESAJ_SAYFA:
+        konusmalar = konusmalar[:MESAJ_SAYFA]
+        son = konusmalar[-1]
+        sonraki = f"{son['son_mesaj_tarihi']}_{son['konusma_id']}"
+
+    mesaj_idleri = [k['son_mesaj_id'] for k in konusmalar if k['son_mesaj_id']]
+    son_mesajlar = {}
+    if mesaj_idleri:
+        cursor.execute(f"SELECT id, gonderen_rol, mesaj FROM mesajlar WHERE id IN ({_in_clause(mesaj_idleri)})",
+                       mesaj_idleri)
+        son_mesajlar = {m['id']: m for m in cursor.fetchall()}
+
+    adlar = {}
+    for rol, tablo in (('MUSTERI', 'musteri'), ('KURYE', 'kurye')):
+        ids = list({k['karsi_id'] for k in konusmalar if k['karsi_rol'] == rol})
+        if ids:
+            cursor.execute(f"SELECT id, ad, soyad FROM {tablo} WHERE id IN ({_in_clause(ids)})", ids)
+            for r in cursor.fetchall():
+                adlar[(rol, r['id'])] = f"{r['ad']} {r['soyad']}"
+
+    for k in konusmalar:
+        k['son_mesaj'] = son_mesajlar.get(k['son_mesaj_id'])
+        k['karsi_ad'] = 'Yönetici' if k['karsi_rol'] == 'ADMIN' else adlar.get((k['karsi_rol'], k['karsi_id']), '-')
+    return konusmalar, sonraki
+
+@app.cli.command('mesaj-konusmalari-olustur')
+def mesaj_konusmalari_command():
+    # Konuşması olmayan (eski) mesajları taraflar + konu ('YNT: ' önekleri atılarak)
+    # ile gruplayıp konuşmalara bağlar. Eski mesajlar okunmuş sayılır.
+    conn = get_db_connection()
+    if not conn:
+        print("Veritabanı bağlantısı yok.")
+        return
+    cursor = conn.cursor(dictionary=True)
+    konusmalar = {}
+    toplam = 0
+    while True:
+        cursor.execute("""
+            SELECT id, gonderen_rol, gonderen_id, alici_rol, alici_id, konu, tarih
+            FROM mesajlar WHERE konusma_id IS NULL
+            ORDER BY id LIMIT 1000
+        """)
+        mesajlar = cursor.fetchall()
+        if not mesajlar:
+            break
+        gruplar = {}
+        for m in mesajlar:
+            gonderen = mesaj_katilimcisi(m['gonderen_rol'], m['gonderen_id'])
+            alici = mesaj_katilimcisi(m['alici_rol'], m['alici_id'])
+            konu = re.sub(r'^(YNT:\s*)+', '', m['konu'] or '').strip()
+            anahtar = (tuple(sorted([gonderen, alici])), konu)
+            if anahtar not in konusmalar:
+                konusmalar[anahtar] = create_konusma(cursor, konu, gonderen, alici)
+            gruplar.setdefault(konusmalar[anahtar], []).append(m)
+        for konusma_id, grup in gruplar.items():
+            ids = [m['id'] for m in grup]
+            son = max(grup, key=lambda m: m['id'])
+            cursor.execute(f"UPDATE mesajlar SET konusma_id=%s WHERE id IN ({_in_clause(ids)})", [konusma_id] + ids)
+            cursor.execute("""
+                UPDATE konusma SET son_mesaj_id=%s, son_mesaj_tarihi=%s
+                WHERE id=%s AND (son_mesaj_id IS NULL OR son_mesaj_id < %s)
+            """, (son['id'], son['tarih'], konusma_id, son['id']))
+            cursor.execute("""
+                UPDATE konusma_katilimci SET son_okunan_id=%s, son_mesaj_tarihi=%s
+                WHERE konusma_id=%s AND son_okunan_id < %s
+            """, (son['id'], son['tarih'], konusma_id, son['id']))
+        conn.commit()
+        toplam += len(mesajlar)
+    print(f"{toplam} mesaj {len(konusmalar)} konuşmaya bağlandı.")
+
+# --- STATİK DOSYALAR ---
+# Flask static/ altını sürüm bilgisi olmadan ve her seferinde yeniden doğrulanan
+# başlıklarla sunar. 'flask asset-derle' static/ altındaki dosyaların içerik
+# özetini asset-manifest.json'a yazar; şablonlar static_url() ile ?v=<özet>
+# ekli URL üretir. Özeti tutan istekler bir yıl 'immutable' önbelleklenir,
+# dosya değişince URL de değişir. Metin dosyalarının .gz/.br kardeşleri de
+# derleme sırasında yazılır ve istemci kabul ediyorsa onlar gönderilir.
+try:
+    import brotli
+except ImportError:   # brotli yoksa sadece gzip kardeşleri üretilir
+    brotli = None
+
+asset_config = {
+    'manifest': os.path.join(app.root_path, 'asset-manifest.json'),
+    'max_age': 31536000,                 # sn; sürümlü URL'ler için (1 yıl)
+    'sikistir': ('.css', '.js', '.svg', '.json', '.txt', '.map', '.xml', '.ico'),
+    'min_boyut': 512,                    # bayt; bundan küçük dosyalar sıkıştırılmaz
+    'immutable_klasorler': ('img/turev/',)   # adında içerik özeti taşıyan dosyalar
+}
+
+class JsonManifest:
+    def __init__(self, yol, kontrol_araligi=5):
+        self.yol = yol
+        self.kontrol_araligi = kontrol_araligi   # sn; dosya en fazla bu sıklıkla yeniden okunur
+        self.lock = threading.Lock()
+        self.veri = {}
+        self.mtime = None
+        self.kontrol = 0
+
+    def get(self, anahtar):
+        # Başka süreçler (CLI, diğer worker'lar) dosyayı güncelleyebilir; mtime'a bakılır
+        simdi = time.time()
+        if simdi - self.kontrol > self.kontrol_araligi:
+            self.kontrol = simdi
+            try:
+                mtime = os.path.getmtime(self.yol)
+            except OSError:
+                mtime = None
+            if mtime != self.mtime:
+                self.reload(mtime)
+        return self.veri.get(anahtar)
+
+    def reload(self, mtime=None):
+        veri = self.read()
+        with self.lock:
+            self.veri = veri if veri is not None else {}
+            self.mtime = mtime
+
+    def read(self):
+        try:
+            with open(self.yol, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def update(self, anahtar, kayit):
+        with self.lock:
+            # Yazmadan önce diskteki son hali al ki paralel çalışan CLI'nin kayıtları ezilmesin
+            veri = self.read()
+            if veri is not None:
+                self.veri = veri
+            self.veri[anahtar] = kayit
+            self.write_locked()
+
+    def replace(self, veri):
+        with self.lock:
+            self.veri = veri
+            self.write_locked()
+
+    def write_locked(self):
+        os.makedirs(os.path.dirname(self.yol), exist_ok=True)
+        gecici = self.yol + '.tmp'
+        with open(gecici, 'w', encoding='utf-8') as f:
+            json.dump(self.veri, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(gecici, self.yol)
+        self.mtime = os.path.getmtime(self.yol)
+
+asset_manifest = JsonManifest(asset_config['manifest'])
+
+def static_url(filename, **kwargs):
+    # url_for('static', filename=...) yerine kullanılır; manifestte varsa ?v=<özet> ekler
+    kayit = asset_manifest.get(filename)
+    if kayit and 'v' not in kwargs:
+        kwargs['v'] = kayit['v']
+    return url_for('static', filename=filename, **kwargs)
+
+def serve_static(filename):
+    kayit = asset_manifest.get(filename) or {}
+    gonderilecek = filename
+    kodlama = None
+    kabul = request.headers.get('Accept-Encoding', '')
+    for aday, uzanti in (('br', '.br'), ('gzip', '.gz')):
+        # Kardeş dosya sadece manifestte kayıtlıysa kullanılır (orijinalle aynı sürümden olduğu bilinir)
+        if aday in kayit.get('kodlamalar', ()) and aday in kabul:
+            gonderilecek, kodlama = filename + uzanti, aday
+            break
+
+    mimetype = mimetypes.guess_type(filename)[0] if kodlama else None
+    resp = send_from_directory(app.static_folder, gonderilecek, mimetype=mimetype)
+    if kayit.get('kodlamalar'):
+        resp.vary.add('Accept-Encoding')
+    if kodlama:
+        resp.content_encoding = kodlama
+
+    surumlu = kayit.get('v') and request.args.get('v') == kayit['v']
+    if surumlu or filename.startswith(asset_config['immutable_klasorler']):
+        resp.cache_control.no_cache = None
+        resp.cache_control.public = True
+        resp.cache_control.max_age = asset_config['max_age']
+        resp.cache_control.immutable = True
+    else:
+        # Sürümsüz URL: ETag/Last-Modified ile doğrulanarak kullanılır
+        resp.cache_control.no_cache = True
+    return resp
+
+app.view_functions['static'] = serve_static
+
+def build_asset_manifest():
+    kok = app.static_folder
+    eski = asset_manifest.read() or {}
+    manifest = {}
+    istatistik = {'dosya': 0, 'sikistirilan': 0, 'kazanc': 0}
+    for dizin, _, dosyalar in os.walk(kok):
+        for ad in sorted(dosyalar):
+            if ad.endswith(('.gz', '.br', '.tmp')):
+                continue
+            tam = os.path.join(dizin, ad)
+            goreli = os.path.relpath(tam, kok).replace(os.sep, '/')
+            with open(tam, 'rb') as f:
+                icerik = f.read()
+            kayit = {'v': hashlib.sha256(icerik).hexdigest()[:10], 'kodlamalar': []}
+            istatistik['dosya'] += 1
+
+            if ad.lower().endswith(asset_config['sikistir']) and len(icerik) >= asset_config['min_boyut']:
+                kardesler = [('gzip', '.gz', lambda b: gzip.compress(b, 9, mtime=0))]
+                if brotli is not None:
+                    kardesler.insert(0, ('br', '.br', lambda b: brotli.compress(b, quality=11)))
+                for kodlama, uzanti, sikistir in kardesler:
+                    hedef = tam + uzanti
+                    # İçerik değişmediyse ve kardeş duruyorsa yeniden sıkıştırma
+                    if (eski.get(goreli, {}).get('v') == kayit['v'] and kodlama in eski[goreli].get('kodlamalar', ())
+                            and os.path.isfile(hedef)):
+                        kayit['kodlamalar'].append(kodlama)
+                        continue
+                    veri = sikistir(icerik)
+                    if len(veri) >= len(icerik):
+                        continue
+                    with open(hedef, 'wb') as f:
+                        f.write(veri)
+                    kayit['kodlamalar'].append(kodlama)
+                    istatistik['kazanc'] += len(icerik) - len(veri)
+                if kayit['kodlamalar']:
+                    istatistik['sikistirilan'] += 1
+            manifest[goreli] = kayit
+
+    # Kaynağı silinmiş ya da artık kayıtlı olmayan sıkıştırılmış kardeşleri temizle
+    for goreli, kayit in eski.items():
+        for kodlama, uzanti in (('br', '.br'), ('gzip', '.gz')):
+            if kodlama in kayit.get('kodlamalar', ()) and kodlama not in manifest.get(goreli, {}).get('kodlamalar', ()):
+                try:
+                    os.remove(os.path.join(kok, goreli + uzanti))
+                except OSError:
+                    pass
+    asset_manifest.replace(manifest)
+    return istatistik
+
+@app.cli.command('asset-derle')
+def asset_derle_command():
+    # Yayına almadan önce (ve resim-turevleri'nden sonra) çalıştırılır
+    istatistik = build_asset_manifest()
+    print(f"{istatistik['dosya']} dosya manifeste yazıldı, {istatistik['sikistirilan']} dosya sıkıştırıldı "
+          f"({istatistik['kazanc'] // 1024} KB kazanç). Brotli: {'var' if brotli else 'yok'}")
+
+# --- ÜRÜN GÖRSELLERİ ---
+# static/img altındaki ürün resimleri 700-900 KB'lık PNG'ler. Her kaynak için
+# küçük (sepet), kart (liste/arama) ve detay boyutunda WebP türevleri üretilir.
+# Dosya adları içerik özetini taşır (simit-3fa1c2d4e5b6-card.webp), böylece
+# resim değişince URL de değişir ve tarayıcı önbelleği güvenle uzun tutulabilir.
+# Hangi kaynağın hangi türevlere karşılık geldiği manifest.json'da durur;
+# şablonlar resim_url() ile türevi seçer, türev yoksa orijinale düşer.
+try:
+    from PIL import Image, ImageOps
+except ImportError:   # Pillow yoksa türev üretilmez, orijinal resimler sunulur
+    Image = ImageOps = None
+
+image_config = {
+    'kaynak_klasor': 'img',            # static/ altına göre
+    'turev_klasor': 'img/turev',
+    'boyutlar': {
+        'thumb': (160, 160, True),     # genişlik, yükseklik, kırp (kare kesit)
+        'card': (480, 360, True),
+        'detail': (1200, 900, False)   # sadece küçült, oranı koru
+    },
+    'format': 'WEBP',
+    'kalite': 80,
+    'uzantilar': ('.png', '.jpg', '.jpeg', '.webp'),
+    'manifest_kontrol': 5              # sn; manifest dosyası en fazla bu sıklıkla yeniden okunur
+}
+
+image_manifest = JsonManifest(os.path.join(app.static_folder, image_config['turev_klasor'], 'manifest.json'),
+                              image_config['manifest_kontrol'])
+
+def resim_kaynagi(resim):
+    # urun.resim değerini static/ altındaki göreli yola çevirir.
+    # 'img/simit.png', '/static/img/simit.png', 'simit.png' kabul edilir; harici URL'ler None döner.
+    if not resim or re.match(r'^[a-z]+:|^//', resim, re.I):
+        return None
+    yol = resim.split('?', 1)[0].lstrip('/')
+    if yol.startswith('static/'):
+        yol = yol[len('static/'):]
+    if '/' not in yol:
+        yol = f"{image_config['kaynak_klasor']}/{yol}"
+    tam = os.path.normpath(os.path.join(app.static_folder, yol))
+    if not tam.startswith(os.path.normpath(app.static_folder) + os.sep):
+        return None
+    return yol
+
+def build_image_variants(resim, zorla=False):
+    # Dönüş: 'yok' (yerel dosya değil/bulunamadı), 'guncel', 'uretildi', 'pillow-yok'
+    kaynak = resim_kaynagi(resim)
+    tam = kaynak and os.path.join(app.static_folder, kaynak)
+    if not tam or not os.path.isfile(tam):
+        return 'yok'
+    with open(tam, 'rb') as f:
+        ozet = hashlib.sha256(f.read()).hexdigest()[:12]
+
+    eski = image_manifest.get(kaynak) or {}
+    turev_klasor = os.path.join(app.static_folder, image_config['turev_klasor'])
+    if not zorla and eski.get('ozet') == ozet and all(
+            os.path.isfile(os.path.join(app.static_folder, eski.get(b, '')))
+            for b in image_config['boyutlar']):
+        return 'guncel'
+    if Image is None:
+        return 'pillow-yok'
+
+    os.makedirs(turev_klasor, exist_ok=True)
+    ad = os.path.splitext(os.path.basename(kaynak))[0]
+    uzanti = image_config['format'].lower()
+    kayit = {'ozet': ozet}
+    with Image.open(tam) as img:
+        img = ImageOps.exif_transpose(img)
+        img = img.convert('RGBA' if 'A' in img.getbands() else 'RGB')
+        for boyut, (genislik, yukseklik, kirp) in image_config['boyutlar'].items():
+            if kirp:
+                turev = ImageOps.fit(img, (genislik, yukseklik), Image.LANCZOS)
+            else:
+                turev = img.copy()
+                turev.thumbnail((genislik, yukseklik), Image.LANCZOS)
+            dosya = f"{image_config['turev_klasor']}/{ad}-{ozet}-{boyut}.{uzanti}"
+            turev.save(os.path.join(app.static_folder, dosya), image_config['format'],
+                       quality=image_config['kalite'], method=6)
+            kayit[boyut] = dosya
+            kayit[f'{boyut}_olcu'] = list(turev.size)
+    image_manifest.update(kaynak, kayit)
+
+    # Önceki içeriğe ait türevler artık referans almıyor
+    for boyut in image_config['boyutlar']:
+        if eski.get(boyut) and eski[boyut] != kayit[boyut]:
+            try:
+                os.remove(os.path.join(app.static_folder, eski[boyut]))
+            except OSError:
+                pass
+    return 'uretildi'
+
+def refresh_urun_resmi(resim):
+    # Admin formlarından transaction dışında çağrılır; resim işlenemese de ürün kaydı geçerlidir
+    try:
+        sonuc = build_image_variants(resim)
+    except Exception as err:
+        print(f"Resim türevleri üretilemedi ({resim}): {err}")
+        flash(f'Resim türevleri üretilemedi: {err}', 'warning')
+        return
+    if sonuc == 'pillow-yok':
+        flash('Pillow kurulu olmadığı için resim türevleri üretilmedi, orijinal resim kullanılacak.', 'warning')
+
+def resim_url(resim, boyut='card'):
+    kaynak = resim_kaynagi(resim)
+    if kaynak is None:
+        return resim or f"https://placehold.co/{image_config['boyutlar'][boyut][0]}x{image_config['boyutlar'][boyut][1]}?text=Urun"
+    kayit = image_manifest.get(kaynak)
+    if kayit and kayit.get(boyut):
+        return static_url(kayit[boyut])
+    return static_url(kaynak)
+
+@app.cli.command('resim-turevleri')
+@click.option('--zorla', is_flag=True, help='Güncel olanlar dahil tüm türevleri yeniden üret.')
+def resim_turevleri_command(zorla):
+    # static/img altındaki tüm resimler için türevleri üretir (içerik değişmediyse atlar)
+    if Image is None:
+        print("Pillow kurulu değil: pip install Pillow")
+        return
+    klasor = os.path.join(app.static_folder, image_config['kaynak_klasor'])
+    sayac = {}
+    for ad in sorted(os.listdir(klasor)):
+        if not ad.lower().endswith(image_config['uzantilar']):
+            continue
+        baslangic = time.perf_counter()
+        sonuc = build_image_variants(f"{image_config['kaynak_klasor']}/{ad}", zorla=zorla)
+        sayac[sonuc] = sayac.get(sonuc, 0) + 1
+        if sonuc == 'uretildi':
+            kayit = image_manifest.get(f"{image_config['kaynak_klasor']}/{ad}")
+            boyutlar = []
+            for boyut in image_config['boyutlar']:
+                boyutlar.append(f"{boyut}={os.path.getsize(os.path.join(app.static_folder, kayit[boyut])) // 1024} KB")
+            orijinal = os.path.getsize(os.path.join(klasor, ad)) // 1024
+            print(f"{ad}: {orijinal} KB -> {', '.join(boyutlar)} ({(time.perf_counter() - baslangic) * 1000:.0f} ms)")
+    print(", ".join(f"{k}={v}" for k, v in sayac.items()) or "İşlenecek resim yok.")
+    if sayac.get('uretildi'):
+        # Önbellekteki ürün kartları yeni türev URL'lerini kullansın
+        conn = get_db_connection()
+        if conn:
+            try:
+                catalog_cache.invalidate(conn.cursor())
+                conn.commit()
+            finally:
+                conn.close()
+
+# --- SATIŞ RAPORLARI ---
+# Raporlar canlı siparis/siparis_detay tablolarından değil, günlük özet (rollup)
+# tablolarından okunur. 'flask rapor-guncelle' (ve uygulama içindeki periyodik
+# görev) son işlenen sipariş id'sinden sonraki siparişlerin günlerini ve durumu
+# hâlâ değişebilecek son 'yeniden_hesap_gun' günü yeniden hesaplar. Satırlar
+# parti parti okunup NumPy dizilerine çevrilir; gruplama np.unique + np.bincount
+# ile yapılır (satır satır Python döngüsü yok). Tutarlar kuruş cinsinden tam
+# sayı olarak toplanır.
+try:
+    import numpy as np
+except ImportError:   # Rapor sayfası özet tablolardan okur; sadece güncelleme numpy ister
+    np = None
+
+analytics_config = {
+    'enabled': True,
+    'interval': 900,               # sn; uygulama içinde özetlerin güncellenme sıklığı
+    'batch_size': 50000,           # bir seferde okunan satır
+    'yeniden_hesap_gun': 3,        # durum değişikliği (iptal vb.) için geriye dönük yeniden hesaplanan gün
+    'varsayilan_gun': 30           # rapor sayfasının varsayılan aralığı
+}
+RAPOR_HARIC_DURUMLAR = ('IPTAL_EDILDI', 'REDDEDILDI')
+
+def _grupla(anahtar, *degerler):
+    # GROUP BY anahtar, SUM(deger...) karşılığı
+    anahtarlar, ters = np.unique(anahtar, return_inverse=True)
+    return (anahtarlar,) + tuple(np.bincount(ters, weights=d, minlength=len(anahtarlar)) for d in degerler)
+
+class RollupAccumulator:
+    # Partilerin kısmi toplamlarını biriktirir; sonunda tek seferde yeniden toplar
+    def __init__(self, alan_sayisi):
+        self.anahtarlar = []
+        self.degerler = [[] for _ in range(alan_sayisi)]
+
+    def add(self, anahtar, *degerler):
+        if len(anahtar) == 0:
+            return
+        sonuc = _grupla(anahtar, *degerler)
+        self.anahtarlar.append(sonuc[0])
+        for liste, toplam in zip(self.degerler, sonuc[1:]):
+            liste.append(toplam)
+
+    def result(self):
+        if not self.anahtarlar:
+            return np.array([], dtype=np.int64), [np.array([]) for _ in self.degerler]
+        sonuc = _grupla(np.concatenate(self.anahtarlar), *[np.concatenate(l) for l in self.degerler])
+        return sonuc[0], [np.rint(d).astype(np.int64) for d in sonuc[1:]]
+
+def _kolonlar(satirlar, tipler):
+    return [np.array(kolon, dtype=tip) for kolon, tip in zip(zip(*satirlar), tipler)]
+
+def _partiler(conn, sorgu, params, parti):
+    # Havuz bağlantıları buffered açıldığından bu taramalar ayrı, buffered olmayan
+    # imleçle yapılır: satırlar sunucudan parti parti okunur, bellek partiyle sınırlı.
+    # İmleç sonuna kadar tüketilir; sonraki sorgu "Unread result" hatası almaz.
+    tarama = conn.cursor(buffered=False)
+    try:
+        tarama.execute(sorgu, params)
+        while True:
+            satirlar = tarama.fetchmany(parti)
+            if not satirlar:
+                break
+            yield satirlar
+    finally:
+        try:
+            # Hata yolunda okunmamış satırlar kalabilir; close() öncesi boşaltılır
+            if tarama.with_rows:
+                tarama.fetchall()
+        except mysql.connector.Error:
+            pass
+        tarama.close()
+
+def rollup_baslangic(cursor, tam=False):
+    # Dönüş: (başlangıç günü TO_DAYS, yeni filigran) ya da hiç sipariş yoksa (None, None)
+    cursor.execute("SELECT MAX(id) FROM siparis")
+    son_id = cursor.fetchone()[0]
+    if son_id is None:
+        return None, None
+    if tam:
+        cursor.execute("SELECT TO_DAYS(MIN(tarih)) FROM siparis")
+        return cursor.fetchone()[0], son_id
+
+    cursor.execute("SELECT deger FROM rapor_isaret WHERE anahtar='son_siparis_id'")
+    row = cursor.fetchone()
+    filigran = row[0] if row else 0
+    cursor.execute("SELECT TO_DAYS(CURDATE()) - %s", (analytics_config['yeniden_hesap_gun'],))
+    baslangic = cursor.fetchone()[0]
+    if filigran < son_id:
+        # Yeni siparişler PK aralığından; normalde bugüne düşer, geç yazılmış eski tarihli olabilir
+        cursor.execute("SELECT TO_DAYS(MIN(tarih)) FROM siparis WHERE id > %s", (filigran,))
+        yeni_gun = cursor.fetchone()[0]
+        if yeni_gun is not None:
+            baslangic = min(baslangic, yeni_gun)
+    return baslangic, son_id
+
+def build_sales_rollups(conn, tam=False):
+    if np is None:
+        raise RuntimeError("numpy kurulu değil: pip install numpy")
+    parti = analytics_config['batch_size']
+    cursor = conn.cursor()
+    if conn.in_transaction:
+        conn.rollback()
+    # Okumalar ve yazımlar tek transaction: rapor sayfası yarım güncellenmiş özet görmez
+    conn.start_transaction()
+    try:
+        baslangic, son_id = rollup_baslangic(cursor, tam)
+        if baslangic is None:
+            conn.rollback()
+            return {'gun': 0, 'siparis': 0, 'detay': 0}
+
+        # Siparişler: gün başına sayılar ve tutarlar (kuruş)
+        gunluk = RollupAccumulator(5)   # siparis, iptal, kuponlu, indirim, net
+        kupon = RollupAccumulator(3)    # siparis, indirim, net
+        kupon_kodlari = {}
+        siparis_sayisi = 0
+        for satirlar in _partiler(conn, f"""
+            SELECT TO_DAYS(tarih), durum IN ({_in_clause(RAPOR_HARIC_DURUMLAR)}),
+                   CAST(ROUND(toplam_tutar * 100) AS SIGNED),
+                   CAST(ROUND(COALESCE(indirim_tutari, 0) * 100) AS SIGNED),
+                   COALESCE(kupon_kodu, '')
+            FROM siparis
+            WHERE tarih >= FROM_DAYS(%s) AND id <= %s
+        """, RAPOR_HARIC_DURUMLAR + (baslangic, son_id), parti):
+            siparis_sayisi += len(satirlar)
+            gun, iptal, net, indirim, kodlar = _kolonlar(satirlar, (np.int64, bool, np.int64, np.int64, object))
+            gecerli = ~iptal
+            kuponlu = kodlar != ''
+            gunluk.add(gun, gecerli.astype(np.int64), iptal.astype(np.int64), (gecerli & kuponlu).astype(np.int64),
+                       np.where(gecerli, indirim, 0), np.where(gecerli, net, 0))
+
+            secili = gecerli & kuponlu
+            if secili.any():
+                benzersiz, ters = np.unique(kodlar[secili].astype(str), return_inverse=True)
+                kod_idx = np.array([kupon_kodlari.setdefault(str(k), len(kupon_kodlari)) for k in benzersiz], dtype=np.int64)
+                anahtar = (gun[secili] << 16) | kod_idx[ters]
+                kupon.add(anahtar, np.ones(len(anahtar), dtype=np.int64), indirim[secili], net[secili])
+
+        # Sipariş kalemleri: gün + ürün başına adet ve ciro
+        urun_gunluk = RollupAccumulator(3)   # siparis, adet, ciro
+        detay_sayisi = 0
+        for satirlar in _partiler(conn, f"""
+            SELECT TO_DAYS(s.tarih), d.urun_id, d.adet, CAST(ROUND(d.adet * d.birim_fiyat * 100) AS SIGNED)
+            FROM siparis s
+            JOIN siparis_detay d ON d.siparis_id = s.id
+            WHERE s.tarih >= FROM_DAYS(%s) AND s.id <= %s AND s.durum NOT IN ({_in_clause(RAPOR_HARIC_DURUMLAR)})
+        """, (baslangic, son_id) + RAPOR_HARIC_DURUMLAR, parti):
+            detay_sayisi += len(satirlar)
+            gun, urun_id, adet, ciro = _kolonlar(satirlar, (np.int64, np.int64, np.int64, np.int64))
+            urun_gunluk.add((gun << 32) | urun_id, np.ones(len(gun), dtype=np.int64), adet, ciro)
+
+        g_anahtar, (g_siparis, g_iptal, g_kuponlu, g_indirim, g_net) = gunluk.result()
+        u_anahtar, (u_siparis, u_adet, u_ciro) = urun_gunluk.result()
+        k_anahtar, (k_siparis, k_indirim, k_net) = kupon.result()
+        u_gun, u_urun = u_anahtar >> 32, u_anahtar & 0xFFFFFFFF
+
+        # Günlük brüt ciro ve adet, ürün satırlarının gün bazında toplamı
+        b_gun, b_adet, b_ciro = _grupla(u_gun, u_adet, u_ciro) if len(u_gun) else ([], [], [])
+        brut = {int(g): (int(a), int(c)) for g, a, c in zip(b_gun, b_adet, b_ciro)}
+
+        cursor.execute("SELECT id, kategori_id FROM urun")
+        kategoriler = dict(cursor.fetchall())
+        kod_adlari = {v: k for k, v in kupon_kodlari.items()}
+
+        for tablo in ('rapor_gunluk', 'rapor_urun_gunluk', 'rapor_kupon_gunluk'):
+            cursor.execute(f"DELETE FROM {tablo} WHERE gun >= FROM_DAYS(%s)", (baslangic,))
+        cursor.executemany("""
+            INSERT INTO rapor_gunluk (gun, siparis_sayisi, iptal_sayisi, kuponlu_siparis, adet, brut_ciro, indirim, net_ciro)
+            VALUES (FROM_DAYS(%s), %s, %s, %s, %s, %s / 100, %s / 100, %s / 100)
+        """, [(int(g), int(s), int(i), int(k), brut.get(int(g), (0, 0))[0], brut.get(int(g), (0, 0))[1], int(ind), int(n))
+              for g, s, i, k, ind, n in zip(g_anahtar, g_siparis, g_iptal, g_kuponlu, g_indirim, g_net)])
+        cursor.executemany("""
+            INSERT INTO rapor_urun_gunluk (gun, urun_id, kategori_id, siparis_sayisi, adet, ciro)
+            VALUES (FROM_DAYS(%s), %s, %s, %s, %s, %s / 100)
+        """, [(int(g), int(u), kategoriler.get(int(u)), int(s), int(a), int(c))
+              for g, u, s, a, c in zip(u_gun, u_urun, u_siparis, u_adet, u_ciro)])
+        cursor.executemany("""
+            INSERT INTO rapor_kupon_gunluk (gun, kupon_kodu, siparis_sayisi, indirim, net_ciro)
+            VALUES (FROM_DAYS(%s), %s, %s, %s / 100, %s / 100)
+        """, [(int(a >> 16), kod_adlari[int(a & 0xFFFF)], int(s), int(i), int(n))
+              for a, s, i, n in zip(k_anahtar, k_siparis, k_indirim, k_net)])
+        cursor.execute("""
+            INSERT INTO rapor_isaret (anahtar, deger) VALUES ('son_siparis_id', %s)
+            ON DUPLICATE KEY UPDATE deger = VALUES(deger)
+        """, (son_id,))
+        conn.commit()
+        return {'gun': len(g_anahtar), 'siparis': siparis_sayisi, 'detay': detay_sayisi}
+    except Exception:
+        conn.rollback()
+        raise
+
+_rapor_stop = threading.Event()
+
+def run_rapor_rollup(stop_event=None):
+    stop_event = stop_event or _rapor_stop
+    while not stop_event.wait(analytics_config['interval']):
+        try:
+            with app.app_context():
+                conn = get_db_connection()
+                if conn:
+                    try:
+                        build_sales_rollups(conn)
+                    finally:
+                        conn.close()
+        except Exception as err:
+            print(f"Satış özetleri güncellenemedi: {err}")
+
+@app.cli.command('rapor-guncelle')
+@click.option('--tam', is_flag=True, help='Tüm geçmişi baştan hesapla.')
+def rapor_guncelle_command(tam):
+    conn = get_db_connection()
+    if not conn:
+        print("Veritabanı bağlantısı yok.")
+        return
+    baslangic = time.perf_counter()
+    try:
+        sonuc = build_sales_rollups(conn, tam=tam)
+    finally:
+        conn.close()
+    print(f"{sonuc['siparis']} sipariş, {sonuc['detay']} kalem işlendi; {sonuc['gun']} gün güncellendi "
+          f"({(time.perf_counter() - baslangic) * 1000:.0f} ms).")
+
+def fetch_satis_raporu(cursor, baslangic, bitis, donem='gun'):
+    # Sadece rapor_* özet tablolarını okur
+    aralik = (baslangic, bitis)
+    cursor.execute("""
+        SELECT COALESCE(SUM(siparis_sayisi), 0) AS siparis, COALESCE(SUM(iptal_sayisi), 0) AS iptal,
+               COALESCE(SUM(kuponlu_siparis), 0) AS kuponlu, COALESCE(SUM(adet), 0) AS adet,
+               COALESCE(SUM(brut_ciro), 0) AS brut, COALESCE(SUM(indirim), 0) AS indirim,
+               COALESCE(SUM(net_ciro), 0) AS net
+        FROM rapor_gunluk WHERE gun BETWEEN %s AND %s
+    """, aralik)
+    ozet = cursor.fetchone()
+    ozet['aov'] = round(float(ozet['net']) / int(ozet['siparis']), 2) if ozet['siparis'] else 0
+    tum = int(ozet['siparis']) + int(ozet['iptal'])
+    ozet['iptal_orani'] = round(100.0 * int(ozet['iptal']) / tum, 1) if tum else 0
+
+    etiket = "DATE_FORMAT(gun, '%Y-%m')" if donem == 'ay' else "gun"
+    cursor.execute(f"""
+        SELECT {etiket} AS donem, SUM(siparis_sayisi) AS siparis, SUM(adet) AS adet,
+               SUM(brut_ciro) AS brut, SUM(indirim) AS indirim, SUM(net_ciro) AS net
+        FROM rapor_gunluk WHERE gun BETWEEN %s AND %s
+        GROUP BY donem ORDER BY donem DESC
+    """, aralik)
+    donemler = cursor.fetchall()
+    en_yuksek = max([d['net'] for d in donemler] or [0])
+    for d in donemler:
+        d['aov'] = round(float(d['net']) / int(d['siparis']), 2) if d['siparis'] else 0
+        d['oran'] = round(100.0 * float(d['net']) / float(en_yuksek)) if en_yuksek else 0
+
+    # Ürün/kategori adları katalog anlık görüntüsünden; özet tablolar dışında tabloya gidilmez
+    katalog = catalog_cache.get() or {'urunler': {}, 'kategori_adlari': {}}
+    cursor.execute("""
+        SELECT urun_id, SUM(siparis_sayisi) AS siparis, SUM(adet) AS adet, SUM(ciro) AS ciro
+        FROM rapor_urun_gunluk WHERE gun BETWEEN %s AND %s
+        GROUP BY urun_id ORDER BY ciro DESC
+    """, aralik)
+    urunler = cursor.fetchall()
+    for u in urunler:
+        u['ad'] = (katalog['urunler'].get(u['urun_id']) or {}).get('ad', f"#{u['urun_id']}")
+
+    cursor.execute("""
+        SELECT kategori_id, SUM(siparis_sayisi) AS siparis, SUM(adet) AS adet, SUM(ciro) AS ciro
+        FROM rapor_urun_gunluk WHERE gun BETWEEN %s AND %s
+        GROUP BY kategori_id ORDER BY ciro DESC
+    """, aralik)
+    kategoriler = cursor.fetchall()
+    for k in kategoriler:
+        k['ad'] = katalog['kategori_adlari'].get(k['kategori_id'], '-')
+
+    cursor.execute("""
+        SELECT kupon_kodu, SUM(siparis_sayisi) AS siparis, SUM(indirim) AS indirim, SUM(net_ciro) AS net
+        FROM rapor_kupon_gunluk WHERE gun BETWEEN %s AND %s
+        GROUP BY kupon_kodu ORDER BY indirim DESC
+    """, aralik)
+    kuponlar = cursor.fetchall()
+
+    cursor.execute("SELECT guncelleme FROM rapor_isaret WHERE anahtar='son_siparis_id'")
+    row = cursor.fetchone()
+    return {'ozet': ozet, 'donemler': donemler, 'urunler': urunler, 'kategoriler': kategoriler,
+            'kuponlar': kuponlar, 'guncelleme': row['guncelleme'] if row else None}
+
+# --- ÜRETİM PLANI ---
+# Yarın kaç simit/poğaça/börek pişirilmeli? stok_hareketi'ndeki SATIS (-) ve
+# IADE (+) hareketlerinden ürün x gün net talep matrisi kurulur; tüm ürünler için
+# birlikte (NumPy dizileriyle) haftanın günü katsayıları ve üstel ağırlıklı seviye
+# hesaplanır. Tahmin + güvenlik payı hedef stoku verir; önerilen üretim hedefin
+# (en az kritik seviye) mevcut stoktan fazlasıdır. Gece 'flask uretim-plani' ile
+# çalıştırılır, admin_urunler son planı gösterir.
+production_config = {
+    'gecmis_gun': 364,          # talep geçmişi (haftanın günü katsayıları için)
+    'seviye_yari_omur': 7,      # gün; seviye tahmininde ağırlıkların yarılanma süresi
+    'seviye_gun': 28,           # seviye ve sapma için bakılan son gün sayısı
+    'katsayi_cekme': 4,         # hafta; az geçmişi olan ürünlerin katsayısı genel profile çekilir
+    'guvenlik_z': 1.28          # ~%90 hizmet seviyesi
+}
+
+def demand_matrix(urun_idleri, gun_idx, miktarlar, gun_sayisi):
+    # (urun_id, gün, miktar) satırlarından ürün x gün matrisi
+    urunler, satir = np.unique(urun_idleri, return_inverse=True)
+    talep = np.zeros((len(urunler), gun_sayisi))
+    np.add.at(talep, (satir, gun_idx), miktarlar)
+    return urunler, talep
+
+def forecast_demand(talep, ilk_hafta_gunu, hedef_hafta_gunu):
+    # talep: ürün x gün (son sütun en yeni gün). Dönüş: (tahmin, sapma) ürün başına
+    cfg = production_config
+    urun_sayisi, gun_sayisi = talep.shape
+    hafta_gunu = (ilk_hafta_gunu + np.arange(gun_sayisi)) % 7
+    birlerde = np.eye(7)[hafta_gunu]                                  # gün x 7
+
+    # Ürünün ilk satışından önceki günler sıfır talep sayılmaz
+    satis_var = talep > 0
+    ilk = np.where(satis_var.any(axis=1), satis_var.argmax(axis=1), gun_sayisi)
+    gecerli = np.arange(gun_sayisi)[None, :] >= ilk[:, None]
+
+    toplam_g = (talep * gecerli) @ birlerde                           # ürün x 7
+    sayi_g = gecerli.astype(float) @ birlerde
+    ortalama = np.divide(toplam_g.sum(axis=1), sayi_g.sum(axis=1), out=np.zeros(urun_sayisi), where=sayi_g.sum(axis=1) > 0)
+    gun_ort = np.divide(toplam_g, sayi_g, out=np.zeros_like(toplam_g), where=sayi_g > 0)
+    katsayi = np.divide(gun_ort, ortalama[:, None], out=np.ones_like(gun_ort), where=ortalama[:, None] > 0)
+
+    # Genel profil (tüm ürünler) ve az gözlemli ürünlerde ona doğru çekme
+    genel_ort = toplam_g.sum(axis=0) / np.maximum(sayi_g.sum(axis=0), 1)
+    genel = genel_ort / genel_ort.mean() if genel_ort.mean() > 0 else np.ones(7)
+    k = cfg['katsayi_cekme']
+    katsayi = (sayi_g * katsayi + k * genel[None, :]) / (sayi_g + k)
+
+    # Son günlerde mevsimsellikten arındırılmış talebin üstel ağırlıklı ortalaması
+    son = slice(max(0, gun_sayisi - cfg['seviye_gun']), gun_sayisi)
+    gun_katsayi = katsayi[:, hafta_gunu[son]]
+    arindirilmis = np.divide(talep[:, son], gun_katsayi, out=np.zeros_like(gun_katsayi), where=gun_katsayi > 0)
+    yas = (gun_sayisi - 1) - np.arange(gun_sayisi)[son]
+    agirlik = 0.5 ** (yas / cfg['seviye_yari_omur'])[None, :] * gecerli[:, son]
+    agirlik_toplam = agirlik.sum(axis=1)
+    seviye = np.divide((arindirilmis * agirlik).sum(axis=1), agirlik_toplam,
+                       out=np.zeros(urun_sayisi), where=agirlik_toplam > 0)
+
+    artik = (arindirilmis - seviye[:, None]) * gecerli[:, son]
+    n = np.maximum(gecerli[:, son].sum(axis=1) - 1, 1)
+    sapma = np.sqrt((artik ** 2).sum(axis=1) / n) * katsayi[:, hedef_hafta_gunu]
+    tahmin = seviye * katsayi[:, hedef_hafta_gunu]
+    return tahmin, sapma
+
+def build_uretim_plani(conn, plan_gunu=None):
+    if np is None:
+        raise RuntimeError("numpy kurulu değil: pip install numpy")
+    cfg = production_config
+    plan_gunu = plan_gunu or date.today() + timedelta(days=1)
+    bitis = plan_gunu - timedelta(days=1)                     # geçmişin son günü (dahil)
+    baslangic = bitis - timedelta(days=cfg['gecmis_gun'] - 1)
+    cursor = conn.cursor()
+
+    # Gün x ürün gruplaması veritabanında (ix_sh_tip_tarih), gerisi dizilerle
+    cursor.execute("""
+        SELECT urun_id, DATEDIFF(created_at, %s) AS gun, -SUM(miktar) AS talep
+        FROM stok_hareketi
+        WHERE hareket_tipi IN ('SATIS', 'IADE') AND created_at >= %s AND created_at < %s
+        GROUP BY urun_id, gun
+    """, (baslangic, baslangic, plan_gunu))
+    satirlar = cursor.fetchall()
+
+    cursor.execute("""
+        SELECT u.id, COALESCE(s.miktar, 0), COALESCE(s.kritik_seviye, 0)
+        FROM urun u
+        LEFT JOIN stok s ON s.urun_id = u.id
+        WHERE u.aktif = 1
+    """)
+    stoklar = cursor.fetchall()
+    if not stoklar:
+        return 0
+    aktif = np.array([r[0] for r in stoklar], dtype=np.int64)
+    miktar = np.array([r[1] for r in stoklar], dtype=np.int64)
+    kritik = np.array([r[2] for r in stoklar], dtype=np.int64)
+
+    tahmin = np.zeros(len(aktif))
+    sapma = np.zeros(len(aktif))
+    if satirlar:
+        urun_idleri, gunler, miktarlar = (np.array(k, dtype=float) for k in zip(*satirlar))
+        urunler, talep = demand_matrix(urun_idleri.astype(np.int64), gunler.astype(np.int64),
+                                       np.maximum(miktarlar, 0), cfg['gecmis_gun'])
+        t, s = forecast_demand(talep, baslangic.weekday(), plan_gunu.weekday())
+        # Geçmişi olan aktif ürünlere eşle (sıralı urunler üzerinde arama)
+        konum = np.searchsorted(urunler, aktif)
+        bulundu = (konum < len(urunler)) & (urunler[np.minimum(konum, len(urunler) - 1)] == aktif)
+        tahmin[bulundu] = t[konum[bulundu]]
+        sapma[bulundu] = s[konum[bulundu]]
+
+    guvenlik = cfg['guvenlik_z'] * sapma
+    hedef = np.maximum(np.ceil(tahmin + guvenlik).astype(np.int64), kritik)
+    oneri = np.maximum(hedef - miktar, 0)
+
+    cursor.execute("DELETE FROM uretim_plani WHERE plan_tarihi=%s", (plan_gunu,))
+    cursor.executemany("""
+        INSERT INTO uretim_plani (plan_tarihi, urun_id, tahmin, guvenlik_payi, hedef_stok, mevcut_stok, kritik_seviye, onerilen_uretim)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    """, [(plan_gunu, int(u), round(float(t), 2), round(float(g), 2), int(h), int(m), int(k), int(o))
+          for u, t, g, h, m, k, o in zip(aktif, tahmin, guvenlik, hedef, miktar, kritik, oneri)])
+    conn.commit()
+    return len(aktif)
+
+@app.cli.command('uretim-plani')
+@click.option('--tarih', default=None, help='Plan günü (YYYY-AA-GG), varsayılan yarın.')
+def uretim_plani_command(tarih):
+    conn = get_db_connection()
+    if not conn:
+        print("Veritabanı bağlantısı yok.")
+        return
+    baslangic = time.perf_counter()
+    try:
+        adet = build_uretim_plani(conn, date.fromisoformat(tarih) if tarih else None)
+    finally:
+        conn.close()
+    print(f"{adet} ürün için üretim planı yazıldı ({(time.perf_counter() - baslangic) * 1000:.0f} ms).")
+
+@app.cli.command('uretim-plani-bench')
+@click.option('--urun', default=5000, help='Ürün sayısı')
+@click.option('--gun', default=730, help='Geçmiş gün sayısı')
+def uretim_plani_bench_command(urun, gun):
+    # Sentetik talep (haftalık desen + gürültü) üzerinde tahminin süresi ve hatası
+    rnd = np.random.default_rng(7)
+    taban = rnd.uniform(5, 200, urun)
+    desen = rnd.uniform(0.6, 1.6, (urun, 7))
+    hafta_gunu = np.arange(gun + 1) % 7
+    gercek = rnd.poisson(taban[:, None] * desen[:, hafta_gunu])
+    baslangic = time.perf_counter()
+    tahmin, _ = forecast_demand(gercek[:, :gun].astype(float), 0, hafta_gunu[gun])
+    sure = time.perf_counter() - baslangic
+    hata = np.abs(tahmin - gercek[:, gun]).sum() / max(gercek[:, gun].sum(), 1)
+    naif = np.abs(gercek[:, gun - 1] - gercek[:, gun]).sum() / max(gercek[:, gun].sum(), 1)
+    print(f"{urun} ürün x {gun} gün: {sure * 1000:.0f} ms, WAPE={hata:.3f} (dünün satışı: {naif:.3f})")
+
+# --- DENETİM KAYITLARI ARŞİVİ ---
+# siparis_durum_log ve stok_hareketi her sipariş/geçişte büyür. Ufuktan eski satırlar
+# PK sırasıyla partiler halinde sıkıştırılmış *_arsiv tablolarına taşınır; sıcak
+# tablolar ve index'leri küçük kalır. (Bu tablolarda yabancı anahtar olduğundan
+# InnoDB bölümlemesi kullanılamıyor.) Okuma tarafı: siparis_detay arşivi de okur,
+# islemlerim sıcak tablo 100 satırı doldurmazsa arşivden tamamlar.
+audit_config = {
+    'enabled': True,
+    'interval': 24 * 3600,      # sn; arka plan arşivleme aralığı
+    'ufuk_gun': 400,            # bundan eski satırlar arşive taşınır
+    'batch_size': 5000,         # transaction başına taşınan satır
+}
+DENETIM_TABLOLARI = {
+    'siparis_durum_log': ('tarih', 'id, siparis_id, eski_durum, yeni_durum, degistiren_id, aciklama, tarih'),
+    'stok_hareketi': ('created_at', 'id, urun_id, siparis_id, hareket_tipi, miktar, aciklama, yapan_id, created_at'),
+}
+ISLEM_GECMISI_LIMIT = 100
+
+def denetim_ufku(tablo, ufuk_gun=None):
+    # Üretim planı talep geçmişini stok_hareketi'nden okur; o pencere arşive taşınmaz.
+    # İstenen ufuk bundan kısaysa alt sınıra çekilir ve uyarılır.
+    ufuk = ufuk_gun or audit_config['ufuk_gun']
+    alt_sinir = production_config['gecmis_gun'] + 7 if tablo == 'stok_hareketi' else 1
+    if ufuk < alt_sinir:
+        print(f"Uyarı: {tablo} arşiv ufku {ufuk} gün üretim planı penceresinden kısa, {alt_sinir} gün kullanılıyor.")
+        return alt_sinir
+    return ufuk
+
+def denetim_sinirlari(ufuk_gun=None):
+    simdi = datetime.now()
+    return {tablo: simdi - timedelta(days=denetim_ufku(tablo, ufuk_gun)) for tablo in DENETIM_TABLOLARI}
+
+def archive_denetim_tablosu(conn, tablo, sinir, batch_size=None):
+    # Satırlar id sırasıyla taranır; ilk ufuk içi satırda durulur (id ~ zaman sırası).
+    # Her parti: kilitle, arşive kopyala, sıcak tablodan sil, commit.
+    tarih_kolonu, kolonlar = DENETIM_TABLOLARI[tablo]
+    batch_size = batch_size or audit_config['batch_size']
+    cursor = conn.cursor()
+    toplam = 0
+    while True:
+        conn.start_transaction()
+        cursor.execute(f"SELECT id, {tarih_kolonu} FROM {tablo} ORDER BY id LIMIT %s FOR UPDATE", (batch_size,))
+        satirlar = cursor.fetchall()
+        son_id = None
+        for satir_id, tarih in satirlar:
+            if tarih >= sinir:
+                break
+            son_id = satir_id
+        if son_id is None:
+            conn.rollback()
+            return toplam
+        cursor.execute(f"INSERT INTO {tablo}_arsiv ({kolonlar}) SELECT {kolonlar} FROM {tablo} WHERE id <= %s",
+                       (son_id,))
+        cursor.execute(f"DELETE FROM {tablo} WHERE id <= %s", (son_id,))
+        toplam += cursor.rowcount
+        conn.commit()
+        if son_id != satirlar[-1][0] or len(satirlar) < batch_size:
+            return toplam
+
+def archive_denetim_kayitlari(conn, ufuk_gun=None, sinirlar=None):
+    sinirlar = sinirlar or denetim_sinirlari(ufuk_gun)
+    return {tablo: archive_denetim_tablosu(conn, tablo, sinir) for tablo, sinir in sinirlar.items()}
+
+def count_eski_denetim(conn, sinirlar):
+    # Arşivleme sonrası kontrol: sıcak tabloda sınırdan eski kalan satır sayısı.
+    # Taşıma id sırasıyla ilerlediğinden geç yazılmış eski tarihli satırlar kalabilir.
+    cursor = conn.cursor()
+    kalan = {}
+    for tablo, sinir in sinirlar.items():
+        cursor.execute(f"SELECT COUNT(*) FROM {tablo} WHERE {DENETIM_TABLOLARI[tablo][0]} < %s", (sinir,))
+        kalan[tablo] = cursor.fetchone()[0]
+    return kalan
+
+def fetch_denetim_gecmisi(cursor, tablo, sorgu, params, limit=ISLEM_GECMISI_LIMIT):
+    # sorgu {tablo} yer tutucusuyla yazılır. Arşivdeki satırlar sıcak tablodakilerden
+    # eski olduğundan sıcak tablo limiti doldurmazsa kalan arşivden eklenir.
+    satirlar = []
+    for ad in (tablo, f'{tablo}_arsiv'):
+        cursor.execute(sorgu.format(tablo=ad) + " LIMIT %s", tuple(params) + (limit - len(satirlar),))
+        satirlar += cursor.fetchall()
+        if len(satirlar) >= limit:
+            break
+    return satirlar
+
+def fetch_siparis_denetimi(cursor, siparis_id):
+    # Sipariş hangi yaşta olursa olsun log ve stok hareketleri sıcak tablo + arşivden okunur
+    # (her ikisinde de siparis_id index'i; taşınmamış siparişte arşiv sorgusu boş döner)
+    log_kolonlari = DENETIM_TABLOLARI['siparis_durum_log'][1]
+    hareket_kolonlari = DENETIM_TABLOLARI['stok_hareketi'][1]
+    # Loglarda degistiren_id hangi tablodan? Rol bilgisi logda yok.
+    # Pratik çözüm: Tüm tablolara left join atıp hangisi doluysa onu alalım.
+    # Not: ID çakışması varsa yanlış isim gelebilir. Ancak bu aşamada yapacak bir şey yok.
+    # İleride log tablosuna 'degistiren_rol' eklenmeli.
+    # Otomatik kurye atamasının sistem hesabı bu tablolarda yok; adı açıkça verilir.
+    cursor.execute(f"""
+        SELECT l.*,
+               CASE WHEN l.degistiren_id = %s THEN 'sistem' ELSE COALESCE(a.k_adi, m.k_adi, k.k_adi) END as k_adi,
+               CASE WHEN l.degistiren_id = %s THEN 'Sistem' ELSE COALESCE(a.ad, m.ad, k.ad) END as ad,
+               CASE WHEN l.degistiren_id = %s THEN '' ELSE COALESCE(a.soyad, m.soyad, k.soyad) END as soyad
+        FROM (
+            SELECT {log_kolonlari} FROM siparis_durum_log WHERE siparis_id=%s
+            UNION ALL
+            SELECT {log_kolonlari} FROM siparis_durum_log_arsiv WHERE siparis_id=%s
+        ) l
+        LEFT JOIN admin a ON l.degistiren_id = a.id
+        LEFT JOIN musteri m ON l.degistiren_id = m.id
+        LEFT JOIN kurye k ON l.degistiren_id = k.id
+        ORDER BY l.tarih ASC, l.id ASC
+    """, (dispatch_config['sistem_kullanici_id'],) * 3 + (siparis_id, siparis_id))
+    loglar = cursor.fetchall()
+
+    cursor.execute(f"""
+        SELECT sh.*, u.ad AS urun_ad
+        FROM (
+            SELECT {hareket_kolonlari} FROM stok_hareketi WHERE siparis_id=%s
+            UNION ALL
+            SELECT {hareket_kolonlari} FROM stok_hareketi_arsiv WHERE siparis_id=%s
+        ) sh
+        JOIN urun u ON u.id = sh.urun_id
+        ORDER BY sh.created_at ASC, sh.id ASC
+    """, (siparis_id, siparis_id))
+    return loglar, cursor.fetchall()
+
+_denetim_stop = threading.Event()
+
+def run_denetim_arsivi(stop_event=None):
+    stop_event = stop_event or _denetim_stop
+    while not stop_event.wait(audit_config['interval']):
+        try:
+            with app.app_context():
+                conn = get_db_connection()
+                if conn:
+                    try:
+                        archive_denetim_kayitlari(conn)
+                    finally:
+                        conn.close()
+        except Exception as err:
+            print(f"Denetim kayıtları arşivlenemedi: {err}")
+
+@app.cli.command('denetim-arsivle')
+@click.option('--ufuk', default=None, type=int, help='Gün; bundan eski satırlar taşınır (varsayılan audit_config ufku; stok_hareketi için üretim planı penceresinden kısaysa ona çekilir)')
+def denetim_arsivle_command(ufuk):
+    conn = get_db_connection()
+    if not conn:
+        print("Veritabanı bağlantısı yok.")
+        return
+    sinirlar = denetim_sinirlari(ufuk)
+    baslangic = time.perf_counter()
+    try:
+        sonuc = archive_denetim_kayitlari(conn, sinirlar=sinirlar)
+        kalan = count_eski_denetim(conn, sinirlar)
+    finally:
+        conn.close()
+    ozet = ', '.join(f"{tablo} ({sinirlar[tablo]:%Y-%m-%d} öncesi): {adet}" for tablo, adet in sonuc.items())
+    print(f"Arşive taşınan satırlar - {ozet} ({(time.perf_counter() - baslangic) * 1000:.0f} ms).")
+    if any(kalan.values()):
+        ozet = ', '.join(f"{tablo}: {adet}" for tablo, adet in kalan.items() if adet)
+        print(f"Uyarı: sınırdan eski olup sıcak tabloda kalan satırlar - {ozet}.")
 
 # --- DECORATORS ---
 def login_required(f):
@@ -45,80 +2550,120 @@ def role_required(allowed_roles):
         return decorated_function
     return decorator
 
+# --- SEPET SAYACI ---
+# Menüdeki sepet rozeti session'da tutulur ve sepet route'ları tarafından artırılıp
+# azaltılır. DB'ye sadece sayaç yoksa veya eskidiyse (başka cihaz/sekme,
+# admin'in ürün silmesi vb.) gidilir.
+def set_sepet_count(adet):
+    session['sepet_count'] = max(0, int(adet))
+    session['sepet_count_at'] = time.time()
+
+def adjust_sepet_count(delta):
+    if 'sepet_count' in session:
+        session['sepet_count'] = max(0, session['sepet_count'] + delta)
+
+def invalidate_sepet_count():
+    session.pop('sepet_count', None)
+    session.pop('sepet_count_at', None)
+
+def reconcile_sepet_count():
+    conn = get_db_connection()
+    if not conn: return session.get('sepet_count', 0)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT SUM(adet) FROM sepet WHERE musteri_id = %s", (session['user_id'],))
+        res = cursor.fetchone()
+        set_sepet_count(res[0] if res and res[0] else 0)
+    finally:
+        conn.close()
+    return session['sepet_count']
+
 @app.context_processor
 def utility_processor():
     def get_sepet_count():
-        if 'user_id' in session:
-            conn = get_db_connection()
-            if not conn: return 0
-            try:
-                cursor = conn.cursor()
-                cursor.execute("SELECT SUM(adet) FROM sepet WHERE musteri_id = %s", (session['user_id'],))
-                res = cursor.fetchone()
-                return int(res[0]) if res and res[0] else 0
-            finally:
-                conn.close()
-        return 0
+        if 'user_id' not in session or session.get('rol') != 'MUSTERI':
+            return 0
+        yas = time.time() - session.get('sepet_count_at', 0)
+        if 'sepet_count' not in session or yas > cache_config['cart_count_ttl']:
+            return reconcile_sepet_count()
+        return session['sepet_count']
 
     def get_site_settings():
-        conn = get_db_connection()
-        settings = {}
-        if conn:
-            try:
-                cursor = conn.cursor(dictionary=True)
-                cursor.execute("SELECT * FROM site_ayarlari WHERE id=1")
-                settings = cursor.fetchone() or {}
-            finally:
-                conn.close()
-        return settings
+        # Ayarlar süreç içi önbellekten gelir; admin_ayarlar güncellemesi sürümü artırır
+        return site_settings_cache.get() or {}
 
-    return dict(sepet_count=get_sepet_count(), site_ayarlari=get_site_settings())
+    return dict(sepet_count=get_sepet_count(), site_ayarlari=get_site_settings(), resim_url=resim_url, static_url=static_url)
 
 # --- ROUTES ---
 
+@app.route('/admin/metrikler')
+@role_required(['ADMIN'])
+def admin_metrikler():
+    metrikler = {'db_pool': db_pool.stats()}
+    conn = get_db_connection()
+    if conn:
+        metrikler['outbox'] = outbox_lag(conn.cursor())
+    metrikler['sse'] = order_events.stats()
+    metrikler['sablon_parcalari'] = fragment_cache.stats()
+    return jsonify(metrikler)
+
+@app.route('/olaylar/siparisler')
+@login_required
+def siparis_olaylari():
+    try:
+        abone = order_events.subscribe(session['rol'], session['user_id'], request.args.get('siparis_id', type=int))
+    except TooManyStreams:
+        return Response('Çok fazla açık bağlantı.', status=429, mimetype='text/plain')
+
+    def akis():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    olay = abone.kuyruk.get(timeout=sse_config['heartbeat'])
+                except queue.Empty:
+                    yield ": ping\n\n"
+                    continue
+                if olay is None:
+                    yield "event: yenile\ndata: {}\n\n"
+                    return
+                yield f"event: siparis\ndata: {json.dumps(olay)}\n\n"
+        finally:
+            order_events.unsubscribe(abone)
+
+    return Response(akis(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/ara')
 def ara():
     query = request.args.get('q', '').strip()
+    sirala = 'puan' if request.args.get('sirala') == 'puan' else 'ilgili'
     urunler = []
     if query:
-        conn = get_db_connection()
-        if conn:
-            try:
-                cursor = conn.cursor(dictionary=True)
-                like = f"%{query}%"
-                cursor.execute("""
-                    SELECT * FROM urun 
-                    WHERE aktif=1 AND (ad LIKE %s OR aciklama LIKE %s)
-                    ORDER BY ad
-                """, (like, like))
-                urunler = cursor.fetchall()
-            finally:
-                conn.close()
-    return render_template('arama_sonuc.html', query=query, urunler=urunler)
+        # LIKE '%q%' yerine katalog anlık görüntüsü üzerindeki ters indeks
+        katalog = catalog_cache.get()
+        if katalog:
+            search_index.sync(katalog)
+            stoklar = stock_cache.get() or {}
+            # Başka bir istek indeksi bu arada daha yeni kataloğa taşımış olabilir;
+            # bu anlık görüntüde olmayan ürünler atlanır
+            bulunanlar = (katalog['urunler'].get(uid) for uid in search_index.search(query))
+            urunler = [with_stok_kovasi(urun, stoklar) for urun in bulunanlar if urun]
+            if sirala == 'puan':
+                urunler.sort(key=puan_sirasi)
+    etag = page_etag('ara', catalog_cache.version, query, sirala, tuple((u['id'], u['stok_kovasi']) for u in urunler))
+    return not_modified(etag) or with_etag(render_template('arama_sonuc.html', query=query, sirala=sirala, urunler=urunler), etag)
 
 @app.route('/')
 def index():
-    conn = get_db_connection()
-    if not conn: return "Veritabanı bağlantısı yok.", 500
-    cursor = conn.cursor(dictionary=True)
-    
-    # Kategorileri getir
-    cursor.execute("SELECT * FROM kategori WHERE aktif = 1 ORDER BY id")
-    kategoriler = cursor.fetchall()
-    
-    # Tüm aktif ürünleri getir (kategori bilgisiyle)
-    cursor.execute("""
-        SELECT u.*, k.ad as kategori_adi,
-               (SELECT miktar FROM stok s WHERE s.urun_id = u.id) as stok_durumu 
-        FROM urun u 
-        JOIN kategori k ON u.kategori_id = k.id
-        WHERE u.aktif = 1
-        ORDER BY u.kategori_id, u.id
-    """)
-    urunler = cursor.fetchall()
-    conn.close()
-    
-    return render_template('index.html', kategoriler=kategoriler, urunler=urunler)
+    # Kategoriler ve aktif ürünler (stok durumuyla) katalog önbelleğinden gelir
+    kategoriler, urunler, gruplar = get_catalog_products()
+    if kategoriler is None: return "Veritabanı bağlantısı yok.", 500
+
+    sirala = 'puan' if request.args.get('sirala') == 'puan' else 'varsayilan'
+    etag = page_etag('index', catalog_cache.version, sirala, tuple((k, grup['imza']) for k, grup in sorted(gruplar.items())))
+    return not_modified(etag) or with_etag(
+        render_template('index.html', kategoriler=kategoriler, urunler=urunler, gruplar=gruplar, sirala=sirala), etag)
 
 @app.route('/hakkimizda')
 def hakkimizda():
@@ -170,6 +2715,7 @@ def login():
             session['k_adi'] = user['k_adi']
             session['rol'] = rol
             session['email'] = user.get('email', '')  # E-posta otomatik doldurma için
+            invalidate_sepet_count()
             
             flash(f"Hoşgeldin {user['ad']}", 'success')
             if rol == 'ADMIN': return redirect(url_for('admin_panel'))
@@ -206,6 +2752,7 @@ def register():
                     INSERT INTO musteri (k_adi, sifre, ad, soyad, email, telefon, aktif, puan)
                     VALUES (%s, %s, %s, %s, %s, %s, 1, 0)
                 """, (k_adi, sifre, ad, soyad, email, telefon))
+                adjust_panel_sayac(cursor, 'musteri', 1)
                 conn.commit()
                 success = True
                 break
@@ -241,53 +2788,48 @@ def urun_detay(id):
     conn = get_db_connection()
     if not conn:
         return "Veritabanı bağlantısı yok.", 500
-    cursor = conn.cursor(dictionary=True)
-    
-    cursor.execute("SELECT * FROM urun WHERE id=%s", (id,))
-    urun = cursor.fetchone()
-    
-    if not urun:
-        conn.close()
-        return "Ürün yok", 404
-    
-    cursor.execute("SELECT ad FROM kategori WHERE id=%s", (urun['kategori_id'],))
-    kat = cursor.fetchone()
-    
-    # Stok durumu
-    cursor.execute("SELECT miktar FROM stok WHERE urun_id=%s", (id,))
-    stok_res = cursor.fetchone()
-    stok_adet = stok_res['miktar'] if stok_res else 0
-
-    # Favori ve yorum izni (daha önce satın aldı mı)
-    favoride = False
-    yorum_izni = False
-    if session.get('user_id'):
-        cursor.execute("SELECT 1 FROM favoriler WHERE musteri_id=%s AND urun_id=%s", (session['user_id'], id))
-        favoride = cursor.fetchone() is not None
-        cursor.execute("""
-            SELECT s.id
-            FROM siparis_detay sd
-            JOIN siparis s ON s.id = sd.siparis_id
-            WHERE s.musteri_id=%s AND sd.urun_id=%s AND s.durum NOT IN ('IPTAL_EDILDI','REDDEDILDI')
-            ORDER BY s.tarih DESC
-            LIMIT 1
-        """, (session['user_id'], id))
-        yorum_izni = cursor.fetchone() is not None
-        
-    # Yorumları Çek (Onaylılar + Kendi Yorumlarım)
-    uid = session.get('user_id', -1)
-    cursor.execute("""
-        SELECT y.*, m.ad, m.soyad 
-        FROM yorum y 
-        JOIN musteri m ON y.musteri_id = m.id 
-        WHERE y.urun_id=%s AND (y.onay_durumu=1 OR y.musteri_id=%s)
-        ORDER BY y.tarih DESC
-    """, (id, uid))
-    yorumlar = cursor.fetchall()
-    
-    conn.close()
-    # Varyant YOK, direkt ürün gönderiyoruz
-    return render_template('urun_detay.html', urun=urun, kategori=kat, stok=stok_adet, favoride=favoride, yorum_izni=yorum_izni, yorumlar=yorumlar)
+    cursor = conn.cursor(dictionary=True)
+
+    try:
+        urun, kat, stok_adet, onbellekten = load_urun_detay(cursor, id)
+        if not urun:
+            return "Ürün yok", 404
+
+        # Favori ve yorum izni (daha önce satın aldı mı); sonuçları ETag'e de girer
+        favoride = False
+        yorum_izni = False
+        musteri_id = session.get('user_id') if session.get('rol') == 'MUSTERI' else None
+        if musteri_id:
+            favoride, yorum_izni = fetch_urun_kullanici_durumu(cursor, id, musteri_id)
+
+        etag = None
+        if onbellekten:
+            review_version_cache.get()
+            etag = page_etag('urun', id, catalog_cache.version, stok_adet, review_version_cache.version, favoride, yorum_izni)
+            cevap = not_modified(etag)
+            if cevap:
+                return cevap
+
+        # Yorumlar: onaylılardan ilk sayfa (devamı urun_yorumlari ile) + kendi onay bekleyenlerim
+        yorumlar, sonraki = fetch_urun_yorumlari(cursor, id)
+        if musteri_id:
+            yorumlar = fetch_bekleyen_yorumlarim(cursor, id, musteri_id) + yorumlar
+    finally:
+        conn.close()
+    return with_etag(render_template('urun_detay.html', urun=urun, kategori=kat, stok=stok_adet, favoride=favoride,
+                                     yorum_izni=yorum_izni, yorumlar=yorumlar, sonraki=sonraki), etag)
+
+@app.route('/urun/<int:id>/yorumlar')
+def urun_yorumlari(id):
+    # "Daha fazla yorum" için sonraki sayfa: HTML parçası + sonraki imleç
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'hata': 'Veritabanı bağlantısı yok.'}), 503
+    try:
+        yorumlar, sonraki = fetch_urun_yorumlari(conn.cursor(dictionary=True), id, request.args.get('once'))
+    finally:
+        conn.close()
+    return jsonify({'html': render_template('_yorum_listesi.html', yorumlar=yorumlar), 'sonraki': sonraki})
 
 @app.route('/sepet', methods=['GET', 'POST'])
 @login_required
@@ -326,6 +2868,7 @@ def sepet():
     items = cursor.fetchall()
     
     toplam = sum(i['toplam'] for i in items)
+    set_sepet_count(sum(i['adet'] for i in items))
     
     indirim_orani = session.get('indirim', 0)
     indirim_tutari = (toplam * indirim_orani) / 100
@@ -369,6 +2912,7 @@ def sepet_ekle():
     """, (session['user_id'], urun_id, adet))
     conn.commit()
     conn.close()
+    adjust_sepet_count(adet)
     flash('Sepete Eklendi', 'success')
     return redirect(request.referrer or url_for('sepet'))
 
@@ -394,9 +2938,11 @@ def sepet_guncelle(id, action):
     
     if row:
         adet, stok = row
+        delta = 0
         if action == 'arttir':
             if adet < stok:
                 cursor.execute("UPDATE sepet SET adet = adet + 1 WHERE id=%s", (id,))
+                delta = 1
             else:
                 flash('Stok yetersiz.', 'warning')
         elif action == 'azalt':
@@ -404,7 +2950,9 @@ def sepet_guncelle(id, action):
                 cursor.execute("UPDATE sepet SET adet = adet - 1 WHERE id=%s", (id,))
             else:
                 cursor.execute("DELETE FROM sepet WHERE id=%s", (id,))
+            delta = -1
         conn.commit()
+        adjust_sepet_count(delta)
     
     conn.close()
     return redirect(url_for('sepet'))
@@ -421,8 +2969,303 @@ def sepet_sil(id):
     cursor.execute("DELETE FROM sepet WHERE id=%s AND musteri_id=%s", (id, session['user_id']))
     conn.commit()
     conn.close()
+    # Silinen satırın adedi bilinmiyor; yönlendirilen sepet sayfası sayacı zaten kesinleştirir
+    invalidate_sepet_count()
     return redirect(url_for('sepet'))
 
+def update_stok_bulk(cursor, degisimler):
+    # {urun_id: +/-miktar} değişimlerini tek UPDATE ile uygular
+    urun_idler = sorted(degisimler)
+    if not urun_idler: return
+    case_params = []
+    for urun_id in urun_idler:
+        case_params += [urun_id, degisimler[urun_id]]
+    cursor.execute(f"""
+        UPDATE stok
+        SET miktar = miktar + CASE urun_id {' '.join(['WHEN %s THEN %s'] * len(urun_idler))} END
+        WHERE urun_id IN ({_in_clause(urun_idler)})
+    """, case_params + urun_idler)
+
+# --- TOPLU STOK İÇE AKTARMA ---
+# Sayım/tedarik dosyaları (CSV veya JSON) satır satır form göndermek yerine tek
+# transaction'da işlenir: tüm satırlar önce doğrulanır, etkilenen stok satırları
+# tek sıralı FOR UPDATE ile kilitlenir, değişimler update_stok_bulk ile tek
+# UPDATE'te uygulanır ve stok_hareketi çok satırlı INSERT'lerle yazılır.
+# Herhangi bir satır hatalıysa hiçbir değişiklik yapılmaz, hatalar satır
+# numarasıyla döner.
+stok_import_config = {
+    'max_satir': 5000,          # tek dosyada kabul edilen en fazla satır
+    'insert_parti': 500,        # stok_hareketi INSERT'i başına satır
+    'hata_gosterim': 20,        # flash ile gösterilen en fazla hata
+    'varsayilan_aciklama': 'Toplu stok içe aktarma',
+}
+STOK_IMPORT_KOLONLAR = ('urun_id', 'hareket_tipi', 'miktar', 'aciklama')
+
+def _stok_import_kayitlari(metin):
+    # Ham dosya içeriğini (satir_no, {kolon: değer}) listesine çevirir
+    if metin[0] in '[{':
+        try:
+            veri = json.loads(metin)
+        except ValueError as e:
+            raise ValueError(f'JSON okunamadı: {e}')
+        if isinstance(veri, dict):
+            veri = veri.get('satirlar')
+        if not isinstance(veri, list):
+            raise ValueError('JSON bir satır listesi olmalı.')
+        return list(enumerate(veri, 1))
+
+    ilk_satir = metin.split('\n', 1)[0]
+    ayirici = ';' if ilk_satir.count(';') > ilk_satir.count(',') else ','
+    satirlar = list(csv.reader(io.StringIO(metin), delimiter=ayirici))
+    kolonlar = STOK_IMPORT_KOLONLAR
+    baslik = [h.strip().lower() for h in satirlar[0]] if satirlar else []
+    ilk_no = 1
+    if baslik and 'urun_id' in baslik:
+        kolonlar = baslik
+        satirlar = satirlar[1:]
+        ilk_no = 2
+    kayitlar = []
+    for no, satir in enumerate(satirlar, ilk_no):
+        if not any(h.strip() for h in satir):
+            continue
+        kayitlar.append((no, dict(zip(kolonlar, (h.strip() for h in satir)))))
+    return kayitlar
+
+def parse_stok_import(metin):
+    # CSV (başlık isteğe bağlı, ',' veya ';') ya da JSON listesi ->
+    # ([(satir_no, urun_id, hareket_tipi, miktar, aciklama)], [(satir_no, hata)])
+    metin = (metin or '').lstrip('\ufeff').strip()
+    if not metin:
+        return [], [(0, 'Dosya boş.')]
+    try:
+        kayitlar = _stok_import_kayitlari(metin)
+    except (ValueError, csv.Error) as e:
+        return [], [(0, str(e))]
+    if len(kayitlar) > stok_import_config['max_satir']:
+        return [], [(0, f"En fazla {stok_import_config['max_satir']} satır yüklenebilir.")]
+
+    satirlar, hatalar = [], []
+    for no, kayit in kayitlar:
+        if not isinstance(kayit, dict):
+            hatalar.append((no, 'Satır bir nesne olmalı.'))
+            continue
+        try:
+            urun_id = int(kayit.get('urun_id'))
+            miktar = int(kayit.get('miktar'))
+        except (TypeError, ValueError):
+            hatalar.append((no, 'urun_id ve miktar tam sayı olmalı.'))
+            continue
+        hareket = str(kayit.get('hareket_tipi') or '').strip().upper()
+        if hareket not in ('GIRIS', 'CIKIS'):
+            hatalar.append((no, 'Hareket tipi GIRIS veya CIKIS olmalı.'))
+            continue
+        if urun_id <= 0 or miktar <= 0:
+            hatalar.append((no, 'urun_id ve miktar pozitif olmalı.'))
+            continue
+        aciklama = str(kayit.get('aciklama') or '').strip() or stok_import_config['varsayilan_aciklama']
+        satirlar.append((no, urun_id, hareket, miktar, aciklama))
+    if not satirlar and not hatalar:
+        hatalar.append((0, 'İşlenecek satır yok.'))
+    return satirlar, hatalar
+
+def lock_stok_rows(cursor, urun_idler):
+    # Verilen ürünlerin stok satırlarını tek sorguda, sabit sırada kilitler
+    urun_idler = sorted(set(urun_idler))
+    if not urun_idler: return {}
+    cursor.execute(f"""
+        SELECT urun_id, miktar FROM stok
+        WHERE urun_id IN ({_in_clause(urun_idler)})
+        ORDER BY urun_id
+        FOR UPDATE
+    """, urun_idler)
+    return {urun_id: miktar for urun_id, miktar in cursor.fetchall()}
+
+def apply_stok_import(cursor, satirlar, yapan_id):
+    # Transaction içinde çağrılır; hata listesi boş dönerse değişiklikler uygulanmıştır
+    stoklar = lock_stok_rows(cursor, [s[1] for s in satirlar])
+    bakiye = dict(stoklar)
+    degisimler, hareketler, hatalar = {}, [], []
+    # Satırlar dosya sırasıyla yürütülür; çıkış, o ana kadarki bakiyeyi aşamaz
+    for no, urun_id, hareket, miktar, aciklama in satirlar:
+        if urun_id not in bakiye:
+            hatalar.append((no, f'Ürün #{urun_id} stok kaydı yok.'))
+            continue
+        fark = miktar if hareket == 'GIRIS' else -miktar
+        if bakiye[urun_id] + fark < 0:
+            hatalar.append((no, f'Ürün #{urun_id} stoku yetersiz ({bakiye[urun_id]} < {miktar}).'))
+            continue
+        bakiye[urun_id] += fark
+        degisimler[urun_id] = degisimler.get(urun_id, 0) + fark
+        hareketler.append((urun_id, hareket, fark, aciklama, yapan_id))
+    if hatalar:
+        return hatalar
+
+    update_stok_bulk(cursor, {u: d for u, d in degisimler.items() if d})
+    parti = stok_import_config['insert_parti']
+    for i in range(0, len(hareketler), parti):
+        # executemany, VALUES listesini tek çok satırlı INSERT olarak gönderir
+        cursor.executemany("""
+            INSERT INTO stok_hareketi (urun_id, siparis_id, hareket_tipi, miktar, aciklama, yapan_id)
+            VALUES (%s, NULL, %s, %s, %s, %s)
+        """, hareketler[i:i + parti])
+    stock_cache.invalidate(cursor)
+    return []
+
+@app.cli.command('stok-toplu-bench')
+@click.option('--satir', default=1000, help='Sentetik dosyadaki satır sayısı')
+@click.option('--yapan', default=1, help='stok_hareketi.yapan_id (admin kullanıcı)')
+def stok_toplu_bench_command(satir, yapan):
+    # Gerçek veritabanında sentetik bir dosyayı işler, ölçer ve geri alır
+    conn = get_db_connection()
+    if not conn:
+        print("Veritabanı bağlantısı yok.")
+        return
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT urun_id FROM stok")
+        urun_idler = [row[0] for row in cursor.fetchall()]
+        if not urun_idler:
+            print("Stok kaydı yok.")
+            return
+        rnd = random.Random(7)
+        metin = "urun_id;hareket_tipi;miktar;aciklama\n" + "\n".join(
+            f"{rnd.choice(urun_idler)};GIRIS;{rnd.randint(1, 50)};bench" for _ in range(satir))
+        baslangic = time.perf_counter()
+        satirlar, hatalar = parse_stok_import(metin)
+        ayrisma = time.perf_counter()
+        # Ürün listesini okuyan SELECT örtük transaction açtı (autocommit kapalı)
+        if conn.in_transaction:
+            conn.rollback()
+        conn.start_transaction()
+        hatalar = hatalar or apply_stok_import(cursor, satirlar, yapan)
+        bitis = time.perf_counter()
+        conn.rollback()
+        if hatalar:
+            print(f"Hata: {hatalar[:3]}")
+            return
+        sure = bitis - baslangic
+        print(f"{satir} satır / {len(set(urun_idler))} ürün: ayrıştırma {(ayrisma - baslangic) * 1000:.0f} ms, "
+              f"toplam {sure * 1000:.0f} ms ({satir / max(sure, 1e-9):.0f} satır/sn), geri alındı.")
+    finally:
+        conn.close()
+
+# --- STOK REZERVASYONU ---
+# Stok, SELECT ... FOR UPDATE ile kilitlenip transaction sonuna kadar tutulmak yerine
+# koşullu UPDATE ile düşülür (WHERE miktar >= n). autocommit modunda her UPDATE
+# kendi başına commit olduğu için satır kilidi sadece o ifade süresince tutulur;
+# aynı ürünü alan yüzlerce checkout birbirini siparişin tamamı boyunca beklemez.
+# Çok kalemli sepette bir kalem yetmezse önceden düşülenler geri eklenir.
+stock_config = {
+    'reservation_minutes': 0    # >0 ise checkout sayfası açıkken sepet stoku bu kadar dakika ayrılır
+}
+
+class InsufficientStock(Exception):
+    def __init__(self, urun_id):
+        super().__init__(f"Yetersiz stok: urun_id={urun_id}")
+        self.urun_id = urun_id
+
+class ReservationExpired(Exception):
+    pass
+
+@contextmanager
+def autocommit(conn):
+    # Not: autocommit'e geçiş açık (okuma) transaction'ını commit eder
+    conn.autocommit = True
+    try:
+        yield conn.cursor()
+    finally:
+        conn.autocommit = False
+
+def reserve_stok(cursor, kalemler):
+    # kalemler: {urun_id: adet}. Hepsi düşülür ya da hiçbiri (telafi ile).
+    uygulanan = {}
+    for urun_id in sorted(kalemler):
+        adet = kalemler[urun_id]
+        cursor.execute(
+            "UPDATE stok SET miktar = miktar - %s WHERE urun_id=%s AND miktar >= %s",
+            (adet, urun_id, adet)
+        )
+        if cursor.rowcount != 1:
+            release_stok(cursor, uygulanan)
+            raise InsufficientStock(urun_id)
+        uygulanan[urun_id] = adet
+    return uygulanan
+
+def release_stok(cursor, kalemler):
+    # reserve_stok'un telafisi: düşülen miktarları geri ekler
+    if kalemler:
+        update_stok_bulk(cursor, kalemler)
+
+def reserve_stok_with_expiry(conn, musteri_id, kalemler, dakika):
+    # Checkout sayfası açıkken stoku süreli olarak ayırır. Her kalem için stok düşme
+    # ve rezervasyon kaydı aynı kısa transaction'da yazılır; süresi dolan kayıtları
+    # release_expired_reservations stoka geri iade eder.
+    cursor = conn.cursor()
+    for urun_id in sorted(kalemler):
+        adet = kalemler[urun_id]
+        cursor.execute(
+            "UPDATE stok SET miktar = miktar - %s WHERE urun_id=%s AND miktar >= %s",
+            (adet, urun_id, adet)
+        )
+        if cursor.rowcount != 1:
+            conn.rollback()
+            release_reservations(conn, musteri_id)
+            raise InsufficientStock(urun_id)
+        cursor.execute("""
+            INSERT INTO stok_rezervasyon (musteri_id, urun_id, miktar, son_gecerlilik)
+            VALUES (%s, %s, %s, DATE_ADD(NOW(), INTERVAL %s MINUTE))
+        """, (musteri_id, urun_id, adet, dakika))
+        conn.commit()
+
+def _release_reservation_rows(conn, rows):
+    # Rezervasyon satırı silinebildiyse (başka biri tüketmediyse/iade etmediyse) stok iade edilir
+    cursor = conn.cursor()
+    for rez_id, urun_id, miktar in rows:
+        cursor.execute("DELETE FROM stok_rezervasyon WHERE id=%s", (rez_id,))
+        if cursor.rowcount == 1:
+            cursor.execute("UPDATE stok SET miktar = miktar + %s WHERE urun_id=%s", (miktar, urun_id))
+        conn.commit()
+    return len(rows)
+
+def release_reservations(conn, musteri_id):
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, urun_id, miktar FROM stok_rezervasyon WHERE musteri_id=%s", (musteri_id,))
+    rows = cursor.fetchall()
+    conn.commit()
+    return _release_reservation_rows(conn, rows)
+
+def release_expired_reservations(conn, limit=500):
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT id, urun_id, miktar FROM stok_rezervasyon
+        WHERE son_gecerlilik < NOW()
+        ORDER BY son_gecerlilik
+        LIMIT %s
+    """, (limit,))
+    rows = cursor.fetchall()
+    conn.commit()
+    return _release_reservation_rows(conn, rows)
+
+def find_reservation(conn, musteri_id, kalemler):
+    # Müşterinin süresi dolmamış rezervasyonu sepetle birebir örtüşüyorsa id'lerini döner
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT id, urun_id, miktar FROM stok_rezervasyon
+        WHERE musteri_id=%s AND son_gecerlilik >= NOW()
+    """, (musteri_id,))
+    rows = cursor.fetchall()
+    if rows and {urun_id: miktar for _, urun_id, miktar in rows} == kalemler and len(rows) == len(kalemler):
+        return [rez_id for rez_id, _, _ in rows]
+    return None
+
+@app.cli.command('stok-rezervasyon-temizle')
+def stok_rezervasyon_temizle_command():
+    conn = get_db_connection()
+    if not conn:
+        print("Veritabanı bağlantısı yok.")
+        return
+    print(f"{release_expired_reservations(conn)} rezervasyon işlendi.")
+
 @app.route('/siparis/olustur', methods=['GET', 'POST'])
 @login_required
 @role_required(['MUSTERI'])
@@ -437,8 +3280,22 @@ def siparis_olustur():
         cursor.execute("SELECT * FROM adres WHERE musteri_id=%s ORDER BY varsayilan DESC, id DESC", (session['user_id'],))
         adresler = cursor.fetchall()
 
+        rezervasyon_dakika = stock_config['reservation_minutes']
+        if rezervasyon_dakika:
+            release_expired_reservations(conn, limit=100)
+
         if request.method == 'GET':
-            return render_template('siparis_olustur.html', adresler=adresler)
+            if rezervasyon_dakika:
+                # Sayfa her açıldığında önceki ayırma iade edilip güncel sepet yeniden ayrılır
+                release_reservations(conn, session['user_id'])
+                cursor.execute("SELECT urun_id, adet FROM sepet WHERE musteri_id=%s", (session['user_id'],))
+                kalemler = {row['urun_id']: row['adet'] for row in cursor.fetchall()}
+                try:
+                    reserve_stok_with_expiry(conn, session['user_id'], kalemler, rezervasyon_dakika)
+                except InsufficientStock:
+                    flash('Yetersiz stok.', 'warning')
+                    return redirect(url_for('sepet'))
+            return render_template('siparis_olustur.html', adresler=adresler, rezervasyon_dakika=rezervasyon_dakika)
 
         # --- POST ---
         if not adresler:
@@ -466,6 +3323,22 @@ def siparis_olustur():
             return redirect(url_for('sepet'))
 
         toplam = sum(i['adet'] * i['fiyat'] for i in items)
+        kalemler = {item['urun_id']: item['adet'] for item in items}
+
+        # Stok: varsa checkout sayfasında ayrılmış rezervasyon kullanılır, yoksa
+        # koşullu UPDATE'lerle (kilit tutmadan) şimdi düşülür
+        rezervasyon_idleri = None
+        if rezervasyon_dakika:
+            rezervasyon_idleri = find_reservation(conn, session['user_id'], kalemler)
+            if rezervasyon_idleri is None:
+                release_reservations(conn, session['user_id'])
+        if rezervasyon_idleri is None:
+            try:
+                with autocommit(conn) as ac_cursor:
+                    reserve_stok(ac_cursor, kalemler)
+            except InsufficientStock:
+                flash('Yetersiz stok (checkout sırasında kontrol edildi).', 'warning')
+                return redirect(url_for('sepet'))
 
         try:
             # conn.start_transaction() # Implicit transaction usage to avoid "Transaction already in progress"
@@ -478,15 +3351,13 @@ def siparis_olustur():
             # Sipariş Notu
             siparis_notu = request.form.get('siparis_notu', '')
 
-            # Stokları kilitle + kontrol et
-            for item in items:
-                cursor.execute("SELECT miktar FROM stok WHERE urun_id=%s FOR UPDATE", (item['urun_id'],))
-                row = cursor.fetchone()
-                stok_miktar = row['miktar'] if row else 0
-                if stok_miktar < item['adet']:
-                    conn.rollback()
-                    flash('Yetersiz stok (checkout sırasında kontrol edildi).', 'warning')
-                    return redirect(url_for('sepet'))
+            # Rezervasyon kullanılıyorsa sipariş ile aynı transaction'da tüketilir; bu arada
+            # süresi dolup iade edildiyse sipariş iptal olur
+            if rezervasyon_idleri:
+                cursor.execute(f"DELETE FROM stok_rezervasyon WHERE id IN ({_in_clause(rezervasyon_idleri)})",
+                               rezervasyon_idleri)
+                if cursor.rowcount != len(rezervasyon_idleri):
+                    raise ReservationExpired()
 
             # Sipariş Kaydı (İndirimli Tutar ile)
             kupon_kodu = session.get('aktif_kupon', None)
@@ -495,51 +3366,45 @@ def siparis_olustur():
                 VALUES (%s, %s, 'OLUSTURULDU', 'KAPIDA_NAKIT', %s, %s, %s, %s)
             """, (session['user_id'], adres_id, odenecek_tutar, siparis_notu, indirim_tutari, kupon_kodu))
             sid = cursor.lastrowid
-
-            # Detaylar + stok düşme + hareket
-            for item in items:
-                cursor.execute("""
-                    INSERT INTO siparis_detay (siparis_id, urun_id, adet, birim_fiyat)
-                    VALUES (%s, %s, %s, %s)
-                """, (sid, item['urun_id'], item['adet'], item['fiyat']))
-
-                cursor.execute(
-                    "UPDATE stok SET miktar = miktar - %s WHERE urun_id=%s",
-                    (item['adet'], item['urun_id'])
-                )
-
-                cursor.execute("""
-                    INSERT INTO stok_hareketi (urun_id, siparis_id, hareket_tipi, miktar, aciklama, yapan_id)
-                    VALUES (%s, %s, 'SATIS', %s, 'Sipariş satışı', %s)
-                """, (item['urun_id'], sid, -item['adet'], session['user_id']))
-
-            # Log
-            cursor.execute("""
-                INSERT INTO siparis_durum_log (siparis_id, eski_durum, yeni_durum, degistiren_id, aciklama, tarih)
-                VALUES (%s, '-', 'OLUSTURULDU', %s, 'Sipariş oluşturuldu', NOW())
-            """, (sid, session['user_id']))
-
-            # Kupon Kullanımını Kaydet
-            if 'aktif_kupon' in session:
-                # Tablo var mı kontrol etmeyeceğiz, hata verirse rollback olur. tablo oluşturmalıyız.
-                try:
-                    cursor.execute("""
-                        INSERT INTO kupon_kullanim (kupon_kod, musteri_id, siparis_id)
-                        VALUES (%s, %s, %s)
-                    """, (session['aktif_kupon'], session['user_id'], sid))
-                except mysql.connector.Error:
-                    pass # Tablo yoksa siparişi patlatma, kupon loglanmasın
+            track_siparis_gecisi(cursor, '-', 'OLUSTURULDU')
+
+            # Detaylar (stok yukarıda düşüldü; executemany INSERT'leri tek çok
+            # satırlı INSERT olarak gönderir)
+            cursor.executemany("""
+                INSERT INTO siparis_detay (siparis_id, urun_id, adet, birim_fiyat)
+                VALUES (%s, %s, %s, %s)
+            """, [(sid, item['urun_id'], item['adet'], item['fiyat']) for item in items])
+
+            # Stok hareketi, durum logu ve kupon kullanımı olay kutusu üzerinden yazılır
+            enqueue_event(
+                cursor, 'SIPARIS_OLUSTURULDU',
+                loglar=[(sid, '-', 'OLUSTURULDU', session['user_id'], 'Sipariş oluşturuldu')],
+                stok_hareketleri=[(item['urun_id'], sid, 'SATIS', -item['adet'], 'Sipariş satışı', session['user_id'])
+                                  for item in items],
+                kupon_kullanimlari=[(session['aktif_kupon'], session['user_id'], sid)] if 'aktif_kupon' in session else ()
+            )
             
             # Session temizliği
             session.pop('indirim', None)
             session.pop('aktif_kupon', None)            # Sepeti temizle
             cursor.execute("DELETE FROM sepet WHERE musteri_id=%s", (session['user_id'],))
 
+            stock_cache.invalidate(cursor)
             conn.commit()
+            publish_siparis_olayi(sid, None, 'OLUSTURULDU', session['user_id'])
+            set_sepet_count(0)
             flash('Sipariş alındı!', 'success')
             return redirect(url_for('siparis_detay', id=sid))
+        except ReservationExpired:
+            conn.rollback()
+            flash('Stok ayırma süresi doldu, lütfen tekrar deneyin.', 'warning')
+            return redirect(url_for('siparis_olustur'))
         except Exception as e:
             conn.rollback()
+            if rezervasyon_idleri is None:
+                # Sipariş yazılamadı: koşullu düşülen stoku geri ver
+                with autocommit(conn) as ac_cursor:
+                    release_stok(ac_cursor, kalemler)
             flash(f'Sipariş oluşturulamadı: {e}', 'danger')
             return redirect(url_for('sepet'))
     finally:
@@ -707,32 +3572,7 @@ def siparis_detay(id):
         """, (id,))
         detaylar = cursor.fetchall()
 
-        # Loglarda degistiren_id hangi tablodan? Rol bilgisi logda yok. 
-        # Pratik çözüm: Tüm tablolara left join atıp hangisi doluysa onu alalım.
-        # Not: ID çakışması varsa yanlış isim gelebilir. Ancak bu aşamada yapacak bir şey yok.
-        # İleride log tablosuna 'degistiren_rol' eklenmeli.
-        cursor.execute("""
-            SELECT l.*, 
-                   COALESCE(a.k_adi, m.k_adi, k.k_adi) as k_adi,
-                   COALESCE(a.ad, m.ad, k.ad) as ad,
-                   COALESCE(a.soyad, m.soyad, k.soyad) as soyad
-            FROM siparis_durum_log l
-            LEFT JOIN admin a ON l.degistiren_id = a.id
-            LEFT JOIN musteri m ON l.degistiren_id = m.id
-            LEFT JOIN kurye k ON l.degistiren_id = k.id
-            WHERE l.siparis_id=%s
-            ORDER BY l.tarih ASC, l.id ASC
-        """, (id,))
-        loglar = cursor.fetchall()
-
-        cursor.execute("""
-            SELECT sh.*, u.ad AS urun_ad
-            FROM stok_hareketi sh
-            JOIN urun u ON u.id = sh.urun_id
-            WHERE sh.siparis_id=%s
-            ORDER BY sh.created_at ASC, sh.id ASC
-        """, (id,))
-        stok_hareketleri = cursor.fetchall()
+        loglar, stok_hareketleri = fetch_siparis_denetimi(cursor, id)
 
         return render_template(
             'siparis_detay.html',
@@ -757,29 +3597,26 @@ def islemlerim():
         uid = session['user_id']
         rol = session.get('rol')
 
-        cursor.execute("""
+        # (degistiren_id, tarih, id) / (yapan_id, created_at, id) index'leri üzerinde sıralı tarama
+        durum_islemleri = fetch_denetim_gecmisi(cursor, 'siparis_durum_log', """
             SELECT
                 l.tarih, l.siparis_id, l.eski_durum, l.yeni_durum, l.aciklama,
                 s.durum AS siparis_guncel_durum
-            FROM siparis_durum_log l
+            FROM {tablo} l
             JOIN siparis s ON s.id = l.siparis_id
             WHERE l.degistiren_id=%s
             ORDER BY l.tarih DESC, l.id DESC
-            LIMIT 100
         """, (uid,))
-        durum_islemleri = cursor.fetchall()
 
-        cursor.execute("""
+        stok_islemleri = fetch_denetim_gecmisi(cursor, 'stok_hareketi', """
             SELECT
                 sh.created_at, sh.hareket_tipi, sh.miktar, sh.siparis_id, sh.aciklama,
                 u.ad AS urun_ad
-            FROM stok_hareketi sh
+            FROM {tablo} sh
             JOIN urun u ON u.id = sh.urun_id
             WHERE sh.yapan_id=%s
             ORDER BY sh.created_at DESC, sh.id DESC
-            LIMIT 100
         """, (uid,))
-        stok_islemleri = cursor.fetchall()
 
         yorumlar = []
         favoriler = []
@@ -922,28 +3759,34 @@ def admin_panel():
         return redirect(url_for('index'))
     cursor = conn.cursor(dictionary=True)
     
-    # Bekleyen siparişler (OLUSTURULDU veya ONAY_BEKLIYOR)
-    cursor.execute("SELECT COUNT(*) as c FROM siparis WHERE durum IN ('ONAY_BEKLIYOR', 'OLUSTURULDU')")
-    bekleyen = cursor.fetchone()['c']
-    
-    # Aktif ürün sayısı
-    cursor.execute("SELECT COUNT(*) as c FROM urun WHERE aktif=1")
-    urun_sayisi = cursor.fetchone()['c']
-    
-    # Toplam müşteri sayısı
-    cursor.execute("SELECT COUNT(*) as c FROM musteri")
-    musteri_sayisi = cursor.fetchone()['c']
-    
-    # Toplam yorum sayısı (onaylı + bekleyen)
-    cursor.execute("SELECT COUNT(*) as c FROM yorum")
-    yorum_sayisi = cursor.fetchone()['c']
-    
-    # Okunmamış mesajlar (yeni sistem)
-    cursor.execute("SELECT COUNT(*) as c FROM mesajlar WHERE alici_rol='ADMIN' AND durum='BEKLIYOR'")
-    okunmamis_mesaj = cursor.fetchone()['c']
+    # Özet sayaçlar (bekleyen sipariş, aktif ürün, müşteri, yorum, okunmamış mesaj)
+    sayaclar = read_panel_sayaclari(cursor)
+    if any(anahtar not in sayaclar for anahtar in PANEL_SAYACLARI):
+        # İlk açılış: sayaçları gerçek değerlerle başlat
+        reconcile_panel_sayaclari(conn)
+        sayaclar = read_panel_sayaclari(cursor)
+    bekleyen = sayaclar.get('bekleyen_siparis', 0)
+    urun_sayisi = sayaclar.get('aktif_urun', 0)
+    musteri_sayisi = sayaclar.get('musteri', 0)
+    yorum_sayisi = sayaclar.get('yorum', 0)
+    okunmamis_mesaj = sayaclar.get('okunmamis_mesaj', 0)
+
+    # Olay kutusu gecikmesi (loglar worker tarafından yazılır)
+    outbox = outbox_lag(cursor)
 
     conn.close()
-    return render_template('admin_panel.html', bekleyen=bekleyen, urun_sayisi=urun_sayisi, musteri_sayisi=musteri_sayisi, yorum_sayisi=yorum_sayisi, okunmamis_mesaj=okunmamis_mesaj)
+    return render_template('admin_panel.html', bekleyen=bekleyen, urun_sayisi=urun_sayisi, musteri_sayisi=musteri_sayisi, yorum_sayisi=yorum_sayisi, okunmamis_mesaj=okunmamis_mesaj, outbox=outbox)
+
+ADMIN_LISTE_SAYFA = 50
+
+def _liste_arama(alanlar, q):
+    # Önek araması (index kullanılabilsin diye baştan eşleşme); sayı ise ID ile de eşleşir
+    kosullar = [f"{alan} LIKE %s" for alan in alanlar]
+    params = [q + '%'] * len(alanlar)
+    if q.isdigit():
+        kosullar.append("k.id = %s")
+        params.append(int(q))
+    return "(" + " OR ".join(kosullar) + ")", params
 
 @app.route('/admin/musteriler')
 @role_required(['ADMIN'])
@@ -951,15 +3794,73 @@ def admin_musteriler():
     conn = get_db_connection()
     if not conn: return redirect(url_for('admin_panel'))
     cursor = conn.cursor(dictionary=True)
-    # Müşterileri ve sipariş sayılarını çek
-    cursor.execute("""
-        SELECT k.*, (SELECT COUNT(*) FROM siparis s WHERE s.musteri_id=k.id) as siparis_sayisi
-        FROM musteri k
-        ORDER BY k.id DESC
-    """)
-    musteriler = cursor.fetchall()
+
+    q = request.args.get('q', '').strip()
+    sirala = request.args.get('sirala', 'yeni')
+    sayfa = max(request.args.get('sayfa', 1, type=int), 1)
+    siralamalar = {
+        'yeni': "k.id DESC",
+        'ad': "k.ad, k.soyad, k.id",
+        'siparis': "siparis_sayisi DESC, k.id DESC"
+    }
+    if sirala not in siralamalar:
+        sirala = 'yeni'
+
+    kosul, params = ("", [])
+    if q:
+        kosul, params = _liste_arama(['k.ad', 'k.soyad', 'k.email', 'k.k_adi', 'k.telefon'], q)
+        kosul = "WHERE " + kosul
+
+    if sirala == 'siparis':
+        # Sipariş sayısına göre sıralama tüm siparişlerin tek seferlik gruplanmasını gerektirir
+        cursor.execute(f"""
+            SELECT k.*, COALESCE(s.siparis_sayisi, 0) as siparis_sayisi, s.son_siparis
+            FROM musteri k
+            LEFT JOIN (
+                SELECT musteri_id, COUNT(*) as siparis_sayisi, MAX(tarih) as son_siparis
+                FROM siparis GROUP BY musteri_id
+            ) s ON s.musteri_id = k.id
+            {kosul}
+            ORDER BY {siralamalar[sirala]}
+            LIMIT %s OFFSET %s
+        """, params + [ADMIN_LISTE_SAYFA + 1, (sayfa - 1) * ADMIN_LISTE_SAYFA])
+        musteriler = cursor.fetchall()
+        sonraki_var = len(musteriler) > ADMIN_LISTE_SAYFA
+        musteriler = musteriler[:ADMIN_LISTE_SAYFA]
+    else:
+        # Önce sayfa, sonra sadece o sayfadaki müşteriler için gruplu sayım
+        cursor.execute(f"""
+            SELECT k.* FROM musteri k
+            {kosul}
+            ORDER BY {siralamalar[sirala]}
+            LIMIT %s OFFSET %s
+        """, params + [ADMIN_LISTE_SAYFA + 1, (sayfa - 1) * ADMIN_LISTE_SAYFA])
+        musteriler = cursor.fetchall()
+        sonraki_var = len(musteriler) > ADMIN_LISTE_SAYFA
+        musteriler = musteriler[:ADMIN_LISTE_SAYFA]
+        ids = [m['id'] for m in musteriler]
+        sayimlar = {}
+        if ids:
+            cursor.execute(f"""
+                SELECT musteri_id, COUNT(*) as siparis_sayisi, MAX(tarih) as son_siparis
+                FROM siparis
+                WHERE musteri_id IN ({_in_clause(ids)})
+                GROUP BY musteri_id
+            """, ids)
+            sayimlar = {r['musteri_id']: r for r in cursor.fetchall()}
+        for m in musteriler:
+            r = sayimlar.get(m['id'])
+            m['siparis_sayisi'] = r['siparis_sayisi'] if r else 0
+            m['son_siparis'] = r['son_siparis'] if r else None
+
+    # Toplam, aramasız listede panel sayacından gelir (COUNT(*) taraması yapılmaz)
+    toplam = None
+    if not q:
+        toplam = read_panel_sayaclari(cursor).get('musteri')
+
     conn.close()
-    return render_template('admin_musteriler.html', musteriler=musteriler)
+    return render_template('admin_musteriler.html', musteriler=musteriler, q=q, sirala=sirala, sayfa=sayfa,
+                           sonraki_var=sonraki_var, toplam=toplam)
 
 # ========== KURYE YÖNETİMİ ==========
 @app.route('/admin/kuryeler')
@@ -968,16 +3869,49 @@ def admin_kuryeler():
     conn = get_db_connection()
     if not conn: return redirect(url_for('admin_panel'))
     cursor = conn.cursor(dictionary=True)
-    cursor.execute("""
-        SELECT k.*, 
-            (SELECT COUNT(*) FROM siparis s WHERE s.kurye_id=k.id AND s.durum='TESLIM_EDILDI') as teslim_sayisi,
-            (SELECT COUNT(*) FROM siparis s WHERE s.kurye_id=k.id AND s.durum IN ('YOLDA', 'KURYE_ATANDI')) as aktif_teslimat
+
+    q = request.args.get('q', '').strip()
+    sirala = request.args.get('sirala', 'yeni')
+    sayfa = max(request.args.get('sayfa', 1, type=int), 1)
+    siralamalar = {
+        'yeni': "k.id DESC",
+        'ad': "k.ad, k.soyad, k.id",
+        'teslim': "teslim_sayisi DESC, k.id DESC",
+        'aktif': "aktif_teslimat DESC, k.id DESC"
+    }
+    if sirala not in siralamalar:
+        sirala = 'yeni'
+
+    kosul, params = ("", [])
+    if q:
+        kosul, params = _liste_arama(['k.ad', 'k.soyad', 'k.k_adi', 'k.telefon'], q)
+        kosul = "WHERE " + kosul
+
+    # Kurye başına sayımlar tek gruplu sorguda (ilişkili alt sorgu yok)
+    cursor.execute(f"""
+        SELECT k.*,
+            COALESCE(s.teslim_sayisi, 0) as teslim_sayisi,
+            COALESCE(s.aktif_teslimat, 0) as aktif_teslimat
         FROM kurye k
-        ORDER BY k.id DESC
-    """)
+        LEFT JOIN (
+            SELECT kurye_id,
+                SUM(durum = 'TESLIM_EDILDI') as teslim_sayisi,
+                SUM(durum IN ('YOLDA', 'KURYE_ATANDI')) as aktif_teslimat
+            FROM siparis
+            WHERE kurye_id IS NOT NULL
+            GROUP BY kurye_id
+        ) s ON s.kurye_id = k.id
+        {kosul}
+        ORDER BY {siralamalar[sirala]}
+        LIMIT %s OFFSET %s
+    """, params + [ADMIN_LISTE_SAYFA + 1, (sayfa - 1) * ADMIN_LISTE_SAYFA])
     kuryeler = cursor.fetchall()
+    sonraki_var = len(kuryeler) > ADMIN_LISTE_SAYFA
+    kuryeler = kuryeler[:ADMIN_LISTE_SAYFA]
+
     conn.close()
-    return render_template('admin_kuryeler.html', kuryeler=kuryeler)
+    return render_template('admin_kuryeler.html', kuryeler=kuryeler, q=q, sirala=sirala, sayfa=sayfa,
+                           sonraki_var=sonraki_var)
 
 @app.route('/admin/kurye/ekle', methods=['POST'])
 @role_required(['ADMIN'])
@@ -1027,6 +3961,32 @@ def admin_kurye_durum(id):
         flash('Kurye durumu güncellendi.', 'success')
     return redirect(url_for('admin_kuryeler'))
 
+@app.route('/admin/raporlar')
+@role_required(['ADMIN'])
+def admin_raporlar():
+    bugun = date.today()
+    try:
+        bitis = date.fromisoformat(request.args.get('bitis') or bugun.isoformat())
+        baslangic = date.fromisoformat(request.args.get('baslangic')
+                                       or (bitis - timedelta(days=analytics_config['varsayilan_gun'] - 1)).isoformat())
+    except ValueError:
+        flash('Tarih biçimi YYYY-AA-GG olmalı.', 'warning')
+        return redirect(url_for('admin_raporlar'))
+    if baslangic > bitis:
+        baslangic, bitis = bitis, baslangic
+    donem = 'ay' if request.args.get('donem') == 'ay' else 'gun'
+
+    conn = get_db_connection()
+    if not conn: return redirect(url_for('admin_panel'))
+    try:
+        t0 = time.perf_counter()
+        rapor = fetch_satis_raporu(conn.cursor(dictionary=True), baslangic, bitis, donem)
+        sure_ms = (time.perf_counter() - t0) * 1000
+    finally:
+        conn.close()
+    return render_template('admin_raporlar.html', rapor=rapor, baslangic=baslangic, bitis=bitis,
+                           donem=donem, sure_ms=sure_ms)
+
 @app.route('/admin/kuponlar')
 @role_required(['ADMIN'])
 def admin_kuponlar():
@@ -1075,6 +4035,10 @@ def admin_kupon_sil(id):
         flash('Kupon silindi.', 'success')
     return redirect(url_for('admin_kuponlar'))
 
+ADMIN_SIPARIS_SAYFA = 50
+DEVAM_EDEN_DURUMLAR = ('OLUSTURULDU', 'ONAYLANDI', 'HAZIRLANIYOR', 'KURYE_ATANDI', 'YOLDA')
+BITEN_DURUMLAR = ('TESLIM_EDILDI', 'IPTAL_EDILDI', 'REDDEDILDI')
+
 @app.route('/admin/siparisler')
 @role_required(['ADMIN'])
 def admin_siparisler():
@@ -1083,25 +4047,79 @@ def admin_siparisler():
         flash('Veritabanı bağlantısı yok.', 'danger')
         return redirect(url_for('index'))
     cursor = conn.cursor(dictionary=True)
-    
-    cursor.execute("""
+
+    # Filtreler (durum, tarih aralığı, kurye, müşteri)
+    durum = request.args.get('durum', '')
+    start_date = request.args.get('start_date', '')
+    end_date = request.args.get('end_date', '')
+    kurye_id = request.args.get('kurye_id', type=int)
+    musteri_id = request.args.get('musteri_id', type=int)
+
+    kosullar = []
+    params = []
+    if start_date:
+        kosullar.append("s.tarih >= %s")
+        params.append(start_date)
+    if end_date:
+        kosullar.append("s.tarih < DATE_ADD(%s, INTERVAL 1 DAY)")
+        params.append(end_date)
+    if kurye_id:
+        kosullar.append("s.kurye_id = %s")
+        params.append(kurye_id)
+    if musteri_id:
+        kosullar.append("s.musteri_id = %s")
+        params.append(musteri_id)
+
+    def durum_kosulu(kume):
+        if durum:
+            return ("s.durum = %s", [durum]) if durum in kume else (None, None)
+        return (f"s.durum IN ({_in_clause(kume)})", list(kume))
+
+    select_sql = """
         SELECT s.*, m.ad as musteri_ad, m.soyad as musteri_soyad, k.ad as kurye_ad, k.soyad as kurye_soyad
         FROM siparis s
         JOIN musteri m ON s.musteri_id = m.id
         LEFT JOIN kurye k ON s.kurye_id = k.id
-        ORDER BY s.tarih DESC
-    """)
-    siparisler = cursor.fetchall()
-
-    cursor.execute("SELECT id, ad, soyad FROM kurye WHERE durum IN ('MUSAIT', 'MESGUL') ORDER BY ad")
-    kuryeler = cursor.fetchall()
-
-    devam_set = ('OLUSTURULDU','ONAYLANDI','HAZIRLANIYOR','KURYE_ATANDI','YOLDA')
-    devam_eden = [s for s in siparisler if s['durum'] in devam_set]
-    bitti = [s for s in siparisler if s['durum'] in ('TESLIM_EDILDI','IPTAL_EDILDI','REDDEDILDI')]
+    """
+
+    # Devam edenler: doğal olarak küçük küme, ayrı sorgu
+    devam_eden = []
+    dk, dp = durum_kosulu(DEVAM_EDEN_DURUMLAR)
+    if dk:
+        cursor.execute(select_sql + " WHERE " + " AND ".join([dk] + kosullar) + " ORDER BY s.tarih DESC, s.id DESC",
+                       dp + params)
+        devam_eden = cursor.fetchall()
+
+    # Bitenler: (tarih, id) üzerinde keyset sayfalama
+    bitti = []
+    sonraki = None
+    bk, bp = durum_kosulu(BITEN_DURUMLAR)
+    if bk:
+        sayfa_kosullari = [bk] + kosullar
+        sayfa_params = bp + params
+        once = request.args.get('once', '')
+        if '_' in once:
+            once_tarih, once_id = once.rsplit('_', 1)
+            sayfa_kosullari.append("(s.tarih < %s OR (s.tarih = %s AND s.id < %s))")
+            sayfa_params += [once_tarih, once_tarih, int(once_id) if once_id.isdigit() else 0]
+        cursor.execute(select_sql + " WHERE " + " AND ".join(sayfa_kosullari)
+                       + " ORDER BY s.tarih DESC, s.id DESC LIMIT %s",
+                       sayfa_params + [ADMIN_SIPARIS_SAYFA + 1])
+        bitti = cursor.fetchall()
+        if len(bitti) > ADMIN_SIPARIS_SAYFA:
+            bitti = bitti[:ADMIN_SIPARIS_SAYFA]
+            son = bitti[-1]
+            sonraki = f"{son['tarih']}_{son['id']}"
+
+    cursor.execute("SELECT id, ad, soyad, durum FROM kurye ORDER BY ad")
+    tum_kuryeler = cursor.fetchall()
+    kuryeler = [k for k in tum_kuryeler if k['durum'] in ('MUSAIT', 'MESGUL')]
 
     conn.close()
-    return render_template('admin_siparisler.html', devam_eden=devam_eden, bitti=bitti, kuryeler=kuryeler)
+    filtreler = {k: v for k, v in request.args.items() if k != 'once' and v}
+    return render_template('admin_siparisler.html', devam_eden=devam_eden, bitti=bitti, kuryeler=kuryeler,
+                           tum_kuryeler=tum_kuryeler, durumlar=DEVAM_EDEN_DURUMLAR + BITEN_DURUMLAR,
+                           filtreler=filtreler, sonraki=sonraki)
 
 @app.route('/admin/urunler')
 @role_required(['ADMIN'])
@@ -1112,14 +4130,23 @@ def admin_urunler():
         return redirect(url_for('index'))
     cursor = conn.cursor(dictionary=True)
 
+    # Son üretim planı (gece işi); öneri mevcut stokla yeniden hesaplanır
+    cursor.execute("SELECT MAX(plan_tarihi) AS plan_tarihi FROM uretim_plani WHERE plan_tarihi >= CURDATE()")
+    row = cursor.fetchone()
+    plan_tarihi = row['plan_tarihi'] if row else None
+
     cursor.execute("""
-        SELECT u.*, s.miktar, s.kritik_seviye
+        SELECT u.*, s.miktar, s.kritik_seviye, p.tahmin AS plan_tahmin, p.hedef_stok AS plan_hedef
         FROM urun u
         LEFT JOIN stok s ON s.urun_id = u.id
+        LEFT JOIN uretim_plani p ON p.urun_id = u.id AND p.plan_tarihi = %s
         WHERE u.aktif=1
         ORDER BY u.ad
-    """)
+    """, (plan_tarihi,))
     urun_list = cursor.fetchall()
+    for u in urun_list:
+        if u['plan_hedef'] is not None:
+            u['plan_uretim'] = max(u['plan_hedef'] - (u['miktar'] or 0), 0)
 
     cursor.execute("""
         SELECT y.*, u.ad AS urun_ad, m.ad AS musteri_ad, m.soyad AS musteri_soyad
@@ -1135,7 +4162,8 @@ def admin_urunler():
     kategoriler = cursor.fetchall()
 
     conn.close()
-    return render_template('admin_urunler.html', urunler=urun_list, yorumlar=yorumlar, kategoriler=kategoriler)
+    return render_template('admin_urunler.html', urunler=urun_list, yorumlar=yorumlar, kategoriler=kategoriler,
+                           plan_tarihi=plan_tarihi)
 
 @app.route('/admin/urun/ekle', methods=['POST'])
 @role_required(['ADMIN'])
@@ -1150,6 +4178,11 @@ def admin_urun_ekle():
         flash('Ad, Fiyat ve Kategori zorunlu.', 'warning')
         return redirect(url_for('admin_urunler'))
 
+    # Türevler transaction açılmadan hazırlanır: kodlama satır kilitlerini tutmaz,
+    # sürüm arttığında diğer worker'ların kart parçaları yeni resmi bulur
+    if resim:
+        refresh_urun_resmi(resim)
+
     conn = get_db_connection()
     if not conn: return redirect(url_for('admin_urunler'))
     
@@ -1160,6 +4193,9 @@ def admin_urun_ekle():
         # Stok kaydını da 0 olarak açalım ki hata vermesin
         urun_id = cursor.lastrowid
         cursor.execute("INSERT INTO stok (urun_id, miktar, kritik_seviye) VALUES (%s, 0, 10)", (urun_id,))
+        adjust_panel_sayac(cursor, 'aktif_urun', 1)
+        catalog_cache.invalidate(cursor)
+        stock_cache.invalidate(cursor)
         
         conn.commit()
         flash('Ürün eklendi.', 'success')
@@ -1178,13 +4214,22 @@ def admin_urun_sil(id):
         return redirect(url_for('admin_urunler'))
     try:
         cursor = conn.cursor()
+        cursor.execute("SELECT aktif FROM urun WHERE id=%s", (id,))
+        urun = cursor.fetchone()
         # Önce bağlı tablolardan sil (foreign key constraints)
         cursor.execute("DELETE FROM stok_hareketi WHERE urun_id=%s", (id,))
+        cursor.execute("DELETE FROM stok_hareketi_arsiv WHERE urun_id=%s", (id,))
         cursor.execute("DELETE FROM favoriler WHERE urun_id=%s", (id,))
         cursor.execute("DELETE FROM sepet WHERE urun_id=%s", (id,))
         cursor.execute("DELETE FROM yorum WHERE urun_id=%s", (id,))
+        adjust_panel_sayac(cursor, 'yorum', -cursor.rowcount)
+        cursor.execute("DELETE FROM urun_puan WHERE urun_id=%s", (id,))
         cursor.execute("DELETE FROM stok WHERE urun_id=%s", (id,))
         cursor.execute("DELETE FROM urun WHERE id=%s", (id,))
+        if urun and urun[0]:
+            adjust_panel_sayac(cursor, 'aktif_urun', -1)
+        catalog_cache.invalidate(cursor)
+        stock_cache.invalidate(cursor)
         conn.commit()
         flash('Ürün silindi.', 'success')
     except Exception as e:
@@ -1201,7 +4246,10 @@ def admin_urun_duzenle():
     fiyat = request.form.get('fiyat')
     resim = request.form.get('resim')
     aciklama = request.form.get('aciklama')
-    
+
+    if resim:
+        refresh_urun_resmi(resim)
+
     conn = get_db_connection()
     if not conn: return redirect(url_for('admin_urunler'))
 
@@ -1212,6 +4260,7 @@ def admin_urun_duzenle():
             SET ad=%s, fiyat=%s, resim=%s, aciklama=%s 
             WHERE id=%s
         """, (ad, fiyat, resim, aciklama, id))
+        catalog_cache.invalidate(cursor)
         conn.commit()
         flash('Ürün güncellendi.', 'success')
     except Exception as e:
@@ -1227,7 +4276,11 @@ def admin_urun_durum(id, aktif):
     if not conn: return redirect(url_for('admin_urunler'))
     try:
         cursor = conn.cursor()
-        cursor.execute("UPDATE urun SET aktif=%s WHERE id=%s", (aktif, id))
+        aktif = 1 if aktif else 0
+        cursor.execute("UPDATE urun SET aktif=%s WHERE id=%s AND aktif<>%s", (aktif, id, aktif))
+        if cursor.rowcount:
+            adjust_panel_sayac(cursor, 'aktif_urun', 1 if aktif else -1)
+        catalog_cache.invalidate(cursor)
         conn.commit()
         flash('Durum güncellendi.', 'success')
     finally:
@@ -1254,23 +4307,22 @@ def admin_kurye_ata(id):
             flash('Geçersiz kurye.', 'danger')
             return redirect(url_for('admin_siparisler'))
 
-        cursor.execute("SELECT durum FROM siparis WHERE id=%s", (id,))
+        cursor.execute("SELECT durum, musteri_id, kurye_id FROM siparis WHERE id=%s", (id,))
         row = cursor.fetchone()
         if not row:
             flash('Sipariş bulunamadı.', 'danger')
             return redirect(url_for('admin_siparisler'))
 
-        durum = row[0]
+        durum, musteri_id, eski_kurye_id = row
         if durum not in ('ONAYLANDI', 'HAZIRLANIYOR', 'KURYE_ATANDI'):
             flash('Bu durumda kurye atanamaz.', 'warning')
             return redirect(url_for('admin_siparisler'))
 
         cursor.execute("UPDATE siparis SET kurye_id=%s, durum='KURYE_ATANDI' WHERE id=%s", (kurye_id, id))
-        cursor.execute("""
-            INSERT INTO siparis_durum_log (siparis_id, eski_durum, yeni_durum, degistiren_id, aciklama, tarih)
-            VALUES (%s, %s, %s, %s, 'Kurye atandı', NOW())
-        """, (id, durum, 'KURYE_ATANDI', session['user_id']))
+        track_siparis_gecisi(cursor, durum, 'KURYE_ATANDI')
+        enqueue_event(cursor, 'KURYE_ATANDI', loglar=[(id, durum, 'KURYE_ATANDI', session['user_id'], 'Kurye atandı')])
         conn.commit()
+        publish_siparis_olayi(id, durum, 'KURYE_ATANDI', musteri_id, int(kurye_id), eski_kurye_id)
         flash('Kurye atandı.', 'success')
         return redirect(url_for('admin_siparisler'))
     except Exception as e:
@@ -1301,6 +4353,10 @@ def admin_stok_hareket():
         flash('Hareket tipi GIRIS veya CIKIS olmalı.', 'warning')
         return redirect(url_for('admin_urunler'))
 
+    if miktar_int <= 0:
+        flash('Miktar pozitif olmalı.', 'warning')
+        return redirect(url_for('admin_urunler'))
+
     conn = get_db_connection()
     if not conn:
         flash('Veritabanı bağlantısı yok.', 'danger')
@@ -1308,26 +4364,28 @@ def admin_stok_hareket():
 
     try:
         cursor = conn.cursor()
-        conn.start_transaction()
-        cursor.execute("SELECT miktar FROM stok WHERE urun_id=%s FOR UPDATE", (urun_id,))
-        row = cursor.fetchone()
-        if not row:
-            conn.rollback()
-            flash('Ürün stok kaydı yok.', 'danger')
-            return redirect(url_for('admin_urunler'))
-
-        mevcut = row[0]
-        yeni_miktar = mevcut + miktar_int if hareket == 'GIRIS' else mevcut - miktar_int
-        if yeni_miktar < 0:
+        # FOR UPDATE ile okuyup yazmak yerine tek koşullu UPDATE (kilit sadece bu ifade boyunca)
+        if hareket == 'GIRIS':
+            cursor.execute("UPDATE stok SET miktar = miktar + %s WHERE urun_id=%s", (miktar_int, urun_id))
+        else:
+            cursor.execute(
+                "UPDATE stok SET miktar = miktar - %s WHERE urun_id=%s AND miktar >= %s",
+                (miktar_int, urun_id, miktar_int)
+            )
+        if cursor.rowcount != 1:
             conn.rollback()
-            flash('Stok negatif olamaz.', 'warning')
+            cursor.execute("SELECT 1 FROM stok WHERE urun_id=%s", (urun_id,))
+            if cursor.fetchone():
+                flash('Stok negatif olamaz.', 'warning')
+            else:
+                flash('Ürün stok kaydı yok.', 'danger')
             return redirect(url_for('admin_urunler'))
 
-        cursor.execute("UPDATE stok SET miktar=%s WHERE urun_id=%s", (yeni_miktar, urun_id))
         cursor.execute("""
             INSERT INTO stok_hareketi (urun_id, siparis_id, hareket_tipi, miktar, aciklama, yapan_id)
             VALUES (%s, NULL, %s, %s, %s, %s)
         """, (urun_id, hareket, miktar_int if hareket == 'GIRIS' else -miktar_int, aciklama, session['user_id']))
+        stock_cache.invalidate(cursor)
         conn.commit()
         flash('Stok güncellendi.', 'success')
         return redirect(url_for('admin_urunler'))
@@ -1338,6 +4396,64 @@ def admin_stok_hareket():
     finally:
         conn.close()
 
+@app.route('/admin/stok/toplu', methods=['POST'])
+@role_required(['ADMIN'])
+def admin_stok_toplu():
+    # Dosya (CSV/JSON), metin kutusu veya ham JSON gövdesi kabul edilir;
+    # Accept: application/json isteyen betiklere satır bazlı sonuç JSON döner
+    json_yanit = request.is_json or request.accept_mimetypes.best == 'application/json'
+    dosya = request.files.get('dosya')
+    if request.is_json:
+        metin = request.get_data(as_text=True)
+    elif dosya and dosya.filename:
+        metin = dosya.read().decode('utf-8', errors='replace')
+    else:
+        metin = request.form.get('satirlar', '')
+
+    def sonuc(hatalar, islenen=0, sure_ms=0):
+        if json_yanit:
+            return jsonify({
+                'basarili': not hatalar,
+                'islenen': islenen,
+                'sure_ms': sure_ms,
+                'hatalar': [{'satir': no, 'hata': hata} for no, hata in hatalar],
+            }), (200 if not hatalar else 422)
+        if hatalar:
+            limit = stok_import_config['hata_gosterim']
+            for no, hata in hatalar[:limit]:
+                flash(f'Satır {no}: {hata}' if no else hata, 'warning')
+            if len(hatalar) > limit:
+                flash(f'... ve {len(hatalar) - limit} hata daha. Hiçbir satır uygulanmadı.', 'warning')
+            else:
+                flash('Hiçbir satır uygulanmadı.', 'warning')
+        else:
+            flash(f'{islenen} stok hareketi işlendi ({sure_ms} ms).', 'success')
+        return redirect(url_for('admin_urunler'))
+
+    baslangic = time.perf_counter()
+    satirlar, hatalar = parse_stok_import(metin)
+    if hatalar:
+        return sonuc(hatalar)
+
+    conn = get_db_connection()
+    if not conn:
+        return sonuc([(0, 'Veritabanı bağlantısı yok.')])
+
+    try:
+        cursor = conn.cursor()
+        conn.start_transaction()
+        hatalar = apply_stok_import(cursor, satirlar, session['user_id'])
+        if hatalar:
+            conn.rollback()
+            return sonuc(hatalar)
+        conn.commit()
+        return sonuc([], len(satirlar), round((time.perf_counter() - baslangic) * 1000))
+    except Exception as e:
+        conn.rollback()
+        return sonuc([(0, f'Hata: {e}')])
+    finally:
+        conn.close()
+
 @app.route('/yorum/ekle', methods=['POST'])
 @login_required
 def yorum_ekle():
@@ -1345,8 +4461,8 @@ def yorum_ekle():
     puan = request.form.get('puan', type=int)
     metin = (request.form.get('metin') or '').strip()
 
-    if not urun_id or not puan:
-        flash('Ürün ve puan zorunlu.', 'warning')
+    if not urun_id or not puan or not 1 <= puan <= 5:
+        flash('Ürün ve puan (1-5) zorunlu.', 'warning')
         return redirect(request.referrer or url_for('index'))
 
     conn = get_db_connection()
@@ -1374,6 +4490,10 @@ def yorum_ekle():
             INSERT INTO yorum (urun_id, musteri_id, siparis_id, puan, metin, onay_durumu)
             VALUES (%s, %s, %s, %s, %s, 1)
         """, (urun_id, session['user_id'], siparis_id, puan, metin))
+        adjust_panel_sayac(cursor, 'yorum', 1)
+        adjust_urun_puan(cursor, urun_id, 1, puan)
+        review_version_cache.invalidate(cursor)
+        catalog_cache.invalidate(cursor)
         conn.commit()
         flash('Yorumunuz başarıyla eklendi. Teşekkürler!', 'success')
     finally:
@@ -1382,20 +4502,10 @@ def yorum_ekle():
 @app.route('/admin/siparis/<int:id>/<action>', methods=['POST'])
 @role_required(['ADMIN'])
 def admin_siparis_islem(id, action):
-    actions = {
-        'onayla': ('ONAYLANDI', {'OLUSTURULDU'}),
-        'hazirla': ('HAZIRLANIYOR', {'ONAYLANDI'}),
-        'iptal': ('IPTAL_EDILDI', {'OLUSTURULDU', 'ONAYLANDI', 'HAZIRLANIYOR', 'KURYE_ATANDI'}),
-        'reddet': ('REDDEDILDI', {'OLUSTURULDU'}),
-        'kapat': ('TESLIM_EDILDI', {'YOLDA'})
-    }
-
-    if action not in actions:
+    if action not in SIPARIS_ISLEMLERI:
         flash('Geçersiz işlem.', 'danger')
         return redirect(url_for('admin_siparisler'))
 
-    yeni_durum, izinli_eski = actions[action]
-
     conn = get_db_connection()
     if not conn:
         flash('Veritabanı bağlantısı yok.', 'danger')
@@ -1404,39 +4514,14 @@ def admin_siparis_islem(id, action):
     try:
         cursor = conn.cursor()
         conn.start_transaction()
-        cursor.execute("SELECT durum FROM siparis WHERE id=%s", (id,))
-        row = cursor.fetchone()
-        if not row:
-            conn.rollback()
-            flash('Sipariş bulunamadı.', 'danger')
-            return redirect(url_for('admin_siparisler'))
-
-        eski_durum = row[0]
-        if eski_durum not in izinli_eski:
+        sonuclar, gecisler = apply_siparis_islemi(cursor, [id], action, session['user_id'])
+        if sonuclar[id]:
             conn.rollback()
-            flash(f'Bu işlem için uygun durum değil: {eski_durum}', 'warning')
+            flash(sonuclar[id], 'warning')
             return redirect(url_for('admin_siparisler'))
-
-        if action == 'iptal' or action == 'reddet':
-            # İptal veya Red durumunda stokları iade et
-            cursor.execute("SELECT urun_id, adet FROM siparis_detay WHERE siparis_id=%s", (id,))
-            detaylar = cursor.fetchall()
-            for urun_id, adet in detaylar:
-                cursor.execute("UPDATE stok SET miktar = miktar + %s WHERE urun_id=%s", (adet, urun_id))
-                cursor.execute("""
-                    INSERT INTO stok_hareketi (urun_id, siparis_id, hareket_tipi, miktar, aciklama, yapan_id)
-                    VALUES (%s, %s, 'IADE', %s, 'Sipariş iptal/red iadesi', %s)
-                """, (urun_id, id, adet, session['user_id']))
-
-            cursor.execute("UPDATE siparis SET durum=%s, kurye_id=NULL WHERE id=%s", (yeni_durum, id))
-        else:
-            cursor.execute("UPDATE siparis SET durum=%s WHERE id=%s", (yeni_durum, id))
-
-        cursor.execute("""
-            INSERT INTO siparis_durum_log (siparis_id, eski_durum, yeni_durum, degistiren_id, aciklama, tarih)
-            VALUES (%s, %s, %s, %s, 'Admin İşlemi', NOW())
-        """, (id, eski_durum, yeni_durum, session['user_id']))
         conn.commit()
+        for gecis in gecisler:
+            publish_siparis_olayi(*gecis)
         flash('Sipariş durumu güncellendi.', 'success')
         return redirect(url_for('admin_siparisler'))
     except Exception as e:
@@ -1446,6 +4531,72 @@ def admin_siparis_islem(id, action):
     finally:
         conn.close()
 
+@app.route('/admin/siparis/toplu', methods=['POST'])
+@role_required(['ADMIN'])
+def admin_siparis_toplu():
+    # Çoklu seçim: uygun durumdaki siparişler geçer, diğerleri sipariş bazında raporlanır.
+    # Accept: application/json isteyen çağrılara sonuç JSON döner
+    json_yanit = request.is_json or request.accept_mimetypes.best == 'application/json'
+    if request.is_json:
+        veri = request.get_json(silent=True)
+        if not isinstance(veri, dict):
+            veri = {}
+        ham_idler = veri.get('siparis_id') or []
+        if not isinstance(ham_idler, list):
+            ham_idler = [ham_idler]
+    else:
+        veri = request.form
+        ham_idler = request.form.getlist('siparis_id')
+    action = veri.get('islem', '')
+    try:
+        siparis_idler = sorted({int(i) for i in ham_idler})
+    except (TypeError, ValueError):
+        siparis_idler = None
+
+    def sonuc(mesaj, sonuclar=None, durum_kodu=200):
+        if json_yanit:
+            return jsonify({
+                'mesaj': mesaj,
+                'sonuclar': [{'siparis_id': i, 'basarili': not hata, 'hata': hata}
+                             for i, hata in (sonuclar or {}).items()],
+            }), durum_kodu
+        if sonuclar is None:
+            flash(mesaj, 'danger' if durum_kodu >= 500 else 'warning')
+        else:
+            basarili = sum(1 for hata in sonuclar.values() if not hata)
+            if basarili:
+                flash(f'{basarili} sipariş güncellendi.', 'success')
+            for siparis_id, hata in sonuclar.items():
+                if hata:
+                    flash(f'#{siparis_id}: {hata}', 'warning')
+        return redirect(url_for('admin_siparisler'))
+
+    if action not in SIPARIS_ISLEMLERI:
+        return sonuc('Geçersiz işlem.', durum_kodu=400)
+    if not siparis_idler:
+        return sonuc('Sipariş seçilmedi.', durum_kodu=400)
+    if len(siparis_idler) > TOPLU_SIPARIS_LIMIT:
+        return sonuc(f'Tek seferde en fazla {TOPLU_SIPARIS_LIMIT} sipariş işlenebilir.', durum_kodu=400)
+
+    conn = get_db_connection()
+    if not conn:
+        return sonuc('Veritabanı bağlantısı yok.', durum_kodu=503)
+
+    try:
+        cursor = conn.cursor()
+        conn.start_transaction()
+        sonuclar, gecisler = apply_siparis_islemi(cursor, siparis_idler, action, session['user_id'],
+                                                  'Admin Toplu İşlem')
+        conn.commit()
+        for gecis in gecisler:
+            publish_siparis_olayi(*gecis)
+        return sonuc(f'{len(gecisler)}/{len(siparis_idler)} sipariş güncellendi.', sonuclar)
+    except Exception as e:
+        conn.rollback()
+        return sonuc(f'Hata: {e}', durum_kodu=500)
+    finally:
+        conn.close()
+
 @app.route('/kurye')
 @role_required(['KURYE', 'ADMIN'])
 def kurye_panel():
@@ -1491,7 +4642,7 @@ def kurye_islem(id, action):
     cursor = conn.cursor()
     
     # Siparişi kontrol et (Tuple index access fixed)
-    cursor.execute("SELECT durum, kurye_id FROM siparis WHERE id=%s", (id,))
+    cursor.execute("SELECT durum, kurye_id, musteri_id FROM siparis WHERE id=%s", (id,))
     siparis = cursor.fetchone() # returns tuple like ('HAZIRLANIYOR', 2)
     
     if not siparis:
@@ -1537,12 +4688,11 @@ def kurye_islem(id, action):
             flash('Bu işlemi yapma yetkiniz yok.', 'danger')
 
     if yeni_durum:
-        # Log Ekle
-        cursor.execute("""
-            INSERT INTO siparis_durum_log (siparis_id, eski_durum, yeni_durum, degistiren_id, aciklama, tarih)
-            VALUES (%s, %s, %s, %s, 'Kurye Islemi', NOW())
-        """, (id, eski_durum, yeni_durum, session['user_id']))
+        # Log Ekle (olay kutusu üzerinden)
+        track_siparis_gecisi(cursor, eski_durum, yeni_durum)
+        enqueue_event(cursor, 'SIPARIS_DURUM', loglar=[(id, eski_durum, yeni_durum, session['user_id'], 'Kurye Islemi')])
         conn.commit()
+        publish_siparis_olayi(id, eski_durum, yeni_durum, siparis[2], mevcut_kurye)
         if isinstance(msj, tuple): msj = msj[0] # Tuple fix
         flash(msj, 'success')
         
@@ -1590,7 +4740,14 @@ def admin_yorum_onayla(id):
     conn = get_db_connection()
     if conn:
         cursor = conn.cursor()
-        cursor.execute("UPDATE yorum SET onay_durumu=1 WHERE id=%s", (id,))
+        cursor.execute("SELECT urun_id, puan FROM yorum WHERE id=%s AND onay_durumu=0 FOR UPDATE", (id,))
+        yorum = cursor.fetchone()
+        cursor.execute("UPDATE yorum SET onay_durumu=1 WHERE id=%s AND onay_durumu=0", (id,))
+        if yorum and cursor.rowcount:
+            # Sadece onaysızdan onaylıya geçişte sayılır; çift tıklama iki kez eklemez
+            adjust_urun_puan(cursor, yorum[0], 1, yorum[1])
+            catalog_cache.invalidate(cursor)
+        review_version_cache.invalidate(cursor)
         conn.commit()
         conn.close()
         flash('Yorum onaylandı.', 'success')
@@ -1602,7 +4759,14 @@ def admin_yorum_sil(id):
     conn = get_db_connection()
     if conn:
         cursor = conn.cursor()
+        cursor.execute("SELECT urun_id, puan, onay_durumu FROM yorum WHERE id=%s FOR UPDATE", (id,))
+        yorum = cursor.fetchone()
         cursor.execute("DELETE FROM yorum WHERE id=%s", (id,))
+        adjust_panel_sayac(cursor, 'yorum', -cursor.rowcount)
+        if yorum and cursor.rowcount and yorum[2]:
+            adjust_urun_puan(cursor, yorum[0], -1, yorum[1])
+            catalog_cache.invalidate(cursor)
+        review_version_cache.invalidate(cursor)
         conn.commit()
         conn.close()
         flash('Yorum silindi.', 'success')
@@ -1621,10 +4785,10 @@ def iletisim():
             conn = get_db_connection()
             if conn:
                 cursor = conn.cursor()
-                cursor.execute("""
-                    INSERT INTO mesajlar (gonderen_id, gonderen_rol, alici_id, alici_rol, konu, mesaj)
-                    VALUES (%s, 'MUSTERI', 1, 'ADMIN', %s, %s)
-                """, (session['user_id'], konu, mesaj))
+                gonderen = mesaj_katilimcisi('MUSTERI', session['user_id'])
+                alici = mesaj_katilimcisi('ADMIN', ADMIN_KUTUSU_ID)
+                konusma_id = create_konusma(cursor, konu, gonderen, alici)
+                append_mesaj(cursor, konusma_id, gonderen, session['user_id'], alici, konu, mesaj)
                 conn.commit()
                 conn.close()
                 flash('Mesajınız yöneticiye gönderildi!', 'success')
@@ -1636,6 +4800,13 @@ def iletisim():
             
     return render_template('iletisim.html')
 
+def mesaj_kutusu_url():
+    if session.get('rol') == 'ADMIN':
+        return url_for('admin_mesajlar')
+    elif session.get('rol') == 'KURYE':
+        return url_for('kurye_mesajlar')
+    return url_for('mesajlarim')
+
 @app.route('/mesaj/gonder', methods=['POST'])
 @login_required
 def mesaj_gonder():
@@ -1643,39 +4814,126 @@ def mesaj_gonder():
     alici_id = request.form.get('alici_id', 1) # Varsayılan Admin ID=1
     konu = request.form.get('konu')
     mesaj = request.form.get('mesaj')
+    konusma_id = request.form.get('konusma_id', type=int)
+    original_id = request.form.get('original_message_id')
     
     # Güvenlik: P2P iletişimi aktif (Kurye <-> Müşteri, Herkes <-> Admin)
     gonderen_rol = session['rol']
-    # Restriction Removed by User Request
-    pass
-        
+    gonderen = mesaj_katilimcisi(gonderen_rol, session['user_id'])
     
+    conn = get_db_connection()
+    if not conn:
+        flash('Veritabanı bağlantısı yok.', 'danger')
+        return redirect(mesaj_kutusu_url())
+
+    try:
+        cursor = conn.cursor(dictionary=True)
+
+        # Yanıt ise orijinal mesajı YANITLANDI yap ve aynı konuşmaya yaz
+        if original_id:
+            cursor.execute("SELECT id, konusma_id, alici_rol, alici_id, durum FROM mesajlar WHERE id=%s", (original_id,))
+            orijinal = cursor.fetchone()
+            if orijinal:
+                cursor.execute("UPDATE mesajlar SET durum='YANITLANDI' WHERE id=%s", (original_id,))
+                if orijinal['alici_rol'] == 'ADMIN' and orijinal['durum'] == 'BEKLIYOR':
+                    adjust_panel_sayac(cursor, 'okunmamis_mesaj', -1)
+                konusma_id = konusma_id or orijinal['konusma_id']
+
+        if konusma_id:
+            # Mevcut konuşma: alıcı her zaman konuşmadaki karşı taraftır
+            alici = find_konusma_karsi(cursor, konusma_id, gonderen)
+            if not alici:
+                conn.rollback()
+                flash('Bu konuşmaya mesaj gönderemezsiniz.', 'danger')
+                return redirect(mesaj_kutusu_url())
+            if not konu:
+                cursor.execute("SELECT konu FROM konusma WHERE id=%s", (konusma_id,))
+                konu = cursor.fetchone()['konu']
+        else:
+            alici = mesaj_katilimcisi(alici_rol, alici_id)
+            konusma_id = create_konusma(cursor, konu, gonderen, alici)
+
+        append_mesaj(cursor, konusma_id, gonderen, session['user_id'], alici, konu, mesaj)
+        conn.commit()
+        flash('Mesajınız gönderildi.', 'success')
+    except Exception as e:
+        conn.rollback()
+        flash(f'Hata: {e}', 'danger')
+        return redirect(mesaj_kutusu_url())
+    finally:
+        conn.close()
+
+    return redirect(url_for('konusma_detay', id=konusma_id))
+
+@app.route('/mesajlar/konusma/<int:id>')
+@login_required
+def konusma_detay(id):
+    conn = get_db_connection()
+    if not conn: return redirect(mesaj_kutusu_url())
+    cursor = conn.cursor(dictionary=True)
+
+    ben = mesaj_katilimcisi(session['rol'], session['user_id'])
+    karsi = find_konusma_karsi(cursor, id, ben)
+    if not karsi:
+        conn.close()
+        flash('Konuşma bulunamadı.', 'warning')
+        return redirect(mesaj_kutusu_url())
+
+    cursor.execute("SELECT id, konu FROM konusma WHERE id=%s", (id,))
+    konusma = cursor.fetchone()
+
+    # Mesajlar (konusma_id, id) index'i üzerinde yeniden eskiye sayfalanır
+    kosullar = ["konusma_id=%s",
+                "NOT ((gonderen_rol=%s AND silindi_gonderen=1) OR (alici_rol=%s AND silindi_alici=1))"]
+    params = [id, ben[0], ben[0]]
+    once = request.args.get('once', type=int)
+    if once:
+        kosullar.append("id < %s")
+        params.append(once)
+    cursor.execute(f"""
+        SELECT * FROM mesajlar
+        WHERE {" AND ".join(kosullar)}
+        ORDER BY id DESC
+        LIMIT %s
+    """, params + [MESAJ_SAYFA + 1])
+    mesajlar = cursor.fetchall()
+    daha_eski = None
+    if len(mesajlar) > MESAJ_SAYFA:
+        mesajlar = mesajlar[:MESAJ_SAYFA]
+        daha_eski = mesajlar[-1]['id']
+    mesajlar.reverse()
+
+    karsi_ad = 'Yönetici'
+    if karsi[0] in ('MUSTERI', 'KURYE'):
+        cursor.execute(f"SELECT ad, soyad FROM {'musteri' if karsi[0] == 'MUSTERI' else 'kurye'} WHERE id=%s",
+                       (karsi[1],))
+        row = cursor.fetchone()
+        karsi_ad = f"{row['ad']} {row['soyad']}" if row else '-'
+
+    mark_konusma_okundu(cursor, id, ben)
+    conn.commit()
+    conn.close()
+    return render_template('konusma.html', konusma=konusma, mesajlar=mesajlar, daha_eski=daha_eski,
+                           karsi_ad=karsi_ad, ben_rol=ben[0], geri_url=mesaj_kutusu_url())
+
+@app.route('/mesajlar/konusma/<int:id>/sil', methods=['POST'])
+@login_required
+def konusma_sil(id):
+    # Konuşmayı sadece kendi kutusundan kaldırır; yeni mesaj gelirse tekrar görünür
     conn = get_db_connection()
     if conn:
         cursor = conn.cursor()
-        
-        # Insert New Message
+        ben = mesaj_katilimcisi(session['rol'], session['user_id'])
         cursor.execute("""
-            INSERT INTO mesajlar (gonderen_id, gonderen_rol, alici_id, alici_rol, konu, mesaj)
-            VALUES (%s, %s, %s, %s, %s, %s)
-        """, (session['user_id'], gonderen_rol, alici_id, alici_rol, konu, mesaj))
-        
-        # Mark original message as REPLIED (if this is a reply)
-        original_id = request.form.get('original_message_id')
-        if original_id:
-            cursor.execute("UPDATE mesajlar SET durum='YANITLANDI' WHERE id=%s", (original_id,))
-            
+            UPDATE konusma_katilimci SET silindi=1, okunmamis=0
+            WHERE konusma_id=%s AND katilimci_rol=%s AND katilimci_id=%s
+        """, (id, ben[0], ben[1]))
+        if ben[0] == 'ADMIN' and cursor.rowcount:
+            yanitla_admin_mesajlari(cursor, id)
         conn.commit()
         conn.close()
-        flash('Mesajınız gönderildi.', 'success')
-    
-    # Yönlendirme mantığı
-    if gonderen_rol == 'ADMIN':
-        return redirect(url_for('admin_mesajlar'))
-    elif gonderen_rol == 'KURYE':
-        return redirect(url_for('kurye_mesajlar'))
-    else:
-        return redirect(url_for('mesajlarim'))
+        flash('Konuşma silindi.', 'success')
+    return redirect(mesaj_kutusu_url())
 
 @app.route('/admin/mesajlar')
 @role_required(['ADMIN'])
@@ -1683,40 +4941,20 @@ def admin_mesajlar():
     conn = get_db_connection()
     if not conn: return redirect(url_for('admin_panel'))
     cursor = conn.cursor(dictionary=True)
-    
-    # Müşteri Mesajları (Eski tablo + Yeni tablo birleşik mantık yerine, sadece yeni tabloya geçiyoruz zamanla)
-    # Şimdilik temiz olsun diye sadece 'mesajlar' tablosundan çekiyoruz.
-    # Ancak eski 'iletisim_mesajlari' tablosunu da görebilmeli.
-    # Kullanıcıya kolaylık olsun diye şimdilik SADECE YENİ SİSTEMİ gösteriyorum.
-    
-    # Müşterilerden Gelenler
-    cursor.execute("""
-        SELECT m.*, mus.ad, mus.soyad 
-        FROM mesajlar m
-        JOIN musteri mus ON m.gonderen_id = mus.id
-        WHERE m.gonderen_rol = 'MUSTERI' AND m.alici_rol = 'ADMIN'
-        ORDER BY m.tarih DESC
-    """)
-    musteri_mesajlari = cursor.fetchall()
-    
-    # Kuryelerden Gelenler
-    cursor.execute("""
-        SELECT m.*, k.ad, k.soyad 
-        FROM mesajlar m
-        JOIN kurye k ON m.gonderen_id = k.id
-        WHERE m.gonderen_rol = 'KURYE' AND m.alici_rol = 'ADMIN'
-        ORDER BY m.tarih DESC
-    """)
-    kurye_mesajlari = cursor.fetchall()
+
+    # Müşteri ve kurye konuşmaları ayrı sekmelerde; her sekme kendi sayfasını çeker
+    sekme = request.args.get('sekme', 'MUSTERI')
+    if sekme not in ('MUSTERI', 'KURYE'):
+        sekme = 'MUSTERI'
+    konusmalar, sonraki = fetch_gelen_kutusu(cursor, mesaj_katilimcisi('ADMIN', ADMIN_KUTUSU_ID),
+                                             request.args.get('once'), karsi_rol=sekme)
 
     # Kurye Listesi (Dropdown için)
     cursor.execute("SELECT id, ad, soyad FROM kurye")
     kuryeler = cursor.fetchall()
     
     conn.close()
-    return render_template('admin_mesajlar.html', 
-                          musteri_mesajlari=musteri_mesajlari, 
-                          kurye_mesajlari=kurye_mesajlari,
+    return render_template('admin_mesajlar.html', konusmalar=konusmalar, sonraki=sonraki, sekme=sekme,
                           kuryeler=kuryeler)
 
 @app.route('/admin/mesaj/sil/<int:id>', methods=['POST'])
@@ -1724,12 +4962,25 @@ def admin_mesajlar():
 def admin_mesaj_sil(id):
     conn = get_db_connection()
     if conn:
-        cursor = conn.cursor()
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("SELECT id, konusma_id, alici_rol, alici_id, durum FROM mesajlar WHERE id=%s", (id,))
+        msg = cursor.fetchone()
         cursor.execute("DELETE FROM mesajlar WHERE id=%s", (id,))
+        if msg and cursor.rowcount:
+            if msg['alici_rol'] == 'ADMIN' and msg['durum'] == 'BEKLIYOR':
+                adjust_panel_sayac(cursor, 'okunmamis_mesaj', -1)
+            forget_okunmamis_mesaj(cursor, msg)
+            if msg['konusma_id']:
+                # Son mesaj silindiyse işaretçiyi bir öncekine çek ((konusma_id, id) index'i)
+                cursor.execute("""
+                    UPDATE konusma
+                    SET son_mesaj_id = (SELECT MAX(id) FROM mesajlar WHERE konusma_id=%s)
+                    WHERE id=%s AND son_mesaj_id=%s
+                """, (msg['konusma_id'], msg['konusma_id'], id))
         conn.commit()
         conn.close()
         flash('Mesaj veritabanından kalıcı olarak silindi.', 'success')
-    return redirect(url_for('admin_mesajlar'))
+    return redirect(request.referrer or url_for('admin_mesajlar'))
 
 @app.route('/mesaj/sil/kullanici/<int:id>', methods=['POST'])
 @login_required
@@ -1754,6 +5005,8 @@ def generic_mesaj_sil(id):
                 
             elif msg['alici_id'] == user_id and msg['alici_rol'] == rol:
                 cursor.execute("UPDATE mesajlar SET silindi_alici=1 WHERE id=%s", (id,))
+                # Okunmadan silindiyse konuşmanın okunmamış sayacından düş
+                forget_okunmamis_mesaj(cursor, msg)
                 conn.commit()
                 flash('Mesaj silindi.', 'success')
             else:
@@ -1764,42 +5017,20 @@ def generic_mesaj_sil(id):
         conn.close()
         
     # Redirect back
-    if session['rol'] == 'KURYE':
-        return redirect(url_for('kurye_mesajlar'))
-    else:
-        return redirect(url_for('mesajlarim'))
+    return redirect(request.referrer or mesaj_kutusu_url())
 
 @app.route('/kurye/mesajlar')
 @role_required(['KURYE'])
 def kurye_mesajlar():
     conn = get_db_connection()
+    if not conn: return redirect(url_for('kurye_panel'))
     cursor = conn.cursor(dictionary=True)
     
-    # Gelen Kutusu (Kurye silmemişse silindi_alici=0)
-    cursor.execute("""
-        SELECT m.*, 
-            CASE 
-                WHEN m.gonderen_rol = 'ADMIN' THEN 'Yönetici'
-                WHEN m.gonderen_rol = 'MUSTERI' THEN CONCAT(mu.ad, ' ', mu.soyad, ' (Müşteri)')
-                ELSE m.gonderen_rol
-            END as gonderen_ad
-        FROM mesajlar m
-        LEFT JOIN musteri mu ON (m.gonderen_rol = 'MUSTERI' AND m.gonderen_id = mu.id)
-        WHERE m.alici_id=%s AND m.alici_rol='KURYE' AND m.silindi_alici=0
-        ORDER BY m.tarih DESC
-    """, (session['user_id'],))
-    gelen_kutusu = cursor.fetchall()
-    
-    # Giden Kutusu (Kurye silmemişse silindi_gonderen=0)
-    cursor.execute("""
-        SELECT * FROM mesajlar 
-        WHERE gonderen_id=%s AND gonderen_rol='KURYE' AND silindi_gonderen=0
-        ORDER BY tarih DESC
-    """, (session['user_id'],))
-    giden_kutusu = cursor.fetchall()
+    konusmalar, sonraki = fetch_gelen_kutusu(cursor, mesaj_katilimcisi('KURYE', session['user_id']),
+                                             request.args.get('once'))
     
     conn.close()
-    return render_template('kurye_mesajlar.html', gelen_kutusu=gelen_kutusu, giden_kutusu=giden_kutusu)
+    return render_template('kurye_mesajlar.html', konusmalar=konusmalar, sonraki=sonraki)
 
 @app.route('/mesajlarim')
 @login_required
@@ -1808,51 +5039,11 @@ def mesajlarim():
     if not conn: return redirect(url_for('index'))
     cursor = conn.cursor(dictionary=True)
     
-    # 1. Eski Sistem Mesajları (Ticket tarzı)
-    cursor.execute("""
-        SELECT * FROM iletisim_mesajlari 
-        WHERE musteri_id=%s 
-        ORDER BY tarih DESC
-    """, (session['user_id'],))
-    eski_mesajlar = cursor.fetchall()
-    
-    # 2. Yeni Sistem Mesajları (Chat tarzı)
-    # MUSTERI için:
-    #   - Gelenler: Alici=Beni ID, AliciRol=MUSTERI, silindi_alici=0
-    #   - Gidenler: Gonderen=BenID, GonderenRol=MUSTERI, silindi_gonderen=0
-    # Tek sorguda birleştirelim veya ayrı ayrı? Template structure supports mixed list.
-    # Current template iterates 'yeni_mesajlar' which included both? 
-    # Wait, earlier I updated `mesajlarim` route to query `iletisim_mesajlari` AND `mesajlar`. 
-    # Let me refetch the ACTUAL `mesajlarim` route implementation because `view_file` cut off right before it.
-    # But based on `kurye_mesajlar` pattern, I will assume I need to fetch `yeni_mesajlar` as a UNION or similar.
-    # Actually, previous interaction log shows the edit to `mesajlarim` route (Lines 1515 in PREVIOUS session).
-    # Since `view_file` cut off, I will REWRITE `mesajlarim` function completely here.
-    
-    cursor.execute("""
-        SELECT m.*, 
-            CASE 
-                WHEN m.gonderen_rol='ADMIN' THEN 'Yönetici'
-                WHEN m.gonderen_rol='KURYE' THEN CONCAT(k.ad, ' ', k.soyad, ' (Kurye)')
-                ELSE 'Siz'
-            END as gonderen_ad,
-            CASE 
-                WHEN m.alici_rol='ADMIN' THEN 'Yönetici'
-                WHEN m.alici_rol='KURYE' THEN CONCAT(k2.ad, ' ', k2.soyad, ' (Kurye)')
-                ELSE 'Müşteri'
-            END as alici_ad
-        FROM mesajlar m
-        LEFT JOIN kurye k ON (m.gonderen_rol='KURYE' AND m.gonderen_id=k.id)
-        LEFT JOIN kurye k2 ON (m.alici_rol='KURYE' AND m.alici_id=k2.id)
-        WHERE 
-           (m.gonderen_id=%s AND m.gonderen_rol='MUSTERI' AND m.silindi_gonderen=0)
-           OR 
-           (m.alici_id=%s AND m.alici_rol='MUSTERI' AND m.silindi_alici=0)
-        ORDER BY m.tarih DESC
-    """, (session['user_id'], session['user_id']))
-    yeni_mesajlar = cursor.fetchall()
+    konusmalar, sonraki = fetch_gelen_kutusu(cursor, mesaj_katilimcisi(session['rol'], session['user_id']),
+                                             request.args.get('once'))
 
     conn.close()
-    return render_template('mesajlarim.html', eski_mesajlar=eski_mesajlar, yeni_mesajlar=yeni_mesajlar)
+    return render_template('mesajlarim.html', konusmalar=konusmalar, sonraki=sonraki)
 
 @app.route('/admin/iletisim/sil/<int:id>', methods=['POST'])
 @role_required(['ADMIN'])
@@ -1886,6 +5077,7 @@ def admin_ayarlar():
             SET site_baslik=%s, telefon=%s, adres=%s, email=%s, hero_baslik=%s, hero_alt_baslik=%s
             WHERE id=1
         """, (site_baslik, telefon, adres, email, hero_baslik, hero_alt_baslik))
+        site_settings_cache.invalidate(cursor)
         conn.commit()
         flash('Site ayarları güncellendi.', 'success')
         conn.close()
@@ -1897,4 +5089,7 @@ def admin_ayarlar():
     return render_template('admin_ayarlar.html', ayarlar=ayarlar)
 
 if __name__ == '__main__':
+    # Debug reloader ana süreci sadece izler; worker'lar asıl (alt) süreçte başlar
+    if outbox_config['run_in_app'] and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_workers()
     app.run(debug=True)
@@ -10,6 +10,20 @@ USE firin_db;
 
 SET FOREIGN_KEY_CHECKS = 0;
 
+DROP TABLE IF EXISTS stok_hareketi_arsiv;
+DROP TABLE IF EXISTS siparis_durum_log_arsiv;
+DROP TABLE IF EXISTS konusma_katilimci;
+DROP TABLE IF EXISTS konusma;
+DROP TABLE IF EXISTS uretim_plani;
+DROP TABLE IF EXISTS rapor_isaret;
+DROP TABLE IF EXISTS rapor_kupon_gunluk;
+DROP TABLE IF EXISTS rapor_urun_gunluk;
+DROP TABLE IF EXISTS rapor_gunluk;
+DROP TABLE IF EXISTS urun_puan;
+DROP TABLE IF EXISTS panel_sayac;
+DROP TABLE IF EXISTS olay_kutusu;
+DROP TABLE IF EXISTS stok_rezervasyon;
+DROP TABLE IF EXISTS onbellek_surum;
 DROP TABLE IF EXISTS stok_hareketi;
 DROP TABLE IF EXISTS yorum;
 DROP TABLE IF EXISTS favoriler;
@@ -91,9 +105,13 @@ CREATE TABLE siparis (
     CONSTRAINT fk_siparis_adres FOREIGN KEY (adres_id) REFERENCES adres(id)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
-CREATE INDEX ix_siparis_musteri ON siparis(musteri_id);
-CREATE INDEX ix_siparis_kurye ON siparis(kurye_id);
-CREATE INDEX ix_siparis_durum ON siparis(durum);
+CREATE INDEX ix_siparis_musteri ON siparis(musteri_id, tarih, id);
+CREATE INDEX ix_siparis_kurye ON siparis(kurye_id, tarih, id);
+CREATE INDEX ix_siparis_durum ON siparis(durum, tarih, id);
+-- Admin sipariş listesi (tarih, id) üzerinde keyset sayfalama yapar
+CREATE INDEX ix_siparis_tarih ON siparis(tarih, id);
+-- Admin kurye listesi kurye başına teslim/aktif sayımlarını index üzerinden gruplar
+CREATE INDEX ix_siparis_kurye_durum ON siparis(kurye_id, durum);
 
 -- 7) SIPARIS_DETAY
 CREATE TABLE siparis_detay (
@@ -115,11 +133,14 @@ CREATE TABLE siparis_durum_log (
     degistiren_id INT NOT NULL,
     aciklama VARCHAR(255),
     tarih TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    olay_anahtari VARCHAR(40) NULL,
+    UNIQUE KEY uk_log_olay (olay_anahtari),
     CONSTRAINT fk_log_siparis FOREIGN KEY (siparis_id) REFERENCES siparis(id) ON DELETE CASCADE,
     CONSTRAINT fk_log_degistiren FOREIGN KEY (degistiren_id) REFERENCES kullanici(id)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
-CREATE INDEX ix_log_degistiren ON siparis_durum_log(degistiren_id);
+-- islemlerim: kullanıcının son işlemleri (ORDER BY tarih DESC, id DESC LIMIT 100)
+CREATE INDEX ix_log_degistiren ON siparis_durum_log(degistiren_id, tarih, id);
 CREATE INDEX ix_log_siparis ON siparis_durum_log(siparis_id);
 
 -- 9) SEPET
@@ -158,6 +179,9 @@ CREATE TABLE yorum (
     CONSTRAINT fk_yorum_siparis FOREIGN KEY (siparis_id) REFERENCES siparis(id) ON DELETE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
+-- Ürün sayfası: onaylı yorumlar (tarih, id) sırasıyla keyset sayfalanır
+CREATE INDEX ix_yorum_urun_onay_tarih ON yorum(urun_id, onay_durumu, tarih, id);
+
 -- 12) KUPON
 CREATE TABLE kupon (
     id INT PRIMARY KEY AUTO_INCREMENT,
@@ -178,14 +202,149 @@ CREATE TABLE stok_hareketi (
     aciklama TEXT,
     yapan_id INT NOT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    olay_anahtari VARCHAR(40) NULL,
+    UNIQUE KEY uk_sh_olay (olay_anahtari),
     CONSTRAINT fk_sh_urun FOREIGN KEY (urun_id) REFERENCES urun(id),
     CONSTRAINT fk_sh_siparis FOREIGN KEY (siparis_id) REFERENCES siparis(id) ON DELETE SET NULL,
     CONSTRAINT fk_sh_yapan FOREIGN KEY (yapan_id) REFERENCES kullanici(id)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
 CREATE INDEX ix_sh_urun ON stok_hareketi(urun_id);
-CREATE INDEX ix_sh_yapan ON stok_hareketi(yapan_id);
+-- islemlerim: kullanıcının son stok işlemleri (ORDER BY created_at DESC, id DESC LIMIT 100)
+CREATE INDEX ix_sh_yapan ON stok_hareketi(yapan_id, created_at, id);
 CREATE INDEX ix_sh_siparis ON stok_hareketi(siparis_id);
+-- Talep tahmini: tip + tarih aralığında ürün/gün gruplaması (kapsayan index)
+CREATE INDEX ix_sh_tip_tarih ON stok_hareketi(hareket_tipi, created_at, urun_id, miktar);
+
+-- 13) ONBELLEK_SURUM (süreç içi önbelleklerin worker'lar arası geçersizleştirilmesi)
+CREATE TABLE onbellek_surum (
+    anahtar VARCHAR(50) PRIMARY KEY,
+    surum BIGINT NOT NULL DEFAULT 0
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- 14) STOK_REZERVASYON (checkout sayfası açıkken süreli stok ayırma)
+CREATE TABLE stok_rezervasyon (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    musteri_id INT NOT NULL,
+    urun_id INT NOT NULL,
+    miktar INT NOT NULL,
+    son_gecerlilik DATETIME NOT NULL,
+    CONSTRAINT fk_rez_urun FOREIGN KEY (urun_id) REFERENCES urun(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE INDEX ix_rez_musteri ON stok_rezervasyon(musteri_id);
+CREATE INDEX ix_rez_sure ON stok_rezervasyon(son_gecerlilik);
+
+-- 15) OLAY_KUTUSU (sipariş yan etkileri için transactional outbox)
+CREATE TABLE olay_kutusu (
+    id BIGINT PRIMARY KEY AUTO_INCREMENT,
+    olay_tipi VARCHAR(30) NOT NULL,
+    yuk JSON NOT NULL,
+    olusturma TIMESTAMP(3) DEFAULT CURRENT_TIMESTAMP(3),
+    durum VARCHAR(10) NOT NULL DEFAULT 'BEKLIYOR',   -- BEKLIYOR / HATALI (yazılamayan olay)
+    deneme INT NOT NULL DEFAULT 0,
+    hata TEXT NULL,
+    INDEX ix_olay_durum (durum, id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- 16) PANEL_SAYAC (yönetim paneli özet sayaçları; anahtar başına parçalı satırlar)
+CREATE TABLE panel_sayac (
+    anahtar VARCHAR(30) NOT NULL,
+    parca TINYINT NOT NULL,
+    deger BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (anahtar, parca)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- 17) URUN_PUAN (onaylı yorumların ürün başına toplamı; yorum ekle/onayla/sil ile güncellenir)
+CREATE TABLE urun_puan (
+    urun_id INT PRIMARY KEY,
+    yorum_sayisi INT NOT NULL DEFAULT 0,
+    puan_toplam INT NOT NULL DEFAULT 0,
+    CONSTRAINT fk_urun_puan_urun FOREIGN KEY (urun_id) REFERENCES urun(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- 18) RAPOR_* (satış raporları için günlük özetler; flask rapor-guncelle ile doldurulur)
+-- İptal/reddedilen siparişler tutarlara dahil edilmez, iptal_sayisi'nda sayılır. Tutarlar TL.
+CREATE TABLE rapor_gunluk (
+    gun DATE PRIMARY KEY,
+    siparis_sayisi INT NOT NULL DEFAULT 0,
+    iptal_sayisi INT NOT NULL DEFAULT 0,
+    kuponlu_siparis INT NOT NULL DEFAULT 0,
+    adet INT NOT NULL DEFAULT 0,
+    brut_ciro DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    indirim DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    net_ciro DECIMAL(14, 2) NOT NULL DEFAULT 0
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE rapor_urun_gunluk (
+    gun DATE NOT NULL,
+    urun_id INT NOT NULL,
+    kategori_id INT NULL,
+    siparis_sayisi INT NOT NULL DEFAULT 0,
+    adet INT NOT NULL DEFAULT 0,
+    ciro DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (gun, urun_id),
+    INDEX ix_rug_urun (urun_id, gun),
+    INDEX ix_rug_kategori (kategori_id, gun)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE rapor_kupon_gunluk (
+    gun DATE NOT NULL,
+    kupon_kodu VARCHAR(20) NOT NULL,
+    siparis_sayisi INT NOT NULL DEFAULT 0,
+    indirim DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    net_ciro DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (gun, kupon_kodu)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- Artımlı güncelleme filigranı (son işlenen sipariş id'si)
+CREATE TABLE rapor_isaret (
+    anahtar VARCHAR(30) PRIMARY KEY,
+    deger BIGINT NOT NULL DEFAULT 0,
+    guncelleme TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- 19) URETIM_PLANI (gece çalışan talep tahmininden ertesi gün üretim önerisi; flask uretim-plani)
+CREATE TABLE uretim_plani (
+    plan_tarihi DATE NOT NULL,
+    urun_id INT NOT NULL,
+    tahmin DECIMAL(10, 2) NOT NULL DEFAULT 0,
+    guvenlik_payi DECIMAL(10, 2) NOT NULL DEFAULT 0,
+    hedef_stok INT NOT NULL DEFAULT 0,
+    mevcut_stok INT NOT NULL DEFAULT 0,
+    kritik_seviye INT NOT NULL DEFAULT 0,
+    onerilen_uretim INT NOT NULL DEFAULT 0,
+    olusturma TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (plan_tarihi, urun_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- 20) *_ARSIV (ufuktan eski denetim kayıtları; flask denetim-arsivle / arka plan işi taşır)
+-- Sıcak tabloyla aynı id'ler korunur; yabancı anahtar ve olay_anahtari yok, satırlar sıkıştırılmış.
+CREATE TABLE siparis_durum_log_arsiv (
+    id INT PRIMARY KEY,
+    siparis_id INT NOT NULL,
+    eski_durum VARCHAR(20),
+    yeni_durum VARCHAR(20),
+    degistiren_id INT NOT NULL,
+    aciklama VARCHAR(255),
+    tarih TIMESTAMP NULL,
+    INDEX ix_loga_siparis (siparis_id),
+    INDEX ix_loga_degistiren (degistiren_id, tarih, id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 ROW_FORMAT=COMPRESSED;
+
+CREATE TABLE stok_hareketi_arsiv (
+    id INT PRIMARY KEY,
+    urun_id INT NOT NULL,
+    siparis_id INT NULL,
+    hareket_tipi VARCHAR(20) NOT NULL,
+    miktar INT NOT NULL,
+    aciklama TEXT,
+    yapan_id INT NOT NULL,
+    created_at TIMESTAMP NULL,
+    INDEX ix_sha_siparis (siparis_id),
+    INDEX ix_sha_yapan (yapan_id, created_at, id),
+    INDEX ix_sha_urun (urun_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 ROW_FORMAT=COMPRESSED;
 
 -- =========================
 -- SEED VERİ
@@ -199,6 +358,10 @@ INSERT INTO kullanici (id, k_adi, sifre, ad, soyad, telefon, email, rol, aktif)
     (4, 'kurye3', '123', 'Ali', 'Kaya', '5551110003', 'kurye3@firin.com', 'KURYE', 1),
     (5, 'kurye4', '123', 'Burak', 'Çelik', '5551110004', 'kurye4@firin.com', 'KURYE', 1);
 
+-- Otomatik kurye atamasının loglarda göründüğü hesap (giriş kapalı), bkz. dispatch_config
+INSERT INTO kullanici (id, k_adi, sifre, ad, soyad, telefon, email, rol, aktif) VALUES
+    (9, 'sistem', '!', 'Otomatik', 'Sistem', NULL, NULL, 'SISTEM', 0);
+
 INSERT INTO kullanici (id, k_adi, sifre, ad, soyad, telefon, email, rol, aktif) VALUES
     (10, 'musteri1', '123', 'Ahmet', 'Yılmaz', '5552000001', 'musteri1@firin.com', 'MUSTERI', 1),
     (11, 'musteri2', '123', 'Ayşe', 'Demir', '5552000002', 'musteri2@firin.com', 'MUSTERI', 1),
@@ -499,6 +662,13 @@ WHERE s.durum IN ('TESLIM_EDILDI', 'ONAYLANDI')
 GROUP BY s.id
 LIMIT 50;
 
+-- Puan toplamları (sonradan tutarlılık için: flask urun-puan-duzelt)
+INSERT INTO urun_puan (urun_id, yorum_sayisi, puan_toplam)
+SELECT urun_id, COUNT(*), SUM(puan)
+FROM yorum
+WHERE onay_durumu = 1
+GROUP BY urun_id;
+
 -- Örnek sepet: ilk 5 müşteri için 2 ürün
 INSERT INTO sepet (musteri_id, urun_id, adet) VALUES
     (10, 4, 2), (10, 13, 1),
@@ -506,3 +676,54 @@ INSERT INTO sepet (musteri_id, urun_id, adet) VALUES
     (12, 7, 1), (12, 24, 2),
     (13, 10, 1), (13, 23, 1),
     (14, 19, 2), (14, 13, 1);
+
+-- =========================
+-- MESAJ KONUŞMALARI
+-- =========================
+-- mesajlar tablosu uygulamanın mevcut tablosudur; yoksa burada oluşturulur.
+-- Mevcut kurulumlarda sadece aşağıdaki konusma tabloları ve ALTER çalıştırılıp
+-- ardından `flask mesaj-konusmalari-olustur` ile eski mesajlar konuşmalara bağlanır.
+CREATE TABLE IF NOT EXISTS mesajlar (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    gonderen_id INT NOT NULL,
+    gonderen_rol VARCHAR(10) NOT NULL,
+    alici_id INT NOT NULL,
+    alici_rol VARCHAR(10) NOT NULL,
+    konu VARCHAR(255),
+    mesaj TEXT,
+    tarih TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    durum VARCHAR(20) DEFAULT 'BEKLIYOR',
+    silindi_gonderen BOOLEAN DEFAULT FALSE,
+    silindi_alici BOOLEAN DEFAULT FALSE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE konusma (
+    id INT PRIMARY KEY AUTO_INCREMENT,
+    konu VARCHAR(255),
+    son_mesaj_id INT NULL,
+    son_mesaj_tarihi TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    olusturma TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- Her konuşmada iki satır: katılımcı başına okunmamış sayacı ve son okunan mesaj
+CREATE TABLE konusma_katilimci (
+    konusma_id INT NOT NULL,
+    katilimci_rol VARCHAR(10) NOT NULL,
+    katilimci_id INT NOT NULL,
+    karsi_rol VARCHAR(10) NOT NULL,
+    karsi_id INT NOT NULL,
+    okunmamis INT NOT NULL DEFAULT 0,
+    son_okunan_id INT NOT NULL DEFAULT 0,
+    son_mesaj_tarihi TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    silindi BOOLEAN NOT NULL DEFAULT FALSE,
+    PRIMARY KEY (konusma_id, katilimci_rol, katilimci_id),
+    CONSTRAINT fk_kk_konusma FOREIGN KEY (konusma_id) REFERENCES konusma(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- Gelen kutusu (tüm konuşmalar / yönetici için karşı role göre sekme) keyset sayfalama
+CREATE INDEX ix_kk_kutu ON konusma_katilimci(katilimci_rol, katilimci_id, silindi, son_mesaj_tarihi, konusma_id);
+CREATE INDEX ix_kk_kutu_rol ON konusma_katilimci(katilimci_rol, katilimci_id, karsi_rol, silindi, son_mesaj_tarihi, konusma_id);
+
+ALTER TABLE mesajlar
+    ADD COLUMN konusma_id INT NULL,
+    ADD INDEX ix_mesaj_konusma (konusma_id, id);